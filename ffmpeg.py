@@ -16,38 +16,71 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os, subprocess, tempfile
+import sys, os, re, tempfile, shutil, json, threading
 
 from ffmpeg_logger import FFmpegLogger
 from ffmpeg_videoproperties import FFmpegVideoProperties
+from ffmpeg_encodingprofile import FFmpegEncodingProfile
+from ffmpeg_cache import FFmpegCache
+from ffmpeg_progress import FFmpegProgress
+from ffmpeg_tracer import FFmpegTracer
+from ffmpeg_runner import FFmpegRunner
 
 class FFmpeg:
-    def __init__(self, logger):
+    def __init__(self, logger, threads = 0, cache = None, profile = None, progress = None, \
+                 runner = None):
         self.logger = logger
+        # maximum number of threads for encoding, 0 lets ffmpeg decide
+        self.threads = threads
+        # encoding settings used whenever a video is re-encoded
+        self.profile = profile if profile else FFmpegEncodingProfile(logger)
+        # artifact cache for probe results and extracted streams
+        self.cache = cache if cache else FFmpegCache(logger)
+        # reports the progress of long running commands
+        self.progress = progress if progress \
+                                 else FFmpegProgress(logger, FFmpegProgress.mode_off)
+        # runs all subprocesses, the methods running ffmpeg or ffprobe are coroutines
+        # named after the method with an _async suffix, which may run simultaneously
+        self.runner = runner if runner else FFmpegRunner(logger)
         
         self.__ffprobeexe = ""
         self.__ffmpegexe = ""
+        self.__versions = {}
+        self.__probe_cache = {}
+        self.__probe_lock = threading.Lock()
         
         self.__find_ffprobe_executable()
         self.__find_ffmpeg_executable()
 
 
     def _run_command(self, args):
-        retval = True
-        output = ""
+        return self.runner.run_command(args)
+
+
+    # description: run an ffmpeg or ffprobe command as a coroutine
+    # parameters : args : the command and its arguments
+    #              inputdata : an iterable of bytes objects to write to the standard
+    #                          input, or None
+    #              label : the name of the command in the progress reports, None to
+    #                      run the command without reporting its progress
+    #              duration : the duration of the output in seconds, 0 if unknown
+    # returns    : True if successful and the output, which is empty when the progress
+    #              is reported
+    async def _run_command_async(self, args, inputdata = None, label = None, duration = 0):
+        if label is None or not self.progress.is_enabled():
+            return await self.runner.run(args, inputdata)
+
+        # ffmpeg writes its progress to the standard output and no statistics to stderr
+        args = args[:1] + [ "-nostats", "-progress", "pipe:1" ] + args[1:]
+        task = self.progress.start_task(label, duration)
+        retval = False
         try:
-            self.logger.log("Running command: " + subprocess.list2cmdline(args))
-            process = subprocess.run(args, \
-                                     stdout = subprocess.PIPE, \
-                                     check = True, \
-                                     universal_newlines = True)
-            process.check_returncode()
-            output = process.stdout
-        except subprocess.CalledProcessError as e:
-            self.logger.error("Command failed, return code = " + str(e.returncode))
-            retval = False
-        
-        return retval, output
+            retval, output = await self.runner.run(args, inputdata, \
+                                                   stdout_callback = task.parse_line)
+        finally:
+            self.progress.finish_task(task, retval)
+
+        return retval, ""
 
 
     def __set_ffprobe_executable(self, ffprobeexe):
@@ -58,14 +91,14 @@ class FFmpeg:
     def __find_ffprobe_executable(self):
         self.logger.log("Checking installation of ffprobe")
         
-        retval, output = self._run_command(["which", "ffprobe"])
+        output = shutil.which("ffprobe")
 
-        if retval:
+        if output:
             self.__set_ffprobe_executable(output)
         else:
             self.logger.error("ffprobe not found")
         
-        return retval
+        return output is not None
 
 
     def __set_ffmpeg_executable(self, ffmpegexe):
@@ -76,14 +109,14 @@ class FFmpeg:
     def __find_ffmpeg_executable(self):
         self.logger.log("Checking installation of ffmpeg")
         
-        retval, output = self._run_command(["which", "ffmpeg"])
+        output = shutil.which("ffmpeg")
 
-        if retval:
+        if output:
             self.__set_ffmpeg_executable(output)
         else:
             self.logger.error("ffmpeg not found")
         
-        return retval
+        return output is not None
 
 
     def get_ffprobe_executable(self):
@@ -98,21 +131,83 @@ class FFmpeg:
         return self.__ffmpegexe
 
 
+    # description: get the version of ffmpeg or ffprobe, part of the key of cached
+    #              artifacts so a different version never reuses them
+    # parameters : executable : the path of ffmpeg or ffprobe
+    # returns    : the first line of the version information
+    async def get_version_async(self, executable):
+        if executable not in self.__versions:
+            retval, output = await self._run_command_async([ executable, "-version" ])
+            self.__versions[executable] = output.split('\n')[0] if retval else ""
+        return self.__versions[executable]
+
+
+    # description: blocking version of get_version_async()
+    def get_version(self, executable):
+        return self.runner.run_sync(self.get_version_async(executable))
+
+
+    # description: probe all streams of a video file in a single ffprobe call
+    #              the result is cached in memory and in the artifact cache
+    # parameters : filename : the video file to probe
+    #              usecache : False for a temporary file, which is not cached
+    # returns    : True if successful and an instance of FFmpegVideoProperties
+    async def probe_async(self, filename, usecache = True):
+        with self.__probe_lock:
+            if usecache and filename in self.__probe_cache:
+                return True, self.__probe_cache[filename]
+
+        self.logger.log("Probing " + filename)
+
+        version = await self.get_version_async(self.get_ffprobe_executable())
+        key = self.cache.get_key(filename, version) \
+                    if usecache and self.cache.is_enabled() else None
+        probedata = self.cache.read_json("probe", key) if key else None
+
+        retval = True
+        if probedata is None:
+            retval, output = await self._run_command_async([
+                self.get_ffprobe_executable(),
+                filename,
+                "-v", str(self.logger.get_ffmpeg_verbosity()),
+                "-print_format", "json",
+                "-show_format",
+                "-show_streams"])
+
+            if retval:
+                try:
+                    probedata = json.loads(output)
+                except ValueError:
+                    self.logger.error("Could not parse ffprobe output")
+                    retval = False
+
+            if retval and key:
+                self.cache.write_json("probe", key, probedata)
+
+        vp = FFmpegVideoProperties(self.logger)
+        if retval:
+            vp.parse(probedata)
+            if usecache:
+                with self.__probe_lock:
+                    self.__probe_cache[filename] = vp
+
+        return retval, vp
+
+
+    # description: blocking version of probe_async()
+    def probe(self, filename, usecache = True):
+        return self.runner.run_sync(self.probe_async(filename, usecache))
+
+
     # description: check if a video file is created by GoPro
     # parameters : filename : the video file to check
     # returns    : True when GoPro signature is found
-    def is_created_by_gopro(self, filename):
+    async def is_created_by_gopro_async(self, filename):
         self.logger.log("Checking GoPro signature in " + filename)
         
-        retval, output = self._run_command([
-            self.get_ffprobe_executable(),
-            filename,
-            "-v", str(self.logger.get_ffmpeg_verbosity()),
-            "-select_streams", "v:0",
-            "-print_format", "flat",
-            "-show_entries", "stream_tags=encoder"])
+        retval, vp = await self.probe_async(filename)
         
-        if retval and "GoPro" in str(output):
+        if retval and "GoPro" in vp.encoder:
             self.logger.log("GoPro signature found")
         else:
             self.logger.log("GoPro signature not found")
@@ -121,20 +216,20 @@ class FFmpeg:
         return retval
 
 
+    # description: blocking version of is_created_by_gopro_async()
+    def is_created_by_gopro(self, filename):
+        return self.runner.run_sync(self.is_created_by_gopro_async(filename))
+
+
     # description: check if a video file contains GoPro telemetry data 
     # parameters : filename : the video file to check
     # returns    : True when telemetry data is found
-    def contains_gopro_telemetry(self, filename):
+    async def contains_gopro_telemetry_async(self, filename):
         self.logger.log("Checking availability of GoPro telemetry data in " + filename)
         
-        retval, output = self._run_command([
-            self.get_ffprobe_executable(),
-            filename,
-            "-v", str(self.logger.get_ffmpeg_verbosity()),
-            "-print_format", "flat",
-            "-show_entries", "stream=codec_tag_string"])
+        retval, vp = await self.probe_async(filename)
         
-        if retval and "gpmd" in str(output):
+        if retval and vp.telemetry_stream is not None:
             self.logger.log("Telemetry data found")
         else:
             self.logger.log("Telemetry data not found")
@@ -143,20 +238,18 @@ class FFmpeg:
         return retval
 
 
-    def __get_telemetry_stream_number(self, filename):
+    # description: blocking version of contains_gopro_telemetry_async()
+    def contains_gopro_telemetry(self, filename):
+        return self.runner.run_sync(self.contains_gopro_telemetry_async(filename))
+
+
+    async def __get_telemetry_stream_number(self, filename):
         self.logger.log("Fetching telemetry data stream number from " + filename)
         
-        retval, output = self._run_command([
-            self.get_ffprobe_executable(),
-            filename,
-            "-v", str(self.logger.get_ffmpeg_verbosity()),
-            "-print_format", "flat",
-            "-show_entries", "stream=codec_tag_string"])
+        retval, vp = await self.probe_async(filename)
         
-        if retval:
-            streamlist = str(output).split('\n')
-            gpmdstreamlist = [s for s in streamlist if "gpmd" in s]
-            gpmdstream = gpmdstreamlist[0].split('.codec')[0][-1]
+        if retval and vp.telemetry_stream is not None:
+            gpmdstream = str(vp.telemetry_stream)
             
             self.logger.log("Telemetry found at stream 0:" + gpmdstream)
         
@@ -174,17 +267,17 @@ class FFmpeg:
     #              outfilename : the filename where the telemetry data should be written
     #              overwrite : if True then outfilename will always be overwritten
     # returns    : True when telemetry data is found and could be extracted
-    def fetch_telemetry_stream(self, infilename, outfilename, overwrite = False):
+    async def fetch_telemetry_stream_async(self, infilename, outfilename, overwrite = False):
         self.logger.log("Extracting telemetry data from " + infilename)
         
         retval = True
         if not overwrite and os.path.exists(outfilename):
             self.logger.log("Telemetry file already exists, skipping")
         else:
-            retval, gpmdstream = self.__get_telemetry_stream_number(infilename)
+            retval, gpmdstream = await self.__get_telemetry_stream_number(infilename)
 
             if retval:
-                retval, output = self._run_command([
+                retval, output = await self._run_command_async([
                     self.get_ffmpeg_executable(),
                     "-v", str(self.logger.get_ffmpeg_verbosity()),
                     "-y",
@@ -193,29 +286,97 @@ class FFmpeg:
                     "-map", "0:" + gpmdstream,
                     "-f", "rawvideo",
                     outfilename])
+                self.logger.add_file_written(outfilename)
         
         return retval
 
 
+    # description: blocking version of fetch_telemetry_stream_async()
+    def fetch_telemetry_stream(self, infilename, outfilename, overwrite = False):
+        return self.runner.run_sync(self.fetch_telemetry_stream_async(infilename, \
+                                                                      outfilename, overwrite))
+
+
+    # description: extract GoPro telemetry data from a video file through a pipe, nothing
+    #              is written to disk
+    # remarks    : the video file should contain telemetry data, test first with
+    #              is_created_by_gopro() and contains_gopro_telemetry()
+    # parameters : infilename : the video file containing telemetry data
+    #              callback : called with each chunk of telemetry data as bytes, as soon
+    #                         as ffmpeg writes it
+    # returns    : True when telemetry data is found and could be extracted
+    async def read_telemetry_stream_async(self, infilename, callback):
+        self.logger.log("Reading telemetry data from " + infilename)
+
+        retval, gpmdstream = await self.__get_telemetry_stream_number(infilename)
+
+        if retval:
+            retval, output = await self.runner.run([
+                self.get_ffmpeg_executable(),
+                "-v", str(self.logger.get_ffmpeg_verbosity()),
+                "-i", infilename,
+                "-codec", "copy",
+                "-map", "0:" + gpmdstream,
+                "-f", "rawvideo",
+                "pipe:1"], stdout_callback = callback, stdout_binary = True)
+
+        return retval
+
+
+    # description: blocking version of read_telemetry_stream_async()
+    def read_telemetry_stream(self, infilename, callback):
+        return self.runner.run_sync(self.read_telemetry_stream_async(infilename, callback))
+
+
+    # description: get the key of an artifact derived from the telemetry of a video file
+    # parameters : infilename : the video file containing telemetry data
+    #              dependencies : anything else the artifact depends on
+    # returns    : the key in the artifact cache
+    async def get_telemetry_key_async(self, infilename, *dependencies):
+        version = await self.get_version_async(self.get_ffmpeg_executable())
+        return self.cache.get_key(infilename, version, *dependencies)
+
+
+    # description: blocking version of get_telemetry_key_async()
+    def get_telemetry_key(self, infilename, *dependencies):
+        return self.runner.run_sync(self.get_telemetry_key_async(infilename, *dependencies))
+
+
+    # description: extract GoPro telemetry data from a video file into the artifact cache
+    #              the extraction is skipped when the telemetry is cached already
+    # parameters : infilename : the video file containing telemetry data
+    # returns    : True if successful and the filename of the telemetry data
+    async def fetch_cached_telemetry_stream_async(self, infilename):
+        key = await self.get_telemetry_key_async(infilename, "gpmd")
+        outfilename = self.cache.lookup("gpmd", key, ".bin")
+        if outfilename:
+            return True, outfilename
+
+        tempfilename = self.cache.create_tempfile("gpmd", ".bin")
+        if await self.fetch_telemetry_stream_async(infilename, tempfilename, True):
+            return True, self.cache.commit(tempfilename, "gpmd", key, ".bin")
+        else:
+            self.cache.discard(tempfilename)
+            return False, None
+
+
+    # description: blocking version of fetch_cached_telemetry_stream_async()
+    def fetch_cached_telemetry_stream(self, infilename):
+        return self.runner.run_sync(self.fetch_cached_telemetry_stream_async(infilename))
+
+
     # description: get framerate, duration, width and height from a video file
     # parameters : filename : the video file of which the parameters should be fetched
     # returns    : True if successful and an instance of FFmpegVideoProperties
-    def get_video_properties(self, filename):
+    async def get_video_properties_async(self, filename):
         self.logger.log("Fetching video properties of " + filename)
         
-        retval, output = self._run_command([
-            self.get_ffprobe_executable(),
-            filename,
-            "-v", str(self.logger.get_ffmpeg_verbosity()),
-            "-select_streams", "v:0",
-            "-print_format", "flat",
-            "-show_entries", "stream=r_frame_rate,duration,width,height"])
-        
-        vp = FFmpegVideoProperties(self.logger)
-        if retval:
-            vp.parse(str(output))
-                        
-        return retval, vp
+        return await self.probe_async(filename)
+
+
+    # description: blocking version of get_video_properties_async()
+    def get_video_properties(self, filename):
+        return self.runner.run_sync(self.get_video_properties_async(filename))
 
 
     # description: rescales a video file
@@ -226,25 +387,32 @@ class FFmpeg:
     #              outfilename : the resulting video file
     #              overwrite : if True then outfilename will always be overwritten
     # returns    : True if successful
-    def rescale_video(self, infilename, newscale, outfilename, overwrite = False):
+    async def rescale_video_async(self, infilename, newscale, outfilename, overwrite = False):
         self.logger.log("Rescaling " + infilename)
         
         retval = True
         if not overwrite and os.path.exists(outfilename):
             self.logger.log("Output file already exists, skipping")
         else:
-            retval, output = self._run_command([
+            retval, output = await self._run_command_async([
                 self.get_ffmpeg_executable(),
                 "-v", str(self.logger.get_ffmpeg_verbosity()),
                 "-y",
                 "-i", infilename,
                 "-vf", "scale=" + newscale,
-                "-c:a", "copy",
-                outfilename])
+                "-c:a", "copy" ] + \
+                self.profile.get_ffmpeg_params(self.threads) + \
+                [ outfilename ])
                         
         return retval
 
 
+    # description: blocking version of rescale_video_async()
+    def rescale_video(self, infilename, newscale, outfilename, overwrite = False):
+        return self.runner.run_sync(self.rescale_video_async(infilename, newscale, \
+                                                             outfilename, overwrite))
+
+
     # description: extracts a section from a video file
     # parameters : infilename : the video file where the section will be extracted from
     #              start_hh,
@@ -260,7 +428,7 @@ class FFmpeg:
     #              outfilename : the resulting video file
     #              overwrite : if True then outfilename will always be overwritten
     # returns    : True if successful
-    def extract_section_from_video(self, \
+    async def extract_section_from_video_async(self, \
                     infilename, start_hh, start_mi, start_ss, \
                     duration_hh, duration_mi, duration_ss, \
                     outfilename, overwrite = False):
@@ -270,7 +438,7 @@ class FFmpeg:
         if not overwrite and os.path.exists(outfilename):
             self.logger.log("Output file already exists, skipping")
         else:
-            retval, output = self._run_command([
+            retval, output = await self._run_command_async([
                 self.get_ffmpeg_executable(),
                 "-v", str(self.logger.get_ffmpeg_verbosity()),
                 "-y",
@@ -278,21 +446,160 @@ class FFmpeg:
                 "-ss", "{:02d}:{:02d}:00.000".format(start_hh, max(0, start_mi - 1)),
                 "-i", infilename,
                 "-ss", "00:{:02d}:{:06.3f}".format(min(start_mi, 1), start_ss),
-                "-t", "{:02d}:{:02d}:{:06.3f}".format(duration_hh, duration_mi, duration_ss),
-                #"-c", "copy",
-                outfilename])
+                "-t", "{:02d}:{:02d}:{:06.3f}".format(duration_hh, duration_mi, duration_ss) ] + \
+                #[ "-c", "copy" ] + \
+                self.profile.get_ffmpeg_params(self.threads) + \
+                [ outfilename ])
         
         return retval
 
 
+    # description: blocking version of extract_section_from_video_async()
+    def extract_section_from_video(self, \
+                    infilename, start_hh, start_mi, start_ss, \
+                    duration_hh, duration_mi, duration_ss, \
+                    outfilename, overwrite = False):
+        return self.runner.run_sync(self.extract_section_from_video_async( \
+                    infilename, start_hh, start_mi, start_ss, \
+                    duration_hh, duration_mi, duration_ss, \
+                    outfilename, overwrite))
+
+
+    # description: get the time of all keyframes of the video stream, the packets are
+    #              read without decoding them
+    # parameters : infilename : the video file
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    # returns    : True if successful and a sorted list of keyframe times in seconds
+    async def get_keyframes_async(self, infilename, inputparams = []):
+        self.logger.log("Fetching keyframes of " + infilename)
+
+        # a concat list is a temporary file, only the keyframes of a video are cached
+        version = await self.get_version_async(self.get_ffprobe_executable())
+        key = self.cache.get_key(infilename, version) \
+                    if self.cache.is_enabled() and not inputparams else None
+        keyframes = self.cache.read_json("keyframes", key) if key else None
+        if keyframes is not None:
+            return True, keyframes
+
+        retval, output = await self._run_command_async([
+            self.get_ffprobe_executable(),
+            "-v", str(self.logger.get_ffmpeg_verbosity()),
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags",
+            "-print_format", "csv=print_section=0" ] + \
+            inputparams + \
+            [ "-i", infilename ])
+
+        keyframes = []
+        if retval:
+            for line in output.splitlines():
+                fields = line.strip().split(',')
+                if len(fields) >= 2 and 'K' in fields[1] and fields[0] not in ('', 'N/A'):
+                    keyframes.append(float(fields[0]))
+            keyframes.sort()
+            self.logger.log("Found %d keyframes" % len(keyframes))
+
+            if key:
+                self.cache.write_json("keyframes", key, keyframes)
+
+        return retval, keyframes
+
+
+    # description: blocking version of get_keyframes_async()
+    def get_keyframes(self, infilename, inputparams = []):
+        return self.runner.run_sync(self.get_keyframes_async(infilename, inputparams))
+
+
+    # description: split a video file in segments without re-encoding
+    #              each segment starts on the first keyframe after the requested time
+    # parameters : infilename : the video file to be split
+    #              split_times : a list of timestamps in seconds where the video should
+    #                            be split
+    #              outdir : the directory where the segments will be written
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    #              segmentformat : the container of the segments, mp4 or mpegts, in an
+    #                              MPEG-TS segment the parameter sets of the video codec
+    #                              are repeated in the stream
+    # returns    : True if successful and a list of (filename, start_time, end_time)
+    async def split_video_async(self, infilename, split_times, outdir, inputparams = [], \
+                                segmentformat = "mp4"):
+        self.logger.log("Splitting %s in %d segments" % (infilename, len(split_times) + 1))
+
+        segmentlist = os.path.join(outdir, "segments.csv")
+        args = [ self.get_ffmpeg_executable(),
+                 "-v", str(self.logger.get_ffmpeg_verbosity()),
+                 "-y" ] + \
+               inputparams + \
+               [ "-i", infilename,
+                 "-map", "0:v:0",
+                 "-map", "0:a?",
+                 "-c", "copy",
+                 "-f", "segment",
+                 "-segment_format", segmentformat,
+                 "-reset_timestamps", "1",
+                 "-segment_list", segmentlist,
+                 "-segment_list_type", "csv" ]
+        if split_times:
+            args = args + [ "-segment_times", \
+                            ",".join([ "{0:.3f}".format(t) for t in split_times ]) ]
+        args.append(os.path.join(outdir, "segment_%03d." + \
+                                         ("ts" if segmentformat == "mpegts" else "mp4")))
+
+        retval, output = await self._run_command_async(args)
+
+        segments = []
+        if retval:
+            with open(segmentlist) as f:
+                for line in f:
+                    fields = line.strip().split(',')
+                    if len(fields) == 3:
+                        segments.append((os.path.join(outdir, fields[0]), \
+                                         float(fields[1]), float(fields[2])))
+                        self.logger.add_file_written(segments[-1][0])
+            self.logger.log("Created %d segments" % len(segments))
+
+        return retval, segments
+
+
+    # description: blocking version of split_video_async()
+    def split_video(self, infilename, split_times, outdir, inputparams = [], \
+                    segmentformat = "mp4"):
+        return self.runner.run_sync(self.split_video_async(infilename, split_times, outdir, \
+                                                           inputparams, segmentformat))
+
+
+    # description: get the ffmpeg input options to read a list written by
+    #              write_concat_list() as a single video, without re-encoding
+    def get_concat_input_params(self):
+        return [ "-f", "concat", "-safe", "0" ]
+
+
+    # description: write a list of video files for the concat demuxer of ffmpeg
+    # parameters : f : an open file object, it is closed afterwards
+    #              infilenames : a list of video files
+    #              durations : the duration of each file in seconds, None to take it from
+    #                          the files
+    def write_concat_list(self, f, infilenames, durations = None):
+        with f:
+            for index, filename in enumerate(infilenames):
+                # quote the filename, a single quote is escaped outside the quotes
+                f.write("file '" + os.path.abspath(filename).replace("'", "'\\''") + "'\n")
+                if durations:
+                    f.write("duration {0:.6f}\n".format(durations[index]))
+
+
     # description: concatenate two or more video files
     # parameters : infilenames : a list of video files
     #                            if the filenames don't start with / then a relative
     #                            path is assumed
     #              outfilename : the resulting video file
     #              overwrite : if True then outfilename will always be overwritten
+    #              durations : the duration of each file in seconds, None to take it from
+    #                          the files
+    #              outputparams : a list of additional ffmpeg output options
     # returns    : True if successful
-    def concat_video(self, infilenames, outfilename, overwrite = False):
+    async def concat_video_async(self, infilenames, outfilename, overwrite = False, \
+                                 durations = None, outputparams = []):
         self.logger.log("Concatenating files %s to %s" % (", ".join(infilenames), outfilename))
 
         retval = True
@@ -302,20 +609,18 @@ class FFmpeg:
             self.logger.log("Creating temporary concatenation file")
             (fd, concattempfile) = tempfile.mkstemp(prefix = "class_ffmpeg_concat_video", \
                                                     suffix = ".list")
-            f = os.fdopen(fd, 'w')
-            for filename in infilenames:
-                f.write("file " + os.path.abspath(filename) + "\n")
-            f.close()
+            self.write_concat_list(os.fdopen(fd, 'w'), infilenames, durations)
             
-            retval, output = self._run_command([
+            retval, output = await self._run_command_async([
                 self.get_ffmpeg_executable(),
                 "-v", str(self.logger.get_ffmpeg_verbosity()),
-                "-y",
-                "-f", "concat",
-                "-safe", "0",
-                "-i", concattempfile,
-                "-c", "copy",
-                outfilename])
+                "-y" ] + \
+                self.get_concat_input_params() + \
+                [ "-i", concattempfile,
+                  "-c", "copy" ] + \
+                outputparams + \
+                [ outfilename ])
+            self.logger.add_file_written(outfilename)
 
             # remove temp file
             if concattempfile and os.path.isfile(concattempfile):
@@ -325,64 +630,141 @@ class FFmpeg:
         return retval
 
 
+    # description: blocking version of concat_video_async()
+    def concat_video(self, infilenames, outfilename, overwrite = False, durations = None, \
+                     outputparams = []):
+        return self.runner.run_sync(self.concat_video_async(infilenames, outfilename, \
+                                                            overwrite, durations, \
+                                                            outputparams))
+
+
+    # description: group the chapters of GoPro recordings according to the GoPro
+    #              naming scheme, a long recording is split in chapters of about 4 GB
+    # parameters : filenames : a list of video files
+    # returns    : a list of recordings, each one a list of its chapters in order
+    #              files which don't follow the naming scheme are a recording on their own
+    def get_gopro_chapters(self, filenames):
+        recordings = {}
+        for filename in filenames:
+            basename = os.path.basename(filename).upper()
+            # https://gopro.com/help/articles/question_answer/GoPro-Camera-File-Naming-Convention
+            # Camera Models: HD HERO2, HERO3, HERO3+, HERO (2014), HERO Session,
+            # HERO4, HERO5 Black, HERO5 Session: GOPRxxxx.MP4, GP01xxxx.MP4, ...
+            match = re.match(r'^(GOPR|GP(\d\d))(\d{4})\.MP4$', basename)
+            if match:
+                key = ("GP", os.path.dirname(filename), match.group(3))
+                chapter = int(match.group(2)) if match.group(2) else 0
+            else:
+                # Camera Models: HERO6 Black and later: GH01xxxx.MP4, GH02xxxx.MP4, ...
+                # or GX for HEVC encoded video
+                match = re.match(r'^(G[HX])(\d\d)(\d{4})\.MP4$', basename)
+                if match:
+                    key = (match.group(1), os.path.dirname(filename), match.group(3))
+                    chapter = int(match.group(2))
+                else:
+                    key = (filename,)
+                    chapter = 0
+            recordings.setdefault(key, []).append((chapter, filename))
+
+        return [ [ filename for (chapter, filename) in sorted(chapters) ] \
+                    for chapters in recordings.values() ]
+
+
     # description: concatenate GoPro video files according to the GoPro naming scheme
     #              the resulting files are name __GPxxxx.MP4
     # parameters : inputdir : the path to search for video files
     #              cleanup : original video files will be removed if this parameter is set
     #              overwrite : if True then outfilename will always be overwritten
     # returns    : True if successful
-    def gopro_concat_video(self, inputdir, cleanup = False, overwrite = False):
+    async def gopro_concat_video_async(self, inputdir, cleanup = False, overwrite = False):
         self.logger.log("Concatenating GoPro files")
         
-        filelist = sorted(os.listdir(inputdir))
-        
-        # https://gopro.com/help/articles/question_answer/GoPro-Camera-File-Naming-Convention
-        # Camera Models: HD HERO2, HERO3, HERO3+, HERO (2014), HERO Session, 
-        # HERO4, HERO5 Black, HERO5 Session
-        videofilelist = [x for x in filelist if x[:4] == "GOPR" and x[-3:] == "MP4"]
-        # Camera Model: HERO6 Black
-        videofilelist = videofilelist + \
-                        [x for x in filelist if x[:4] in ("GH01", "GX01") and x[-3:] == "MP4"]
-        self.logger.log("Found video files %s" % (", ".join(videofilelist)))
+        filelist = [ os.path.join(inputdir, x) for x in sorted(os.listdir(inputdir)) \
+                        if re.match(r'^(GOPR|GP\d\d|G[HX]\d\d)\d{4}\.MP4$', x.upper()) ]
         
-        comblist = [[y for y in filelist if y[4:8] in x] for x in videofilelist]
-        
-        for filenames in comblist:
-            fullfilename = os.path.join(params.inputdir, filenames[0])
-            newfilename = os.path.join(params.inputdir, "__GP" + filenames[0][4:8] + ".MP4")
+        retval = True
+        for filenames in self.get_gopro_chapters(filelist):
+            self.logger.log("Found video files %s" % (", ".join(filenames)))
+            number = os.path.basename(filenames[0])[-8:-4]
+            newfilename = os.path.join(inputdir, "__GP" + number + ".MP4")
             
             if len(filenames) == 1:
-                self.logger.log("Renaming %s to %s" % (fullfilename, newfilename))
-                os.rename(fullfilename, newfilename)
+                self.logger.log("Renaming %s to %s" % (filenames[0], newfilename))
+                os.rename(filenames[0], newfilename)
             else:
-                self.concat_video(filenames, newfilename, overwrite)
+                retval = await self.concat_video_async(filenames, newfilename, overwrite)
 
                 if retval:
                     if cleanup:
                         self.logger.log("Removing original files")
                         for filename in filenames:
-                            os.remove(os.path.join(params.inputdir, filename))
+                            os.remove(filename)
                 else:
-                    return False
+                    break
         
-        return True
+        return retval
 
 
-    def apply_custom_filter(self, infilename, filterparams, outfilename, overwrite = False):
+    # description: blocking version of gopro_concat_video_async()
+    def gopro_concat_video(self, inputdir, cleanup = False, overwrite = False):
+        return self.runner.run_sync(self.gopro_concat_video_async(inputdir, cleanup, \
+                                                                  overwrite))
+
+
+    # description: apply ffmpeg filters on a video file
+    # parameters : infilename : the video file to be filtered
+    #              filterparams : a list of ffmpeg output options
+    #              outfilename : the resulting video file
+    #              overwrite : if True then outfilename will always be overwritten
+    #              threads : maximum number of threads, None to use the default of
+    #                        this instance
+    #              profile : the encoding profile, None to use the default of this instance
+    #              inputparams : a list of ffmpeg input options, eg to seek in the input
+    #              pipeparams : a list of ffmpeg input options for a second input, which
+    #                           is read from the standard input
+    #              pipedata : an iterable of bytes objects to write to the second input,
+    #                         None if there is no second input
+    #              duration : the duration of the output in seconds, used to report
+    #                         the progress, 0 if unknown
+    # returns    : True if successful
+    async def apply_custom_filter_async(self, infilename, filterparams, outfilename, \
+                                        overwrite = False, threads = None, profile = None, \
+                                        inputparams = [], pipeparams = [], pipedata = None, \
+                                        duration = 0):
         self.logger.log("Applying custom filter on %s to %s" % (infilename, outfilename))
 
+        if threads is None:
+            threads = self.threads
+        if profile is None:
+            profile = self.profile
+
         retval = True
         if not overwrite and os.path.exists(outfilename):
             self.logger.log("Output file already exists, skipping")
         else:
             cmd = [ self.get_ffmpeg_executable(),
                     "-v", str(self.logger.get_ffmpeg_verbosity()),
-                    "-y",
-                    "-i", infilename ] + \
+                    "-y" ] + \
+                  inputparams + \
+                  [ "-i", infilename ] + \
+                  (pipeparams + [ "-i", "pipe:0" ] if pipedata is not None else []) + \
                   filterparams + \
+                  profile.get_ffmpeg_params(threads) + \
                   [ outfilename ]
             
-            retval, output = self._run_command(cmd)
+            retval, output = await self._run_command_async(cmd, pipedata, \
+                                                           os.path.basename(outfilename), \
+                                                           duration)
+            self.logger.add_file_written(outfilename)
         
         return retval
 
+
+    # description: blocking version of apply_custom_filter_async()
+    def apply_custom_filter(self, infilename, filterparams, outfilename, overwrite = False, \
+                            threads = None, profile = None, inputparams = [], \
+                            pipeparams = [], pipedata = None, duration = 0):
+        return self.runner.run_sync( \
+                    self.apply_custom_filter_async(infilename, filterparams, outfilename, \
+                                                   overwrite, threads, profile, inputparams, \
+                                                   pipeparams, pipedata, duration))
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+# class FFmpeg -- python interface to the ffmpeg command
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, json, time, hashlib, tempfile, threading
+
+# Stores artifacts derived from an input file, such as probe results or extracted
+# streams. The key of an artifact is a hash of the identity of the input file (path,
+# size and modification time) and of everything else the artifact depends on, like
+# the version of the tools which created it, so a changed input or tool never returns
+# stale data. Artifacts are written to a temporary file and renamed when complete, so
+# multiple processes can share the cache directory. When the cache grows beyond its
+# maximum size the least recently used artifacts are removed. The size of the cache
+# is measured once and then estimated from the stored artifacts, it is only measured
+# again when the estimate exceeds the maximum size or after a number of commits, since
+# other jobs sharing the cache directory store artifacts as well.
+class FFmpegCache:
+    # artifacts used this recently are never evicted, another job may be reading them
+    graceperiod = 60
+    # number of commits after which the size of the cache is measured again
+    rescaninterval = 100
+
+    def __init__(self, logger, cachedir = "", maxsize = 0):
+        self.logger = logger
+        # cache directory, empty to disable the cache
+        self.cachedir = cachedir
+        # maximum size of the cache in bytes, 0 for unlimited
+        self.maxsize = maxsize
+
+        # estimated size of the cache in bytes, None until it is measured
+        self.__size = None
+        self.__commits = 0
+        self.__lock = threading.Lock()
+
+
+    def is_enabled(self):
+        return bool(self.cachedir)
+
+
+    # description: get the key of an artifact
+    # parameters : filename : the input file the artifact is derived from
+    #              dependencies : anything else the artifact depends on
+    # returns    : a hexadecimal hash
+    def get_key(self, filename, *dependencies):
+        stat = os.stat(filename)
+        identity = [ os.path.abspath(filename), str(stat.st_size), str(stat.st_mtime_ns) ] + \
+                   [ str(d) for d in dependencies ]
+        return hashlib.sha1(":".join(identity).encode('utf-8')).hexdigest()
+
+
+    def __get_path(self, kind, key, suffix):
+        return os.path.join(self.cachedir, kind, key + suffix)
+
+
+    # description: look up an artifact and mark it as recently used
+    # parameters : kind : the kind of artifact, each kind has its own subdirectory
+    #              key : the key returned by get_key()
+    #              suffix : the file extension of the artifact
+    # returns    : the path of the artifact, or None if it is not in the cache
+    def lookup(self, kind, key, suffix = ""):
+        if not self.is_enabled():
+            return None
+
+        path = self.__get_path(kind, key, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+
+        self.logger.log("Found %s in cache %s", kind, path)
+        return path
+
+
+    # description: create a temporary file in the cache, to be stored with commit()
+    # returns    : the path of the temporary file
+    def create_tempfile(self, kind, suffix = ""):
+        os.makedirs(os.path.join(self.cachedir, kind), exist_ok = True)
+        (fd, tempfilename) = tempfile.mkstemp(dir = os.path.join(self.cachedir, kind), \
+                                              suffix = suffix + ".tmp")
+        os.close(fd)
+        return tempfilename
+
+
+    # description: store a completed temporary file as an artifact
+    # parameters : tempfilename : the file returned by create_tempfile()
+    #              kind, key, suffix : as in lookup()
+    # returns    : the path of the artifact
+    def commit(self, tempfilename, kind, key, suffix = ""):
+        path = self.__get_path(kind, key, suffix)
+        os.replace(tempfilename, path)
+        self.logger.log("Stored %s in cache %s", kind, path)
+
+        with self.__lock:
+            self.__commits = self.__commits + 1
+            if self.__size is not None:
+                self.__size = self.__size + os.path.getsize(path)
+        self.evict()
+
+        return path
+
+
+    # description: remove a temporary file which will not be committed
+    def discard(self, tempfilename):
+        try:
+            os.remove(tempfilename)
+        except OSError:
+            pass
+
+
+    # description: read a JSON artifact
+    # returns    : the decoded data, or None if it is not in the cache
+    def read_json(self, kind, key):
+        path = self.lookup(kind, key, ".json")
+        if not path:
+            return None
+
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+    # description: write a JSON artifact, failures are logged but not fatal
+    def write_json(self, kind, key, data):
+        if not self.is_enabled():
+            return
+
+        try:
+            tempfilename = self.create_tempfile(kind, ".json")
+            with open(tempfilename, 'w') as f:
+                json.dump(data, f)
+            self.logger.add_file_written(tempfilename)
+            self.commit(tempfilename, kind, key, ".json")
+        except OSError as e:
+            self.logger.log("Could not write " + kind + " to cache, error = " + str(e))
+
+
+    # description: get the artifacts in the cache, files with the same name apart from
+    #              the extension belong to one artifact, eg the sheet and metrics of a
+    #              glyph atlas, so they are evicted together
+    # returns    : a list of (mtime, size, paths) with the most recent use of the artifact
+    def __get_entries(self):
+        entries = {}
+        for dirpath, dirnames, filenames in os.walk(self.cachedir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # removed by another job
+                    continue
+                name = os.path.join(dirpath, filename.split('.')[0])
+                (mtime, size, paths) = entries.get(name, (0, 0, []))
+                entries[name] = (max(mtime, stat.st_mtime), size + stat.st_size, paths + [ path ])
+        return list(entries.values())
+
+
+    # description: remove the least recently used artifacts until the cache is smaller
+    #              than its maximum size
+    def evict(self):
+        if not self.is_enabled() or self.maxsize <= 0:
+            return
+
+        with self.__lock:
+            if self.__size is not None and self.__size <= self.maxsize and \
+               self.__commits < self.rescaninterval:
+                return
+
+            self.__commits = 0
+            entries = self.__get_entries()
+            cachesize = sum([ e[1] for e in entries ])
+
+            threshold = time.time() - self.graceperiod
+            for (mtime, size, paths) in sorted(entries):
+                if cachesize <= self.maxsize or mtime > threshold:
+                    break
+                for path in paths:
+                    try:
+                        os.remove(path)
+                        self.logger.log("Evicted %s from cache", path)
+                    except OSError:
+                        pass
+                cachesize = cachesize - size
+
+            self.__size = cachesize
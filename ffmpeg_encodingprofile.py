@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# class FFmpeg -- python interface to the ffmpeg command
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os
+
+class FFmpegEncodingProfile:
+    # the settings which can be configured, an empty value leaves the ffmpeg default
+    settings = [ "codec", "preset", "crf", "pixelformat", "codecprofile", "level", "threads" ]
+
+    def __init__(self, logger, name = "default"):
+        self.logger = logger
+        self.name = name
+        self.codec = ""
+        self.preset = ""
+        self.crf = ""
+        self.pixelformat = ""
+        # profile and level of the codec, eg high and 4.2
+        self.codecprofile = ""
+        self.level = ""
+        self.threads = ""
+
+
+    # description: change a setting of the profile
+    # parameters : setting : one of the names in settings
+    #              value : the new value
+    # returns    : True if the setting exists
+    def set(self, setting, value):
+        if setting not in self.settings:
+            self.logger.error("Unknown encoding setting " + setting)
+            return False
+
+        setattr(self, setting, str(value).strip())
+        return True
+
+
+    # description: get the ffmpeg output options for video encoding
+    # parameters : threads : the number of threads to use when the profile doesn't
+    #                        specify it, 0 lets ffmpeg decide
+    # returns    : a list of ffmpeg options
+    def get_ffmpeg_params(self, threads = 0):
+        params = []
+        if self.codec:
+            params = params + [ "-c:v", self.codec ]
+        if self.preset:
+            params = params + [ "-preset", self.preset ]
+        if self.crf:
+            params = params + [ "-crf", self.crf ]
+        if self.pixelformat:
+            params = params + [ "-pix_fmt", self.pixelformat ]
+        if self.codecprofile:
+            params = params + [ "-profile:v", self.codecprofile ]
+        if self.level:
+            params = params + [ "-level", self.level ]
+        if self.threads:
+            params = params + [ "-threads", self.threads ]
+        elif threads > 0:
+            params = params + [ "-threads", str(threads) ]
+        return params
+
+
+    def log(self):
+        self.logger.log("Encoding profile " + self.name + ":")
+        for setting in self.settings:
+            self.logger.log(setting + " = " + getattr(self, setting))
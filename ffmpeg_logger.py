@@ -16,15 +16,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os
+import sys, os, contextlib
 
 class FFmpegLogger:
     verbosity_off = 0
     verbosity_normal = 1
     verbosity_detail = 2
     
-    def __init__(self, verbositylevel = verbosity_off):
+    def __init__(self, verbositylevel = verbosity_off, tracer = None):
         self.verbositylevel = verbositylevel
+        # an FFmpegTracer recording the time spent in each stage, or None
+        self.tracer = tracer
 
 
     def increase_verbosity(self):
@@ -38,11 +40,37 @@ class FFmpegLogger:
             return 8 # Only show errors after which the process absolutely cannot continue.
 
 
-    def log(self, text):
+    def is_enabled(self, verbositylevel = verbosity_normal):
+        return self.verbositylevel >= verbositylevel
+
+
+    # description: print a message when verbose
+    # parameters : text : the message, or a format string when args are given
+    #              args : values formatted into text with the % operator, only when
+    #                     the message is printed
+    def log(self, text, *args):
         if self.verbositylevel >= self.verbosity_normal:
-            print(text)
+            print(text % args if args else text)
 
 
     def error(self, text):
         print(text)
 
+
+    # description: create a tracing span around a stage of the processing
+    # returns    : a context manager, which does nothing when tracing is disabled
+    def span(self, name, category = "stage", **args):
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name, category, **args)
+
+
+    def add_subprocess_time(self, seconds):
+        if self.tracer is not None:
+            self.tracer.add_subprocess_time(seconds)
+
+
+    # description: add the size of a written file to the open tracing spans
+    def add_file_written(self, filename):
+        if self.tracer is not None and os.path.isfile(filename):
+            self.tracer.add_bytes_written(os.path.getsize(filename))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# class FFmpeg -- python interface to the ffmpeg command
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, time, threading
+
+# The progress of one ffmpeg process. ffmpeg started with -progress writes a block of
+# key=value lines about once per second, the block ends with a progress line.
+class FFmpegProgressTask:
+    def __init__(self, reporter, label, duration):
+        self.reporter = reporter
+        self.label = label
+        # the duration of the output in seconds, 0 if unknown
+        self.duration = duration
+        self.start_time = time.time()
+
+        self.frame = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        # the time in seconds of the output written so far
+        self.out_time = 0.0
+
+        self.__block = {}
+
+
+    # description: parse a line written by ffmpeg -progress
+    def parse_line(self, line):
+        line = line.strip()
+        if '=' not in line:
+            return
+
+        (key, value) = line.split('=', 1)
+        if key != 'progress':
+            self.__block[key] = value.strip()
+            return
+
+        try:
+            self.frame = int(self.__block.get('frame', self.frame))
+            self.fps = float(self.__block.get('fps', self.fps))
+            if self.__block.get('out_time_us', 'N/A') != 'N/A':
+                self.out_time = max(0.0, int(self.__block['out_time_us']) / 1000000)
+            speed = self.__block.get('speed', 'N/A').rstrip('x')
+            if speed != 'N/A':
+                self.speed = float(speed)
+        except ValueError:
+            # incomplete values at the start of the output
+            pass
+        self.__block = {}
+
+        self.reporter.update(self, value == 'end')
+
+
+    def get_elapsed(self):
+        return time.time() - self.start_time
+
+
+    # description: get the completed part of the output
+    # returns    : a percentage, or None if the duration is unknown
+    def get_percentage(self):
+        if self.duration <= 0:
+            return None
+        return min(100.0, 100.0 * self.out_time / self.duration)
+
+
+    # description: estimate the remaining time from the average throughput so far
+    # returns    : the remaining time in seconds, or None if it can't be estimated
+    def get_eta(self):
+        elapsed = self.get_elapsed()
+        if self.duration <= 0 or self.out_time <= 0 or elapsed <= 0:
+            return None
+        return max(0.0, self.duration - self.out_time) * elapsed / self.out_time
+
+
+
+# Reports the progress of all running ffmpeg processes, either as a status line
+# which is redrawn in the terminal or as machine readable lines:
+#   progress label=... frame=... fps=... speed=... out_time=... duration=...
+#            percent=... elapsed=... eta=... status=running|done|failed
+class FFmpegProgress:
+    mode_off = "off"
+    mode_display = "display"
+    mode_machine = "machine"
+    modes = [ mode_off, mode_display, mode_machine ]
+
+    # minimum number of seconds between two reports
+    interval = 1.0
+
+    def __init__(self, logger, mode = mode_display, stream = None):
+        self.logger = logger
+        self.stream = stream if stream else sys.stderr
+        self.mode = mode
+        # a status line can only be redrawn in a terminal
+        if mode == self.mode_display and not self.stream.isatty():
+            self.mode = self.mode_off
+
+        self.__tasks = []
+        self.__last_report = {}
+        self.__linelength = 0
+        self.__lock = threading.Lock()
+
+
+    def is_enabled(self):
+        return self.mode != self.mode_off
+
+
+    # description: register a new ffmpeg process
+    # parameters : label : the name shown in the reports, eg the output file
+    #              duration : the duration of the output in seconds, 0 if unknown
+    # returns    : an FFmpegProgressTask to pass the output of ffmpeg to
+    def start_task(self, label, duration = 0):
+        task = FFmpegProgressTask(self, label, duration)
+        with self.__lock:
+            self.__tasks.append(task)
+        return task
+
+
+    # description: unregister an ffmpeg process and report its result
+    def finish_task(self, task, succeeded):
+        with self.__lock:
+            if task in self.__tasks:
+                self.__tasks.remove(task)
+                self.__report(task, "done" if succeeded else "failed")
+
+
+    def update(self, task, finished = False):
+        now = time.time()
+        with self.__lock:
+            if finished or now - self.__last_report.get(id(task), 0) >= self.interval:
+                self.__last_report[id(task)] = now
+                self.__report(task, "running")
+
+
+    def __format_time(self, seconds):
+        if seconds is None:
+            return "--:--:--"
+        seconds = int(round(seconds))
+        return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+    def __format_task(self, task):
+        percentage = task.get_percentage()
+        return "%s%s %.1f fps %.2fx ETA %s" % \
+                    (task.label, \
+                     " %.1f%%" % percentage if percentage is not None else "", \
+                     task.fps, task.speed, self.__format_time(task.get_eta()))
+
+
+    def __write_line(self, text, final):
+        padding = max(0, self.__linelength - len(text))
+        self.stream.write("\r" + text + " " * padding + ("\n" if final else ""))
+        self.stream.flush()
+        self.__linelength = 0 if final else len(text)
+
+
+    def __report(self, task, status):
+        if self.mode == self.mode_machine:
+            percentage = task.get_percentage()
+            eta = task.get_eta()
+            self.stream.write("progress label=%s frame=%d fps=%.2f speed=%.3f " \
+                              "out_time=%.3f duration=%.3f percent=%s elapsed=%.1f " \
+                              "eta=%s status=%s\n" % \
+                                (task.label.replace(' ', '_'), task.frame, task.fps, \
+                                 task.speed, task.out_time, task.duration, \
+                                 "%.1f" % percentage if percentage is not None else "NA", \
+                                 task.get_elapsed(), \
+                                 "%.1f" % eta if eta is not None else "NA", status))
+            self.stream.flush()
+        elif self.mode == self.mode_display:
+            if status != "running":
+                self.__write_line("%s %s in %s, average %.1f fps" % \
+                                    (task.label, status, \
+                                     self.__format_time(task.get_elapsed()), \
+                                     task.frame / max(task.get_elapsed(), 0.001)), True)
+            if self.__tasks:
+                self.__write_line(" | ".join([ self.__format_task(t) \
+                                                    for t in self.__tasks ]), False)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# class FFmpeg -- python interface to the ffmpeg command
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, time, asyncio, subprocess, threading
+
+# Runs subprocesses with asyncio. All subprocesses are managed by one event loop in a
+# background thread, so they can be awaited from coroutines running on that loop as
+# well as called from ordinary threads with run_sync(). The number of simultaneous
+# subprocesses can be limited, a subprocess which runs too long or of which the
+# coroutine is cancelled is killed.
+class FFmpegRunner:
+    # number of bytes read at once from a binary standard output
+    chunksize = 65536
+
+    def __init__(self, logger, maxprocesses = 0, timeout = 0):
+        self.logger = logger
+        # maximum number of simultaneous subprocesses, 0 for unlimited
+        self.maxprocesses = maxprocesses
+        # default maximum duration of a subprocess in seconds, 0 for unlimited
+        self.timeout = timeout
+
+        self.__loop = None
+        self.__thread = None
+        self.__semaphore = None
+        self.__processes = set()
+        self.__cancelled = False
+        self.__lock = threading.Lock()
+
+
+    # description: get the event loop, it is started on first use
+    def get_loop(self):
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                self.__thread = threading.Thread(target = self.__loop.run_forever, \
+                                                 name = "FFmpegRunner", daemon = True)
+                self.__thread.start()
+        return self.__loop
+
+
+    # description: run a coroutine on the event loop and wait for its result
+    #              the coroutine is cancelled when the waiting thread is interrupted
+    # remarks    : can't be called from a coroutine on the event loop, await the
+    #              coroutine there instead
+    def run_sync(self, coroutine):
+        loop = self.get_loop()
+        if threading.current_thread() is self.__thread:
+            coroutine.close()
+            raise RuntimeError("run_sync() called from the event loop, use await instead")
+
+        # the coroutine runs in a copy of the context of this thread, so it is traced
+        # as part of the stage which is waiting for it
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+
+    async def __get_semaphore(self):
+        if self.__semaphore is None and self.maxprocesses > 0:
+            self.__semaphore = asyncio.Semaphore(self.maxprocesses)
+        return self.__semaphore
+
+
+    async def __read_lines(self, stream, callback):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            callback(line.decode('utf-8', 'replace'))
+
+
+    async def __read_chunks(self, stream, callback):
+        while True:
+            data = await stream.read(self.chunksize)
+            if not data:
+                break
+            callback(data)
+
+
+    # description: write the input data, the data is created in a worker thread since
+    #              creating it can take a while
+    async def __write_input(self, process, inputdata):
+        loop = asyncio.get_running_loop()
+        iterator = iter(inputdata)
+        try:
+            while True:
+                data = await loop.run_in_executor(None, next, iterator, None)
+                if data is None:
+                    break
+                process.stdin.write(data)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # the command stopped reading, the return code tells why
+            pass
+        finally:
+            process.stdin.close()
+
+
+    async def __kill(self, process):
+        if process.returncode is None:
+            self.logger.log("Killing process %d", process.pid)
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+
+    # description: run a command
+    # parameters : args : the command and its arguments
+    #              inputdata : an iterable of bytes objects to write to the standard
+    #                          input, or None
+    #              timeout : maximum duration in seconds, None for the default timeout
+    #                        and 0 for unlimited
+    #              stdout_callback : called with each line of the standard output, which
+    #                                is not returned, None to return the output
+    #              stdout_binary : if True the standard output is binary data, which is
+    #                              passed to stdout_callback in chunks of bytes as it
+    #                              is read, or returned as bytes
+    #              stderr_callback : called with each line of the standard error, None to
+    #                                leave it in the terminal
+    # returns    : True if successful and the standard output
+    async def run(self, args, inputdata = None, timeout = None, \
+                  stdout_callback = None, stderr_callback = None, stdout_binary = False):
+        if timeout is None:
+            timeout = self.timeout
+        if self.__cancelled:
+            self.logger.error("Cancelled: " + subprocess.list2cmdline(args))
+            return False, b"" if stdout_binary else ""
+
+        semaphore = await self.__get_semaphore()
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            with self.logger.span(os.path.basename(args[0]), "subprocess"):
+                return await self.__run(args, inputdata, timeout, \
+                                        stdout_callback, stderr_callback, stdout_binary)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+
+    async def __run(self, args, inputdata, timeout, \
+                    stdout_callback, stderr_callback, stdout_binary):
+        self.logger.log("Running command: %s", subprocess.list2cmdline(args))
+        starttime = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(*args, \
+                        stdin = asyncio.subprocess.PIPE if inputdata is not None \
+                                                        else asyncio.subprocess.DEVNULL, \
+                        stdout = asyncio.subprocess.PIPE, \
+                        stderr = asyncio.subprocess.PIPE if stderr_callback else None)
+        self.__processes.add(process)
+
+        output = []
+        read_stdout = self.__read_chunks if stdout_binary else self.__read_lines
+        tasks = [ read_stdout(process.stdout, \
+                              stdout_callback if stdout_callback else output.append) ]
+        if stderr_callback:
+            tasks.append(self.__read_lines(process.stderr, stderr_callback))
+        if inputdata is not None:
+            tasks.append(self.__write_input(process, inputdata))
+
+        retval = True
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks, process.wait()), \
+                                   timeout if timeout > 0 else None)
+            if process.returncode != 0:
+                self.logger.error("Command failed, return code = " + str(process.returncode))
+                retval = False
+        except asyncio.TimeoutError:
+            self.logger.error("Command timed out after %d seconds: %s" % \
+                                (timeout, subprocess.list2cmdline(args)))
+            retval = False
+        finally:
+            # also when the coroutine is cancelled, no child process is left behind
+            await self.__kill(process)
+            self.__processes.discard(process)
+            self.logger.add_subprocess_time(time.perf_counter() - starttime)
+
+        return retval, (b"" if stdout_binary else "").join(output)
+
+
+    # description: run a command from an ordinary thread, see run()
+    def run_command(self, args, **kwargs):
+        return self.run_sync(self.run(args, **kwargs))
+
+
+    # description: kill all running subprocesses and refuse to start new ones, eg when
+    #              the user interrupts
+    def kill_all(self):
+        self.__cancelled = True
+        if self.__loop is None:
+            return
+
+        async def kill_processes():
+            for process in list(self.__processes):
+                await self.__kill(process)
+
+        asyncio.run_coroutine_threadsafe(kill_processes(), self.__loop).result()
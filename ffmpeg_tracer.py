@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# class FFmpeg -- python interface to the ffmpeg command
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, time, json, threading, contextvars
+
+# A timed stage of the processing. Spans are used as context managers and can be nested,
+# time spent in subprocesses and bytes written are added to every open span of the
+# thread or coroutine which ran the subprocess or wrote the file.
+class FFmpegTraceSpan:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+        self.start = 0.0
+        # wall time in seconds
+        self.duration = 0.0
+        # cpu time of the thread in seconds, excluding subprocesses
+        self.cputime = 0.0
+        # wall time in seconds spent waiting for subprocesses
+        self.subprocesstime = 0.0
+        self.byteswritten = 0
+        self.threadid = 0
+
+        self.__cpustart = 0.0
+        self.__token = None
+
+
+    def __enter__(self):
+        self.threadid = threading.get_ident()
+        self.__token = self.tracer._push(self)
+        self.start = time.perf_counter()
+        self.__cpustart = time.thread_time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.cputime = time.thread_time() - self.__cpustart
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._pop(self, self.__token)
+        return False
+
+
+
+class FFmpegTracer:
+    def __init__(self):
+        self.__origin = time.perf_counter()
+        self.__spans = []
+        self.__lock = threading.Lock()
+        # the open spans, a context variable is local to each thread and is copied to
+        # the coroutines started from it
+        self.__stack = contextvars.ContextVar("spans", default = ())
+
+
+    # description: create a span, to be used in a with statement
+    # parameters : name : the name of the stage, spans with the same name are
+    #                     combined in the summary
+    #              category : the kind of stage, eg telemetry, plugin or ffmpeg
+    #              args : extra information stored with the span in the trace
+    def span(self, name, category = "stage", **args):
+        return FFmpegTraceSpan(self, name, category, args)
+
+
+    def _push(self, span):
+        return self.__stack.set(self.__stack.get() + (span, ))
+
+
+    def _pop(self, span, token):
+        self.__stack.reset(token)
+        with self.__lock:
+            self.__spans.append(span)
+
+
+    def add_subprocess_time(self, seconds):
+        with self.__lock:
+            for span in self.__stack.get():
+                span.subprocesstime += seconds
+
+
+    def add_bytes_written(self, count):
+        with self.__lock:
+            for span in self.__stack.get():
+                span.byteswritten += count
+
+
+    def get_spans(self):
+        with self.__lock:
+            return list(self.__spans)
+
+
+    # description: write all completed spans in the Chrome trace event format, which can
+    #              be loaded in chrome://tracing or https://ui.perfetto.dev
+    def write_chrome_trace(self, filename):
+        events = []
+        for span in sorted(self.get_spans(), key = lambda s: s.start):
+            args = dict(span.args)
+            args['cpu_ms'] = round(span.cputime * 1000, 3)
+            args['subprocess_ms'] = round(span.subprocesstime * 1000, 3)
+            args['bytes_written'] = span.byteswritten
+            events.append({ 'name': span.name,
+                            'cat': span.category,
+                            'ph': 'X',
+                            'ts': round((span.start - self.__origin) * 1000000, 1),
+                            'dur': round(span.duration * 1000000, 1),
+                            'pid': os.getpid(),
+                            'tid': span.threadid,
+                            'args': args })
+
+        with open(filename, 'w') as f:
+            json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, f, indent = 1)
+
+
+    # description: get a table of the total time of each stage, in order of first use
+    def get_summary(self):
+        totals = {}
+        for span in sorted(self.get_spans(), key = lambda s: s.start):
+            total = totals.setdefault((span.category, span.name), [ 0, 0.0, 0.0, 0.0, 0 ])
+            total[0] += 1
+            total[1] += span.duration
+            total[2] += span.cputime
+            total[3] += span.subprocesstime
+            total[4] += span.byteswritten
+
+        lines = [ "%-12s %-32s %6s %10s %10s %11s %12s" % \
+                    ("category", "stage", "count", "wall (s)", "cpu (s)", "subproc (s)", \
+                     "written (B)") ]
+        for (category, name), total in totals.items():
+            lines.append("%-12s %-32s %6d %10.3f %10.3f %11.3f %12d" % \
+                            ((category, name[:32]) + tuple(total)))
+        return "\n".join(lines)
@@ -25,55 +25,77 @@ class FFmpegVideoProperties:
         self.duration = 0.0
         self.video_width = 0
         self.video_height = 0
-
-
-    def __parse_framerate(self, instring):
-        # get the part behind =
-        rate = instring.split('=')[1]
-        # strip the quotes
-        rate = rate.replace('"', '').strip()
+        self.encoder = ""
+        # name of the video codec, eg h264 or hevc
+        self.codec = ""
+        # profile and level of the video codec, eg High and 42 for level 4.2
+        self.profile = ""
+        self.level = 0
+        self.pixelformat = ""
+        # time base of the video stream, eg 1/90000
+        self.timebase = ""
+        # index of the GoPro telemetry stream, None if not available
+        self.telemetry_stream = None
+        # the stream information as returned by ffprobe
+        self.streams = []
+
+
+    def __parse_framerate(self, rate):
         #  split when / is found
         ratelist = rate.split('/')
 
         if len(ratelist) == 1:
             self.framerate = float(ratelist[0])
-        elif len(ratelist) == 2:
+        elif len(ratelist) == 2 and float(ratelist[1]) != 0:
             self.framerate = float(ratelist[0])/float(ratelist[1])
         self.logger.log("Detected framerate = " + str(self.framerate))
         
 
-    def __parse_duration(self, instring):
-        # get the part behind =
-        duration = instring.split('=')[1]
-        # strip the quotes
-        duration = duration.replace('"', '').strip()
+    def __parse_duration(self, duration):
         self.duration = float(duration)
         self.logger.log("Detected duration = " + str(self.duration))
         
 
-    def __parse_video_width(self, instring):
-        # get the part behind =
-        width = instring.split('=')[1]
+    def __parse_video_width(self, width):
         self.video_width = int(width)
         self.logger.log("Detected frame width = " + str(self.video_width))
 
 
-    def __parse_video_height(self, instring):
-        # get the part behind =
-        height = instring.split('=')[1]
+    def __parse_video_height(self, height):
         self.video_height = int(height)
         self.logger.log("Detected frame height = " + str(self.video_height))
 
 
-    def parse(self, ffproberesult):
-        outlist = ffproberesult.split("\n")
-        for prop in outlist:
-            if "r_frame_rate" in prop:
-                self.__parse_framerate(prop)
-            elif "duration" in prop:
-                self.__parse_duration(prop)
-            elif "width" in prop:
-                self.__parse_video_width(prop)
-            elif "height" in prop:
-                self.__parse_video_height(prop)
-
+    # description: fill in the properties from the output of ffprobe
+    # parameters : probedata : the decoded json output of ffprobe, containing at least
+    #                          the streams section
+    def parse(self, probedata):
+        self.streams = probedata.get('streams', [])
+
+        videostreams = [ s for s in self.streams if s.get('codec_type') == 'video' ]
+        if videostreams:
+            videostream = videostreams[0]
+            if 'r_frame_rate' in videostream:
+                self.__parse_framerate(videostream['r_frame_rate'])
+            if 'duration' in videostream:
+                self.__parse_duration(videostream['duration'])
+            if 'width' in videostream:
+                self.__parse_video_width(videostream['width'])
+            if 'height' in videostream:
+                self.__parse_video_height(videostream['height'])
+            self.encoder = videostream.get('tags', {}).get('encoder', '')
+            self.logger.log("Detected encoder = " + self.encoder)
+            self.codec = videostream.get('codec_name', '')
+            self.logger.log("Detected codec = " + self.codec)
+            self.profile = videostream.get('profile', '')
+            self.level = int(videostream.get('level', 0))
+            self.pixelformat = videostream.get('pix_fmt', '')
+            self.timebase = videostream.get('time_base', '')
+            self.logger.log("Detected profile = %s, level = %d, pixel format = %s, " \
+                            "time base = %s", self.profile, self.level, self.pixelformat, \
+                            self.timebase)
+
+        gpmdstreams = [ s for s in self.streams if s.get('codec_tag_string') == 'gpmd' ]
+        if gpmdstreams:
+            self.telemetry_stream = gpmdstreams[0]['index']
+            self.logger.log("Detected telemetry stream = " + str(self.telemetry_stream))
@@ -19,8 +19,12 @@
 import sys, os
 from ffmpeg import FFmpegLogger
 from ffmpeg import FFmpeg
+from ffmpeg import FFmpegCache
+from ffmpeg import FFmpegProgress
+from ffmpeg import FFmpegTracer
+from ffmpeg import FFmpegRunner
 from gpt_parameters import Parameters
-from gpt_telemetry import Telemetry
+from gpt_batch import Batch
 
 # MAIN
 
@@ -28,27 +32,30 @@ params = Parameters()
 if not params.parse_commandline():
     sys.exit()
 
-ffmpeg = FFmpeg(params.logger)
-
-# TODO: see if we have to concat other parts of the video
-#ffmpeg.gopro_concat_video(os.path.split(os.path.abspath(params.filename))[0])
-
-if not os.path.exists(params.filename):
-    params.logger.error("Validation error: filename " + params.filename + " was not found")
+retval, profile = params.read_encoding_profile()
+if not retval:
     sys.exit()
 
-if not ffmpeg.is_created_by_gopro(params.filename):
-    params.logger.error("Validation error: file is not recorded with a GoPro camera")
-    sys.exit()
+if params.tracefile:
+    params.logger.tracer = FFmpegTracer()
 
-if not ffmpeg.contains_gopro_telemetry(params.filename):
-    params.logger.error("Validation error: telemetry data not found")
-    sys.exit()
+cache = FFmpegCache(params.logger, params.cachedir, params.cachesize * 1024 * 1024)
+progress = FFmpegProgress(params.logger, params.progress)
+runner = FFmpegRunner(params.logger, params.processes, params.timeout)
+ffmpeg = FFmpeg(params.logger, params.get_threads_per_job(), cache, profile, progress, runner)
 
-telemetry = Telemetry(params, ffmpeg)
+batch = Batch(params, ffmpeg)
 
-if not telemetry.initialized:
-    sys.exit()
+try:
+    retval = batch.run()
+except KeyboardInterrupt:
+    # don't leave ffmpeg processes running in the background
+    runner.kill_all()
+    sys.exit(130)
 
-telemetry.run_plugins()
+if params.logger.tracer is not None:
+    params.logger.tracer.write_chrome_trace(params.tracefile)
+    print(params.logger.tracer.get_summary())
 
+if not retval:
+    sys.exit(1)
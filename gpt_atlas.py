@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+# gpt_atlas -- pre-rendered glyphs for the overlay engine of gopro-telemetry
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, json, hashlib, tempfile, collections, threading
+from ffmpeg import FFmpegLogger
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+# Every glyph is rendered once with FreeType into a sprite sheet, text is composed by
+# copying the glyphs from the sheet. The sheet is cached on disk, keyed by the font, its
+# size and style. Composed texts are kept in a small in-memory cache as well, since the
+# same values tend to be displayed over and over.
+class GlyphAtlas:
+    # glyphs which are rendered in advance, others are added when needed
+    charset = "".join([ chr(c) for c in range(32, 127) ])
+    sheetwidth = 2048
+    textcachesize = 1024
+
+    def __init__(self, logger, fontfile, fontsize, borderwidth, \
+                 fillcolor = (255, 255, 255, 255), bordercolor = (0, 0, 0, 255), \
+                 cachedir = ""):
+        if Image is None:
+            raise Exception("The glyph atlas requires the Python Imaging Library (Pillow)")
+
+        self.logger = logger
+        self.fontfile = fontfile
+        self.fontsize = fontsize
+        self.borderwidth = borderwidth
+        self.fillcolor = tuple(fillcolor)
+        self.bordercolor = tuple(bordercolor)
+        self.cachedir = cachedir
+
+        self.__font = ImageFont.truetype(fontfile, fontsize)
+        (ascent, descent) = self.__font.getmetrics()
+        self.__baseline = ascent + borderwidth
+        # all glyphs have the same height, so texts line up
+        self.height = ascent + descent + 2 * borderwidth
+
+        self.__sheet = None
+        # char : (x, y, width, height, xoffset, advance) in the sheet
+        self.__glyphs = {}
+        self.__next_x = 0
+        self.__next_y = 0
+        self.__changed = False
+        self.__texts = collections.OrderedDict()
+        # parallel segments share the atlas
+        self.__lock = threading.RLock()
+
+        if not self.__load():
+            self.__sheet = Image.new('RGBA', (self.sheetwidth, self.height), (0, 0, 0, 0))
+            for char in self.charset:
+                self.__add_glyph(char)
+            self.__save()
+
+
+    def __get_cachefile(self):
+        if not self.cachedir:
+            return None
+
+        key = "%s:%d:%d:%d:%s:%s:%s" % \
+                (os.path.abspath(self.fontfile), os.stat(self.fontfile).st_mtime_ns, \
+                 self.fontsize, self.borderwidth, self.fillcolor, self.bordercolor, \
+                 self.charset)
+        return os.path.join(self.cachedir, "atlas", \
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+    def __load(self):
+        cachefile = self.__get_cachefile()
+        if not cachefile:
+            return False
+
+        try:
+            with open(cachefile + ".json") as f:
+                metrics = json.load(f)
+            sheet = Image.open(cachefile + ".png")
+            sheet.load()
+            # mark as recently used, the cache evicts the sheet and metrics together
+            os.utime(cachefile + ".json")
+            os.utime(cachefile + ".png")
+        except (OSError, ValueError):
+            return False
+
+        self.__sheet = sheet.convert('RGBA')
+        self.__glyphs = { char: tuple(glyph) for char, glyph in metrics['glyphs'].items() }
+        (self.__next_x, self.__next_y) = metrics['next']
+        self.logger.log("Glyph atlas loaded from cache " + cachefile)
+        return True
+
+
+    # description: write the sprite sheet to the cache directory, if anything changed
+    def save(self):
+        with self.__lock:
+            self.__save()
+
+
+    def __save(self):
+        cachefile = self.__get_cachefile()
+        if not cachefile or not self.__changed:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(cachefile), exist_ok = True)
+            (fd, temppng) = tempfile.mkstemp(dir = os.path.dirname(cachefile), suffix = ".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                self.__sheet.save(f, format = 'PNG')
+            (fd, tempjson) = tempfile.mkstemp(dir = os.path.dirname(cachefile), suffix = ".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({ 'glyphs': self.__glyphs, \
+                            'next': [ self.__next_x, self.__next_y ] }, f)
+            # the metrics are checked last, write them after the sheet
+            os.replace(temppng, cachefile + ".png")
+            os.replace(tempjson, cachefile + ".json")
+            self.__changed = False
+        except OSError as e:
+            self.logger.log("Could not write glyph atlas, error = " + str(e))
+
+
+    def __add_glyph(self, char):
+        (left, top, right, bottom) = self.__font.getbbox(char, anchor = 'ls', \
+                                                         stroke_width = self.borderwidth)
+        advance = self.__font.getlength(char)
+        xoffset = min(left, 0)
+        width = max(right, int(advance) + 1) - xoffset
+
+        if self.__next_x + width > self.sheetwidth:
+            self.__next_x = 0
+            self.__next_y = self.__next_y + self.height
+        if self.__next_y + self.height > self.__sheet.height:
+            sheet = Image.new('RGBA', (self.sheetwidth, self.__next_y + self.height), \
+                              (0, 0, 0, 0))
+            sheet.paste(self.__sheet, (0, 0))
+            self.__sheet = sheet
+
+        draw = ImageDraw.Draw(self.__sheet)
+        draw.text((self.__next_x - xoffset, self.__next_y + self.__baseline), char, \
+                  font = self.__font, anchor = 'ls', fill = self.fillcolor, \
+                  stroke_width = self.borderwidth, stroke_fill = self.bordercolor)
+
+        self.__glyphs[char] = (self.__next_x, self.__next_y, width, self.height, \
+                               xoffset, advance)
+        self.__next_x = self.__next_x + width
+        self.__changed = True
+
+
+    # description: compose a text from the glyphs in the atlas
+    # parameters : text : the text to render
+    # returns    : an RGBA image of the text
+    def render_text(self, text):
+        with self.__lock:
+            return self.__render_text(text)
+
+
+    def __render_text(self, text):
+        if text in self.__texts:
+            self.__texts.move_to_end(text)
+            return self.__texts[text]
+
+        for char in text:
+            if char not in self.__glyphs:
+                self.__add_glyph(char)
+
+        pen = self.borderwidth
+        placements = []
+        for char in text:
+            (x, y, width, height, xoffset, advance) = self.__glyphs[char]
+            placements.append(((x, y, x + width, y + height), int(round(pen + xoffset))))
+            pen = pen + advance
+
+        image = Image.new('RGBA', (max(1, int(pen) + self.borderwidth), self.height), \
+                          (0, 0, 0, 0))
+        for (box, x) in placements:
+            # glyphs may overlap, blend instead of replacing the pixels
+            image.alpha_composite(self.__sheet, (max(0, x), 0), box)
+
+        self.__texts[text] = image
+        if len(self.__texts) > self.textcachesize:
+            self.__texts.popitem(last = False)
+
+        return image
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# gpt_batch -- process multiple input files with gopro-telemetry
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, copy, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg import FFmpegLogger
+from ffmpeg import FFmpeg
+from gpt_parameters import Parameters
+from gpt_telemetry import Telemetry
+
+class BatchResult:
+    def __init__(self, filename):
+        self.filename = filename
+        self.succeeded = False
+        self.message = ""
+        self.elapsed = 0.0
+
+
+
+class Batch:
+    def __init__(self, params, ffmpeg):
+        self.logger = params.logger
+
+        self.__params = params
+        self.__ffmpeg = ffmpeg
+        self.__results = []
+
+
+    def __validate(self, filename):
+        if not os.path.exists(filename):
+            return "Validation error: filename " + filename + " was not found"
+
+        if not self.__ffmpeg.is_created_by_gopro(filename):
+            return "Validation error: file is not recorded with a GoPro camera"
+
+        if not self.__ffmpeg.contains_gopro_telemetry(filename):
+            return "Validation error: telemetry data not found"
+
+        return ""
+
+
+    # description: process one input file, or all chapters of a recording
+    # parameters : filenames : the input file, or the chapters in order
+    def __process_file(self, filenames):
+        filename = filenames[0]
+        result = BatchResult(filename)
+        start_time = time.time()
+
+        with self.logger.span(os.path.basename(filename), "file"):
+            # errors in one file should not stop the other ones
+            try:
+                for chapter in filenames:
+                    result.message = self.__validate(chapter)
+                    if result.message:
+                        break
+                if not result.message:
+                    params = copy.copy(self.__params)
+                    params.filename = filename
+                    params.chapterfiles = filenames if len(filenames) > 1 else []
+
+                    telemetry = Telemetry(params, self.__ffmpeg)
+                    if not telemetry.initialized:
+                        result.message = "Telemetry could not be read"
+                    elif not telemetry.run_plugins():
+                        result.message = "Rendering failed"
+                    else:
+                        result.succeeded = True
+                        result.message = "OK"
+            except Exception as e:
+                self.logger.log(traceback.format_exc())
+                result.message = "Unexpected error: " + str(e)
+
+        result.elapsed = time.time() - start_time
+        if not result.succeeded:
+            self.logger.error(filename + ": " + result.message)
+
+        return result
+
+
+    def __print_summary(self):
+        print("Summary:")
+        for result in self.__results:
+            print("  {0:<40} {1:>8.1f}s  {2}".format(result.filename, \
+                                                   result.elapsed, \
+                                                   result.message))
+        succeeded = len([ r for r in self.__results if r.succeeded ])
+        print("%d of %d files processed successfully" % (succeeded, len(self.__results)))
+
+
+    # description: process all input files, at most params.workers simultaneously
+    #              the chapters of a recording are processed together if requested
+    # returns    : True if all files were processed successfully
+    def run(self):
+        if self.__params.chapters:
+            jobs = self.__ffmpeg.get_gopro_chapters(self.__params.filenames)
+            for chapters in jobs:
+                if len(chapters) > 1:
+                    self.logger.log("Rendering chapters " + ", ".join(chapters) + \
+                                    " as one video")
+        else:
+            jobs = [ [ filename ] for filename in self.__params.filenames ]
+
+        with ThreadPoolExecutor(max_workers = self.__params.workers) as executor:
+            self.__results = list(executor.map(self.__process_file, jobs))
+
+        if len(jobs) > 1:
+            self.__print_summary()
+
+        return all([ r.succeeded for r in self.__results ])
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+
+# gpt_benchmark -- measure the performance of gopro-telemetry on synthetic videos
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, getopt, struct, subprocess, json, time, platform, shutil, statistics
+from ffmpeg import FFmpegLogger
+from ffmpeg import FFmpeg
+
+# The benchmark generates its input videos offline: an ffmpeg test pattern with a
+# synthetic GoPro telemetry track, so no real footage is needed. Every video is
+# processed by gpt.py with an empty cache (cold) and again with the filled cache
+# (warm). The wall time of each processing stage is taken from the trace of gpt.py,
+# the peak memory of gpt.py from the resource usage of the process. The results can
+# be stored as a baseline and compared with the results of a later run.
+
+# description: create a GPMF KLV item
+# parameters : key : the four character key
+#              datatype : the GPMF type character, b'\0' for nested items
+#              size : the size of one sample in bytes
+#              repeat : the number of samples
+#              payload : the data
+def klv(key, datatype, size, repeat, payload):
+    return key + datatype + struct.pack('>BH', size, repeat) + payload + \
+           b'\0' * ((-len(payload)) % 4)
+
+
+def nested_klv(key, items):
+    payload = b''.join(items)
+    return klv(key, b'\0', 1, len(payload), payload)
+
+
+# description: create one second of telemetry as a DEVC payload, with GPS at 18 Hz,
+#              the accelerometer and gyroscope at 200 Hz and the temperature, the
+#              camera rides 10 m/s to the north-east
+# parameters : second : the time of the payload in seconds since the start
+def create_gpmf_payload(second, gps_rate = 18, imu_rate = 200):
+    stmp = klv(b'STMP', b'J', 8, 1, struct.pack('>Q', second * 1000000))
+
+    gps = b''
+    for i in range(gps_rate):
+        t = second + i / gps_rate
+        gps = gps + struct.pack('>5i', int((51.0 + t * 6.4e-5) * 1e7), \
+                                       int((4.0 + t * 1.0e-4) * 1e7), \
+                                       int((20.0 + 5.0 * (t % 60) / 60) * 1000), \
+                                       10000, 1000)
+    # the recording starts on 1 January 2018 at noon
+    (minutes, seconds) = divmod(second, 60)
+    gpsu = "180101%02d%02d%02d.000" % (12 + minutes // 60, minutes % 60, seconds)
+    gpsstream = nested_klv(b'STRM', [ \
+                    stmp, \
+                    klv(b'GPSU', b'U', 16, 1, gpsu.encode('ascii')), \
+                    klv(b'GPSF', b'L', 4, 1, struct.pack('>I', 3)), \
+                    klv(b'SCAL', b'l', 4, 5, struct.pack('>5i', 10000000, 10000000, \
+                                                         1000, 1000, 100)), \
+                    klv(b'GPS5', b'l', 20, gps_rate, gps) ])
+
+    accl = b''.join([ struct.pack('>3h', 4180, (i % 20) - 10, 25) for i in range(imu_rate) ])
+    acclstream = nested_klv(b'STRM', [ \
+                    stmp, \
+                    klv(b'SCAL', b's', 2, 1, struct.pack('>h', 418)), \
+                    klv(b'ACCL', b's', 6, imu_rate, accl) ])
+
+    gyro = b''.join([ struct.pack('>3h', (i % 7) - 3, 2, -1) for i in range(imu_rate) ])
+    gyrostream = nested_klv(b'STRM', [ \
+                    stmp, \
+                    klv(b'SCAL', b's', 2, 1, struct.pack('>h', 939)), \
+                    klv(b'GYRO', b's', 6, imu_rate, gyro) ])
+
+    tmpcstream = nested_klv(b'STRM', [ \
+                    stmp, \
+                    klv(b'TMPC', b'f', 4, 1, struct.pack('>f', 40.0 + second / 60)) ])
+
+    return nested_klv(b'DEVC', [ klv(b'DVID', b'L', 4, 1, struct.pack('>I', 1)), \
+                                 klv(b'DVNM', b'c', 6, 1, b'Camera'), \
+                                 gpsstream, acclstream, gyrostream, tmpcstream ])
+
+
+class Benchmark:
+    def __init__(self):
+        self.workdir = os.path.join(os.path.expanduser("~"), ".cache", \
+                                    "gopro-telemetry-benchmark")
+        self.configfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                                       "gpt_config.xml")
+        self.profilename = "fast"
+        self.resolutions = [ "1280x720", "1920x1080" ]
+        self.durations = [ 10, 60 ]
+        self.framerate = 30
+        self.repeat = 3
+        self.outputfile = ""
+        self.baselinefile = ""
+        # maximum relative increase of the time or memory before it is a regression
+        self.tolerance = 0.10
+        # extra options for gpt.py
+        self.gptoptions = []
+        self.logger = FFmpegLogger(FFmpegLogger.verbosity_off)
+
+
+    def __usage(self):
+        print("Usage: " + sys.argv[0] + " [OPTION]... [-- GPTOPTION...]\n"
+              "Measure the performance of gopro-telemetry on synthetic videos\n\n"
+              "  -w --workdir      Directory for the generated videos and the cache\n"
+              "                    (default = " + self.workdir + ")\n"
+              "  -c --config       Configuration file (default = " + self.configfile + ")\n"
+              "  -e --profile      Encoding profile (default = " + self.profilename + ")\n"
+              "  -s --sizes        Comma separated video resolutions\n"
+              "                    (default = " + ",".join(self.resolutions) + ")\n"
+              "  -l --lengths      Comma separated video lengths in seconds\n"
+              "                    (default = " + \
+                                   ",".join([ str(d) for d in self.durations ]) + ")\n"
+              "  -f --framerate    Framerate of the videos (default = " + \
+                                   str(self.framerate) + ")\n"
+              "  -r --repeat       Number of runs of each measurement, the median is kept\n"
+              "                    (default = " + str(self.repeat) + ")\n"
+              "  -o --output       Write the results to a JSON baseline file\n"
+              "  -b --baseline     Compare the results with a JSON baseline file\n"
+              "  -t --tolerance    Maximum increase in percent of the time or memory\n"
+              "                    compared with the baseline (default = " + \
+                                   str(int(self.tolerance * 100)) + ")\n"
+              "  -v --verbose      Display extra information while processing\n"
+              "  -h --help         Display help and exit\n\n"
+              "Options after -- are passed to gpt.py, eg -- -n overlay -p 2\n")
+
+
+    # returns True if parameters could be parsed successfully
+    def parse_commandline(self):
+        try:
+            opts, args = getopt.getopt(sys.argv[1:], "w:c:e:s:l:f:r:o:b:t:vh", [
+                "workdir=",
+                "config=",
+                "profile=",
+                "sizes=",
+                "lengths=",
+                "framerate=",
+                "repeat=",
+                "output=",
+                "baseline=",
+                "tolerance=",
+                "verbose",
+                "help"])
+        except getopt.GetoptError:
+            self.__usage()
+            return False
+        try:
+            for opt, arg in opts:
+                if opt in ("-h", "--help"):
+                    self.__usage()
+                    return False
+                elif opt in ("-w", "--workdir"):
+                    self.workdir = str(arg)
+                elif opt in ("-c", "--config"):
+                    self.configfile = str(arg)
+                elif opt in ("-e", "--profile"):
+                    self.profilename = str(arg)
+                elif opt in ("-s", "--sizes"):
+                    self.resolutions = [ s for s in arg.split(',') if s ]
+                    if not all([ len([ int(v) for v in s.split('x') ]) == 2 \
+                                    for s in self.resolutions ]):
+                        raise ValueError("invalid resolution")
+                elif opt in ("-l", "--lengths"):
+                    self.durations = [ max(1, int(d)) for d in arg.split(',') if d ]
+                elif opt in ("-f", "--framerate"):
+                    self.framerate = max(1, int(arg))
+                elif opt in ("-r", "--repeat"):
+                    self.repeat = max(1, int(arg))
+                elif opt in ("-o", "--output"):
+                    self.outputfile = str(arg)
+                elif opt in ("-b", "--baseline"):
+                    self.baselinefile = str(arg)
+                elif opt in ("-t", "--tolerance"):
+                    self.tolerance = max(0.0, float(arg) / 100)
+                elif opt in ("-v", "--verbose"):
+                    self.logger.increase_verbosity()
+        except ValueError:
+            self.__usage()
+            return False
+
+        self.gptoptions = args
+        return True
+
+
+    # description: create a synthetic GoPro video, unless it exists already
+    # returns    : True if successful and the filename of the video
+    def __create_video(self, ffmpeg, resolution, duration):
+        clipdir = os.path.join(self.workdir, "clips")
+        os.makedirs(clipdir, exist_ok = True)
+        filename = os.path.join(clipdir, "GOPR%s-%ds-%dfps.MP4" % \
+                                            (resolution, duration, self.framerate))
+        if os.path.exists(filename):
+            return True, filename
+
+        self.logger.log("Creating synthetic video %s", filename)
+        gpmdfile = os.path.join(clipdir, "gpmd-%ds.bin" % duration)
+        with open(gpmdfile, 'wb') as f:
+            for second in range(duration):
+                f.write(create_gpmf_payload(second))
+
+        # the mov muxer writes the encoder tag and the gpmd track the way a GoPro
+        # camera does, the test pattern is encoded with a keyframe every second
+        tempfilename = filename + ".tmp"
+        retval, output = ffmpeg._run_command([
+            ffmpeg.get_ffmpeg_executable(),
+            "-v", str(self.logger.get_ffmpeg_verbosity()),
+            "-y",
+            "-f", "lavfi",
+            "-i", "testsrc2=size=%s:rate=%d:duration=%d" % \
+                        (resolution, self.framerate, duration),
+            "-f", "data",
+            "-i", gpmdfile,
+            "-map", "0:v",
+            "-map", "1:d",
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-g", str(self.framerate),
+            "-pix_fmt", "yuv420p",
+            "-metadata:s:v:0", "encoder=GoPro AVC encoder",
+            "-c:d", "copy",
+            "-tag:d", "gpmd",
+            "-metadata:s:d:0", "handler_name=GoPro MET",
+            "-f", "mov",
+            tempfilename ])
+        os.remove(gpmdfile)
+
+        if retval:
+            os.replace(tempfilename, filename)
+        elif os.path.exists(tempfilename):
+            os.remove(tempfilename)
+
+        return retval, filename
+
+
+    # description: run gpt.py once on a video
+    # returns    : True if successful, the wall time, the peak memory in kB and a
+    #              dictionary with the wall time of each stage
+    def __run_gpt(self, filename, cachedir):
+        tracefile = os.path.join(self.workdir, "trace.json")
+        args = [ sys.executable, \
+                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "gpt.py"), \
+                 "-o", "-g", "off", \
+                 "-c", self.configfile, \
+                 "-d", cachedir, \
+                 "-x", tracefile ] + \
+               ([ "-e", self.profilename ] if self.profilename else []) + \
+               self.gptoptions + [ filename ]
+
+        self.logger.log("Running command: %s", subprocess.list2cmdline(args))
+        starttime = time.perf_counter()
+        process = subprocess.Popen(args, stdout = subprocess.DEVNULL)
+        # the resource usage of this process only, subprocesses of gpt.py not included
+        (pid, status, rusage) = os.wait4(process.pid, 0)
+        walltime = time.perf_counter() - starttime
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode != 0:
+            self.logger.error("gpt.py failed on %s, return code = %d" % \
+                                (filename, returncode))
+            return False, walltime, 0, {}
+
+        stages = {}
+        with open(tracefile) as f:
+            for event in json.load(f)['traceEvents']:
+                if event['cat'] in ("file", "plugin"):
+                    continue
+                name = event['cat'] + "/" + event['name']
+                stages[name] = stages.get(name, 0.0) + event['dur'] / 1000000
+
+        # ru_maxrss is in kB on Linux
+        return True, walltime, rusage.ru_maxrss, stages
+
+
+    # description: measure a video with an empty and with a filled cache
+    # returns    : True if successful and a list of results
+    def __measure(self, filename, name, resolution, duration):
+        cachedir = os.path.join(self.workdir, "cache")
+        shutil.rmtree(cachedir, ignore_errors = True)
+
+        results = []
+        for run in [ "cold", "warm" ]:
+            walltimes = []
+            memory = []
+            stages = []
+            for i in range(self.repeat):
+                if run == "cold":
+                    shutil.rmtree(cachedir, ignore_errors = True)
+                retval, walltime, maxrss, stagetimes = self.__run_gpt(filename, cachedir)
+                if not retval:
+                    return False, results
+                walltimes.append(walltime)
+                memory.append(maxrss)
+                stages.append(stagetimes)
+
+            walltime = statistics.median(walltimes)
+            results.append({ 'name': name + "/" + run,
+                             'resolution': resolution,
+                             'duration': duration,
+                             'framerate': self.framerate,
+                             'run': run,
+                             'wall': round(walltime, 3),
+                             'wall_runs': [ round(w, 3) for w in walltimes ],
+                             'fps': round(duration * self.framerate / walltime, 2),
+                             'maxrss_kb': max(memory),
+                             'stages': { stage: round(statistics.median( \
+                                                    [ s.get(stage, 0.0) for s in stages ]), 3) \
+                                            for stage in sorted(set().union(*stages)) } })
+            print("%-32s %8.3f s %8.1f fps %8d kB" % \
+                    (results[-1]['name'], walltime, results[-1]['fps'], max(memory)))
+
+        return True, results
+
+
+    # description: compare the results with a baseline
+    # returns    : True if there is no regression
+    def __compare(self, results):
+        with open(self.baselinefile) as f:
+            baseline = { r['name']: r for r in json.load(f)['results'] }
+
+        retval = True
+        print("\nComparison with " + self.baselinefile)
+        for result in results:
+            if result['name'] not in baseline:
+                print("%-32s not in baseline" % result['name'])
+                continue
+            previous = baseline[result['name']]
+            for (field, unit) in [ ('wall', "s"), ('maxrss_kb', "kB") ]:
+                change = (result[field] - previous[field]) / previous[field] \
+                                                        if previous[field] > 0 else 0.0
+                regression = change > self.tolerance
+                retval = retval and not regression
+                print("%-32s %-10s %10.3f -> %10.3f %s %+6.1f%% %s" % \
+                        (result['name'], field, previous[field], result[field], unit, \
+                         change * 100, "REGRESSION" if regression else ""))
+
+        return retval
+
+
+    def run(self):
+        ffmpeg = FFmpeg(self.logger)
+
+        results = []
+        for resolution in self.resolutions:
+            for duration in self.durations:
+                retval, filename = self.__create_video(ffmpeg, resolution, duration)
+                if not retval:
+                    return False
+                retval, measurements = self.__measure(filename, \
+                                                      "%s-%ds" % (resolution, duration), \
+                                                      resolution, duration)
+                if not retval:
+                    return False
+                results = results + measurements
+
+        if self.outputfile:
+            with open(self.outputfile, 'w') as f:
+                json.dump({ 'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                            'host': platform.node(),
+                            'platform': platform.platform(),
+                            'cpus': os.cpu_count(),
+                            'python': platform.python_version(),
+                            'ffmpeg': ffmpeg.get_version(ffmpeg.get_ffmpeg_executable()),
+                            'profile': self.profilename,
+                            'options': self.gptoptions,
+                            'results': results }, f, indent = 2)
+            print("Results written to " + self.outputfile)
+
+        if self.baselinefile:
+            return self.__compare(results)
+
+        return True
+
+
+
+# MAIN
+
+if __name__ == '__main__':
+    benchmark = Benchmark()
+    if not benchmark.parse_commandline():
+        sys.exit()
+
+    if not benchmark.run():
+        sys.exit(1)
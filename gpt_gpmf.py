@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+# gpt_gpmf -- decoder for the GoPro metadata format (GPMF)
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, struct, array, calendar, datetime
+import numpy as np
+from ffmpeg import FFmpegLogger
+
+# https://github.com/gopro/gpmf-parser
+# The telemetry stream is a sequence of KLV (key, length, value) items. Each item has
+# an 8 byte header: a four character key, a type character, the size of one sample
+# and the number of samples, followed by the data padded to a multiple of 4 bytes.
+# Items of type 0 contain nested KLV items. Each payload is a DEVC item containing
+# one STRM item per sensor, which holds the sensor data and its metadata.
+# The STMP item of a stream contains the time of its first sample in microseconds,
+# the time of the other samples is interpolated up to the first sample of the next
+# payload. Streams without STMP fall back to GPSU for GPS, or else have no timestamps.
+# GPSU is only known after the first GPS fix, it is anchored to the time of the
+# payload containing the first fix, taken from the STMP of another sensor or from the
+# number of preceding payloads, which are about one second each.
+
+class GPMFDecoder:
+    # increase when the decoded columns change, cached results are not reused
+    version = 3
+    # approximate duration of a payload in seconds
+    payload_duration = 1.0
+
+    # struct format of the numeric GPMF types
+    __formats = { 'b': 'b', 'B': 'B', 's': 'h', 'S': 'H', 'l': 'i', 'L': 'I', \
+                  'j': 'q', 'J': 'Q', 'f': 'f', 'd': 'd', 'q': 'i', 'Q': 'q' }
+
+    # names of the decoded channels for each supported sensor
+    # the names of the GPS channels are the same as the ones gopro2json uses
+    # the axis order of ACCL and GYRO depends on the camera model
+    __channels = { b'GPS5': [ 'lat', 'lon', 'alt', 'spd', 'spd_3d' ], \
+                   b'TMPC': [ 'temp' ], \
+                   b'ACCL': [ 'accl_x', 'accl_y', 'accl_z' ], \
+                   b'GYRO': [ 'gyro_x', 'gyro_y', 'gyro_z' ] }
+
+    # parameters : channels : the names of the channels to decode, the values of sensors
+    #                         without any requested channel are skipped, None to decode
+    #                         all channels, utc requires GPS5
+    def __init__(self, logger, channels = None):
+        self.logger = logger
+        self.__sensors = [ key for (key, names) in self.__channels.items() \
+                               if channels is None or \
+                                  any([ name in channels for name in names ]) or \
+                                  (key == b'GPS5' and 'utc' in channels) ]
+
+        # decoded values, a typed array for each channel
+        self.columns = {}
+        # time of each value in seconds since the start of the video, a numpy array
+        # for each channel, the channels of one sensor share the same array
+        self.timestamps = {}
+
+        self.__payload_count = 0
+        # (utc, number of GPS5 samples, payload index) for each payload, GPSU contains
+        # the time of the first sample only and is interpolated when the next one is
+        # known, it is None before the first fix
+        self.__gpsu = []
+        # the first stmp of any sensor by payload index
+        self.__payload_stmp = {}
+        # (stmp, number of samples) for each payload of each sensor
+        self.__stmp = {}
+        # the first stmp of every sensor, including the skipped ones, so the timestamps
+        # don't depend on the decoded sensors
+        self.__first_stmp = {}
+        # the part of the stream which is not decoded yet
+        self.__buffer = bytearray()
+        self.__failed = False
+
+
+    # description: get the sensors which are decoded
+    # returns    : a list of the four character keys of the sensors, eg GPS5
+    def get_sensors(self):
+        return [ key.decode('latin-1') for key in self.__sensors ]
+
+
+    def __iterate_klv(self, data, offset, end):
+        while offset + 8 <= end:
+            key, typechar, size, repeat = struct.unpack_from('>4scBH', data, offset)
+            length = size * repeat
+            yield key, typechar, size, repeat, offset + 8
+            offset = offset + 8 + ((length + 3) & ~3)
+
+
+    def __unpack(self, data, offset, typechar, size, repeat):
+        fmt = self.__formats[typechar]
+        count = size * repeat // struct.calcsize(fmt)
+        values = struct.unpack_from('>' + str(count) + fmt, data, offset)
+        if typechar == 'q':
+            values = [ v / 65536.0 for v in values ]
+        elif typechar == 'Q':
+            values = [ v / 4294967296.0 for v in values ]
+        return values
+
+
+    def __parse_gpsu(self, data, offset):
+        # format yymmddhhmmss.sss
+        text = data[offset:offset + 16].decode('ascii')
+        dt = datetime.datetime.strptime(text[:12], '%y%m%d%H%M%S')
+        return calendar.timegm(dt.timetuple()) * 1000000 + \
+               int(round(float(text[12:]) * 1000000))
+
+
+    def __add_values(self, key, values, scal):
+        names = self.__channels[key]
+        for index, name in enumerate(names):
+            divisor = scal[index] if len(scal) > index else scal[0]
+            column = self.columns.setdefault(name, array.array('d'))
+            if divisor == 1:
+                column.extend(values[index::len(names)])
+            else:
+                column.extend(v / divisor for v in values[index::len(names)])
+
+
+    def __decode_strm(self, data, offset, end):
+        scal = [ 1 ]
+        gpsu = None
+        stmp = None
+        gps5count = 0
+        for key, typechar, size, repeat, valueoffset in self.__iterate_klv(data, offset, end):
+            typechar = typechar.decode('latin-1')
+            if key == b'SCAL':
+                scal = self.__unpack(data, valueoffset, typechar, size, repeat)
+            elif key == b'GPSU':
+                gpsu = self.__parse_gpsu(data, valueoffset)
+            elif key == b'STMP':
+                stmp = self.__unpack(data, valueoffset, typechar, size, repeat)[0]
+                self.__payload_stmp.setdefault(self.__payload_count, stmp)
+            elif key in self.__channels and stmp is not None:
+                self.__first_stmp.setdefault(key, stmp)
+            if key in self.__sensors and typechar in self.__formats:
+                values = self.__unpack(data, valueoffset, typechar, size, repeat)
+                self.__add_values(key, values, scal)
+                count = len(values) // len(self.__channels[key])
+                self.__stmp.setdefault(key, []).append((stmp, count))
+                if key == b'GPS5':
+                    gps5count = count
+
+        if gps5count > 0:
+            self.__gpsu.append((gpsu, gps5count, self.__payload_count))
+
+
+    def __decode_devc(self, data):
+        for key, typechar, size, repeat, valueoffset in self.__iterate_klv(data, 0, len(data)):
+            if key == b'STRM' and typechar == b'\0':
+                self.__decode_strm(data, valueoffset, valueoffset + size * repeat)
+        self.__payload_count = self.__payload_count + 1
+
+
+    # description: get the time of every sample, given the time of the first sample of
+    #              each payload, the time between two payloads is divided evenly over
+    #              the samples of the first one
+    # parameters : starts : the time of the first sample of each payload
+    #              counts : the number of samples of each payload
+    #              interval : the duration of the last payload
+    # returns    : a numpy array with the time of each sample
+    def __interpolate(self, starts, counts, interval):
+        starts = np.asarray(starts, dtype = np.float64)
+        counts = np.asarray(counts, dtype = np.int64)
+        durations = np.diff(starts, append = starts[-1] + interval)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(starts, counts) + \
+               (np.arange(counts.sum()) - first) * np.repeat(durations / counts, counts)
+
+
+    def __interpolate_utc(self):
+        payloads = [ (start, count) for (start, count, index) in self.__gpsu \
+                                            if start is not None ]
+        if payloads:
+            starts = [ p[0] for p in payloads ]
+            interval = starts[-1] - starts[-2] if len(starts) > 1 else 1000000
+            utc = self.__interpolate(starts, [ p[1] for p in payloads ], interval)
+            self.columns['utc'] = array.array('d', utc.tobytes())
+
+
+    def __get_sensor_timestamps(self, key, origin):
+        payloads = self.__stmp[key]
+        if all([ stmp is not None for (stmp, count) in payloads ]):
+            starts = [ (stmp - origin) / 1000000 for (stmp, count) in payloads ]
+        elif key == b'GPS5' and \
+             any([ utc is not None for (utc, count, index) in self.__gpsu ]):
+            starts = self.__get_gpsu_starts(origin)
+        else:
+            return None
+
+        interval = starts[-1] - starts[-2] if len(starts) > 1 else 1.0
+        return self.__interpolate(starts, [ count for (stmp, count) in payloads ], interval)
+
+
+    # description: get the time of the first GPS5 sample of each payload from GPSU
+    #              the GPS time is anchored to the payload containing the first fix, the
+    #              payloads before it are spaced by payload_duration
+    # parameters : origin : the first stmp of the recording, None if there is none
+    # returns    : a list with the time in seconds of each payload containing GPS5
+    def __get_gpsu_starts(self, origin):
+        (first_utc, count, first_index) = \
+            [ gpsu for gpsu in self.__gpsu if gpsu[0] is not None ][0]
+        anchor = (self.__payload_stmp[first_index] - origin) / 1000000 \
+                        if origin is not None and first_index in self.__payload_stmp \
+                        else first_index * self.payload_duration
+        return [ anchor + ((utc - first_utc) / 1000000 if utc is not None \
+                           else (index - first_index) * self.payload_duration) \
+                        for (utc, count, index) in self.__gpsu ]
+
+
+    def __calculate_timestamps(self):
+        # STMP counts from the start of the camera recording, which is the first payload
+        origin = min(self.__first_stmp.values()) if self.__first_stmp else None
+
+        for key, names in self.__channels.items():
+            if key not in self.__stmp:
+                continue
+            timestamps = self.__get_sensor_timestamps(key, origin)
+            if timestamps is None:
+                self.logger.log("No timestamps found for %s", key.decode('latin-1'))
+                continue
+            for name in names + ([ 'utc' ] if key == b'GPS5' else []):
+                if name in self.columns and len(self.columns[name]) == len(timestamps):
+                    self.timestamps[name] = timestamps
+
+
+    # description: decode the next part of a telemetry stream, each payload is decoded
+    #              as soon as it is complete, so the stream can be read from a pipe
+    # parameters : data : the bytes following the data passed in the previous call
+    def feed(self, data):
+        if self.__failed:
+            return
+
+        self.__buffer += data
+        offset = 0
+        try:
+            while offset + 8 <= len(self.__buffer):
+                key, typechar, size, repeat = struct.unpack_from('>4scBH', self.__buffer, offset)
+                length = (size * repeat + 3) & ~3
+                if offset + 8 + length > len(self.__buffer):
+                    break
+                if key == b'DEVC':
+                    self.__decode_devc(bytes(self.__buffer[offset + 8:offset + 8 + length]))
+                offset += 8 + length
+        except (struct.error, ValueError) as e:
+            self.logger.error("Decoding telemetry failed, error = " + str(e))
+            self.__failed = True
+        del self.__buffer[:offset]
+
+
+    # description: calculate the timestamps after the whole stream is passed to feed()
+    # returns    : True if successful
+    def finish(self):
+        if self.__buffer and not self.__failed:
+            self.logger.error("Telemetry stream is truncated")
+
+        self.__interpolate_utc()
+        self.__calculate_timestamps()
+        self.logger.log("Decoded %d telemetry payloads", self.__payload_count)
+
+        return not self.__failed
+
+
+    # description: decode a telemetry stream
+    # parameters : f : a binary file object positioned at the start of the stream, eg
+    #                  an open file or a pipe, it is read sequentially
+    # returns    : True if successful
+    def decode_stream(self, f):
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            self.feed(data)
+
+        return self.finish()
+
+
+    # description: decode a telemetry file extracted with fetch_telemetry_stream()
+    # parameters : filename : the telemetry file
+    # returns    : True if successful
+    def decode_file(self, filename):
+        self.logger.log("Decoding telemetry file " + filename)
+
+        with open(filename, 'rb') as f:
+            return self.decode_stream(f)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# gpt_json_reader -- incremental reader for the json files of gopro2json
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, json, array
+
+# Reads the records of the array with the given name one at a time, the file is never
+# loaded in memory as a whole. Only the data array of a gopro2json file is supported,
+# anything before the array name or after the array is ignored.
+class JSONRecordReader:
+    def __init__(self, f, arrayname = 'data', chunksize = 65536):
+        self.__file = f
+        self.__arrayname = '"' + arrayname + '"'
+        self.__chunksize = chunksize
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ""
+        self.__pos = 0
+        self.__eof = False
+
+
+    def __read_chunk(self):
+        chunk = self.__file.read(self.__chunksize)
+        if not chunk:
+            self.__eof = True
+            return False
+        # drop what has been parsed already to keep the buffer small
+        self.__buffer = self.__buffer[self.__pos:] + chunk
+        self.__pos = 0
+        return True
+
+
+    def __skip(self, characters):
+        while True:
+            while self.__pos < len(self.__buffer) and self.__buffer[self.__pos] in characters:
+                self.__pos = self.__pos + 1
+            if self.__pos < len(self.__buffer) or not self.__read_chunk():
+                return
+
+
+    def __find_array_start(self):
+        while True:
+            index = self.__buffer.find(self.__arrayname, self.__pos)
+            if index >= 0:
+                self.__pos = index + len(self.__arrayname)
+                self.__skip(' \t\r\n:')
+                if self.__buffer[self.__pos:self.__pos + 1] != '[':
+                    raise json.decoder.JSONDecodeError("Expecting '['", \
+                                                       self.__buffer, self.__pos)
+                self.__pos = self.__pos + 1
+                return
+            # keep the tail in case the array name is split over two chunks
+            self.__pos = max(self.__pos, len(self.__buffer) - len(self.__arrayname))
+            if not self.__read_chunk():
+                raise json.decoder.JSONDecodeError("Array " + self.__arrayname + \
+                                                   " not found", self.__buffer, self.__pos)
+
+
+    def __iter__(self):
+        self.__find_array_start()
+        while True:
+            self.__skip(' \t\r\n,')
+            if self.__pos >= len(self.__buffer):
+                raise json.decoder.JSONDecodeError("Unterminated array", \
+                                                   self.__buffer, self.__pos)
+            if self.__buffer[self.__pos] == ']':
+                return
+            try:
+                record, self.__pos = self.__decoder.raw_decode(self.__buffer, self.__pos)
+            except json.decoder.JSONDecodeError:
+                # the record may continue in the next chunk
+                if self.__eof or not self.__read_chunk():
+                    raise
+                continue
+            yield record
+
+
+
+# description: read the requested tags from a gopro2json file
+# parameters : filename : the json file
+#              tags : the tags to keep, or None to keep all tags
+# returns    : a dict containing a typed array for each tag, values which are not
+#              numeric, eg null, are NaN like the missing samples in the telemetry store
+def read_json_columns(filename, tags = None):
+    columns = {}
+    with open(filename) as f:
+        for record in JSONRecordReader(f):
+            for tag in record:
+                if tags is None or tag in tags:
+                    columns.setdefault(tag, array.array('d')).append(to_float(record[tag]))
+    return columns
+
+
+# description: convert a json value to a float
+# parameters : value : the decoded json value
+# returns    : the value as a float, or NaN if it is not numeric
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# gpt_overlay -- render the telemetry as an image stream to overlay on the video
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, io, re, math, bisect, threading
+from ffmpeg import FFmpegLogger
+from gpt_atlas import GlyphAtlas
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# the text of one plugin, changing over time
+class OverlayTextLayer:
+    def __init__(self, params, events):
+        self.params = params
+        self.starts = [ e[0] for e in events ]
+        self.ends = [ e[1] for e in events ]
+        # the texts are escaped for drawtext, the overlay draws them literally
+        self.texts = [ re.sub(r'\\(.)', r'\1', e[2]) for e in events ]
+
+
+    # description: get the text displayed at a given time, None if there is none
+    def get_text(self, t):
+        index = bisect.bisect_right(self.starts, t) - 1
+        if index >= 0 and t < self.ends[index]:
+            return self.texts[index]
+        return None
+
+
+
+# Rasterizes the text of all plugins in a transparent image the size of the video.
+# A new image is only drawn when one of the texts changes, the images are streamed to
+# ffmpeg as PNG at a low constant framerate and placed on the video with the overlay
+# filter, which repeats each image until the next one arrives. The texts are composed
+# from a GlyphAtlas, so FreeType only renders each glyph once.
+class OverlayRenderer:
+    fontfile = "/usr/share/fonts/TTF/DejaVuSans.ttf"
+    fontsize = 72
+    borderwidth = 2
+
+    def __init__(self, logger, videoproperties, cachedir = ""):
+        self.logger = logger
+        self.videoproperties = videoproperties
+        self.cachedir = cachedir
+
+        self.__layers = []
+        self.__atlas = None
+        self.__atlas_lock = threading.Lock()
+
+
+    def add_text_layer(self, params, events):
+        self.__layers.append(OverlayTextLayer(params, events))
+
+
+    def has_layers(self):
+        return len(self.__layers) > 0
+
+
+    # description: get the interval between two images in seconds, a whole number of
+    #              video frames matching the highest update rate of all plugins
+    def get_frame_interval(self):
+        framerate = self.videoproperties.framerate
+        updaterate = max([ l.params.updaterate for l in self.__layers ])
+        if updaterate <= 0 or updaterate > framerate:
+            updaterate = framerate
+        return max(1, round(framerate / updaterate)) / framerate
+
+
+    # description: get the ffmpeg input options for the image stream
+    def get_input_params(self):
+        return [ "-f", "image2pipe", \
+                 "-framerate", "{0:.6f}".format(1 / self.get_frame_interval()), \
+                 "-c:v", "png" ]
+
+
+    def __get_atlas(self):
+        if Image is None:
+            raise Exception("The overlay engine requires the Python Imaging Library (Pillow)")
+        with self.__atlas_lock:
+            if self.__atlas is None:
+                self.__atlas = GlyphAtlas(self.logger, self.fontfile, self.fontsize, \
+                                          self.borderwidth, cachedir = self.cachedir)
+        return self.__atlas
+
+
+    # description: draw the given texts on a transparent image
+    # parameters : texts : the text of each layer, None if nothing is displayed
+    # returns    : the image encoded as PNG
+    def rasterize(self, texts):
+        width = self.videoproperties.video_width
+        height = self.videoproperties.video_height
+        atlas = self.__get_atlas()
+
+        image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for layer, text in zip(self.__layers, texts):
+            if text:
+                textimage = atlas.render_text(text)
+                (x, y) = layer.params.get_position(width, height, \
+                                                   textimage.width, textimage.height)
+                image.alpha_composite(textimage, (max(0, x), max(0, y)))
+
+        output = io.BytesIO()
+        # mostly transparent, a fast compression is good enough
+        image.save(output, format = 'PNG', compress_level = 1)
+        return output.getvalue()
+
+
+    # description: generate the images for a section of the video
+    # parameters : start_time : start of the section in seconds
+    #              end_time : end of the section in seconds, None for the end of the video
+    # returns    : a generator of PNG encoded images, one for each frame interval
+    def get_frames(self, start_time = 0, end_time = None):
+        if end_time is None:
+            end_time = self.videoproperties.duration
+
+        interval = self.get_frame_interval()
+        frame_count = max(1, math.ceil((end_time - start_time) / interval - 1e-6))
+        self.logger.log("Streaming %d overlay images", frame_count)
+
+        previous_texts = None
+        frame = None
+        rasterized = 0
+        for index in range(frame_count):
+            t = start_time + index * interval
+            texts = [ layer.get_text(t) for layer in self.__layers ]
+            if texts != previous_texts:
+                frame = self.rasterize(texts)
+                previous_texts = texts
+                rasterized = rasterized + 1
+            yield frame
+
+        self.logger.log("Rasterized %d overlay images", rasterized)
+        if self.__atlas is not None:
+            self.__atlas.save()
@@ -16,34 +16,176 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, getopt
+import sys, os, getopt, glob
+from xml.dom import minidom
 from ffmpeg import FFmpegLogger
+from ffmpeg import FFmpegEncodingProfile
+from ffmpeg import FFmpegProgress
 
 class Parameters:
     def __init__(self):
         # default parameters
         self.filename = ""
+        self.filenames = []
+        self.chapters = False
+        # the chapters of the recording, when processing chapters as a single video
+        self.chapterfiles = []
         self.configfile = "gpt_config.xml"
         self.overwrite = False
+        self.gopro2json = False
+        self.parallel = 1
+        self.workers = 1
+        self.threads = os.cpu_count() or 1
+        # nothing but the rendered video is written unless a cache directory is given
+        self.cachedir = ""
+        self.cachesize = 1024
+        # maximum number of simultaneous ffmpeg processes, 0 for unlimited
+        self.processes = 0
+        # maximum duration of an ffmpeg process in seconds, 0 for unlimited
+        self.timeout = 0
+        self.profilename = ""
+        self.profileoverrides = []
+        self.preview = False
+        self.preview_start = 0.0
+        self.preview_duration = 10.0
+        self.preview_scale = "-2:360"
+        self.engine = "drawtext"
+        self.smart = False
+        self.progress = FFmpegProgress.mode_display
+        # file to write the Chrome trace of all processing stages to, empty to disable
+        self.tracefile = ""
+        # a list of (start_time, end_time) where telemetry is displayed, None for always
+        self.ranges = None
         self.logger = FFmpegLogger(FFmpegLogger.verbosity_off)
 
 
     def __usage(self):
-        print("Usage: " + sys.argv[0] + " [OPTION]... inputfile\n"
+        print("Usage: " + sys.argv[0] + " [OPTION]... inputfile...\n"
               "Rerender input movie with speed and position on screen\n\n"
               "  -c --config       Configuration file (default = " + self.configfile + ")\n"
               "  -o --overwrite    Overwrite generated files (default = no)\n"
+              "  -a --chapters     Render all chapters of a GoPro recording as one video\n"
+              "                    (default = no)\n"
+              "  -j --gopro2json   Parse telemetry with gopro2json instead of the\n"
+              "                    builtin decoder\n"
+              "  -p --parallel     Number of segments to render in parallel (default = " + \
+                                   str(self.parallel) + ")\n"
+              "  -w --workers      Number of input files to process simultaneously\n"
+              "                    (default = " + str(self.workers) + ")\n"
+              "  -t --threads      Total number of threads for all ffmpeg processes\n"
+              "                    (default = " + str(self.threads) + ")\n"
+              "  -i --processes    Maximum number of simultaneous ffmpeg processes, 0 for\n"
+              "                    unlimited (default = " + str(self.processes) + ")\n"
+              "  -u --timeout      Maximum duration of an ffmpeg process in seconds, 0 for\n"
+              "                    unlimited (default = " + str(self.timeout) + ")\n"
+              "  -d --cachedir     Cache directory, caching is disabled without one, eg\n"
+              "                    ~/.cache/gopro-telemetry\n"
+              "  -m --cachesize    Maximum size of the cache directory in MB, 0 for\n"
+              "                    unlimited (default = " + str(self.cachesize) + ")\n"
+              "  -e --profile      Encoding profile from the configuration file\n"
+              "  -s --set          Override a setting of the encoding profile, eg crf=20\n"
+              "  -n --engine       Render text with the ffmpeg drawtext filter (drawtext)\n"
+              "                    or in python as an overlay stream (overlay)\n"
+              "                    (default = " + self.engine + ")\n"
+              "  -k --smart        Only re-encode the parts of the video where telemetry is\n"
+              "                    displayed, copy the other parts (default = no)\n"
+              "  -l --ranges       Only display telemetry in the given time ranges in\n"
+              "                    seconds, eg 0-10,60-90\n"
+              "  -r --preview      Quick low resolution render of a part of the video,\n"
+              "                    given as start,duration[,scale] eg 60,10 or 60,10,-2:720\n"
+              "                    (default scale = " + self.preview_scale + ")\n"
+              "  -g --progress     Report the progress of ffmpeg as a status line (display),\n"
+              "                    as machine readable lines on stderr (machine) or not at\n"
+              "                    all (off) (default = " + self.progress + ")\n"
+              "  -x --trace        Write the time spent in each processing stage to a file\n"
+              "                    in Chrome trace format and display a summary\n"
               "  -v --verbose      Display extra information while processing\n"
               "  -vv               Display extra information and subprocess output\n"
               "  -h --help         Display help and exit\n")
 
 
+    # description: expand directories and wildcards in the input files
+    #              directories are searched for MP4 files, rendered files are skipped
+    def __expand_filenames(self, args):
+        filenames = []
+        for arg in args:
+            if os.path.isdir(arg):
+                filenames = filenames + \
+                    sorted([ os.path.join(arg, f) for f in os.listdir(arg) \
+                                if f.lower().endswith(".mp4") and \
+                                   not f.lower().endswith(".rendered.mp4") and \
+                                   not f.lower().endswith(".preview.mp4") ])
+            elif any(c in arg for c in "*?["):
+                filenames = filenames + sorted(glob.glob(arg))
+            else:
+                filenames.append(arg)
+        return filenames
+
+
+    # description: parse the argument of the preview option: start,duration[,scale]
+    def __parse_preview(self, arg):
+        fields = arg.split(',')
+        if len(fields) < 2 or len(fields) > 3:
+            return False
+        try:
+            self.preview_start = max(0.0, float(fields[0]))
+            self.preview_duration = float(fields[1])
+        except ValueError:
+            return False
+        if len(fields) == 3:
+            self.preview_scale = fields[2]
+        self.preview = self.preview_duration > 0
+        return self.preview
+
+
+    # description: parse the argument of the ranges option: start-end[,start-end]...
+    def __parse_ranges(self, arg):
+        ranges = []
+        for field in arg.split(','):
+            bounds = field.split('-')
+            if len(bounds) != 2:
+                return False
+            try:
+                start_time = float(bounds[0])
+                end_time = float(bounds[1])
+            except ValueError:
+                return False
+            if end_time <= start_time:
+                return False
+            ranges.append((start_time, end_time))
+        self.ranges = sorted(ranges)
+        return True
+
+
+    # description: get the number of threads each ffmpeg process may use
+    #              the thread budget is divided over all simultaneous processes
+    def get_threads_per_job(self):
+        return max(1, self.threads // self.workers)
+
+
     # returns True if parameters could be parsed successfully
     def parse_commandline(self):
         try:
-            opts, args = getopt.getopt(sys.argv[1:], "c:ovh", [
+            opts, args = getopt.getopt(sys.argv[1:], "c:oajp:w:t:i:u:d:m:e:s:kl:r:n:g:x:vh", [
                 "config=",
                 "overwrite",
+                "chapters",
+                "gopro2json",
+                "parallel=",
+                "workers=",
+                "threads=",
+                "processes=",
+                "timeout=",
+                "cachedir=",
+                "cachesize=",
+                "profile=",
+                "set=",
+                "smart",
+                "ranges=",
+                "preview=",
+                "engine=",
+                "progress=",
+                "trace=",
                 "verbose",
                 "help"])
         except getopt.GetoptError:
@@ -57,21 +199,150 @@ class Parameters:
                 self.configfile = str(arg)
             elif opt in ("-o", "--overwrite"):
                 self.overwrite = True
+            elif opt in ("-a", "--chapters"):
+                self.chapters = True
+            elif opt in ("-j", "--gopro2json"):
+                self.gopro2json = True
+            elif opt in ("-d", "--cachedir"):
+                self.cachedir = str(arg)
+            elif opt in ("-m", "--cachesize", "-i", "--processes", "-u", "--timeout"):
+                try:
+                    value = max(0, int(arg))
+                except ValueError:
+                    self.__usage()
+                    return False
+                if opt in ("-m", "--cachesize"):
+                    self.cachesize = value
+                elif opt in ("-i", "--processes"):
+                    self.processes = value
+                else:
+                    self.timeout = value
+            elif opt in ("-e", "--profile"):
+                self.profilename = str(arg)
+            elif opt in ("-s", "--set"):
+                if '=' not in arg:
+                    self.__usage()
+                    return False
+                self.profileoverrides.append(tuple(str(arg).split('=', 1)))
+            elif opt in ("-n", "--engine"):
+                if arg not in ("drawtext", "overlay"):
+                    self.__usage()
+                    return False
+                self.engine = str(arg)
+            elif opt in ("-g", "--progress"):
+                if arg not in FFmpegProgress.modes:
+                    self.__usage()
+                    return False
+                self.progress = str(arg)
+            elif opt in ("-x", "--trace"):
+                self.tracefile = str(arg)
+            elif opt in ("-k", "--smart"):
+                self.smart = True
+            elif opt in ("-l", "--ranges"):
+                if not self.__parse_ranges(str(arg)):
+                    self.__usage()
+                    return False
+            elif opt in ("-r", "--preview"):
+                if not self.__parse_preview(str(arg)):
+                    self.__usage()
+                    return False
+            elif opt in ("-p", "--parallel", "-w", "--workers", "-t", "--threads"):
+                try:
+                    value = max(1, int(arg))
+                except ValueError:
+                    self.__usage()
+                    return False
+                if opt in ("-p", "--parallel"):
+                    self.parallel = value
+                elif opt in ("-w", "--workers"):
+                    self.workers = value
+                else:
+                    self.threads = value
             elif opt in ("-v", "--verbose"):
                 self.logger.increase_verbosity()
         
         retval = True
-        try:
-            self.filename = args[0]
-        except:
+        self.filenames = self.__expand_filenames(args)
+        if self.filenames:
+            self.filename = self.filenames[0]
+        else:
             self.logger.error("Nothing to do!")
             retval = False
 
         self.logger.log("Parameters:")
-        self.logger.log("filename = " + self.filename)
+        self.logger.log("filenames = " + ", ".join(self.filenames))
         self.logger.log("configuration file = " + self.configfile)
         self.logger.log("overwrite = " + str(self.overwrite))
+        self.logger.log("chapters = " + str(self.chapters))
+        self.logger.log("gopro2json = " + str(self.gopro2json))
+        self.logger.log("parallel = " + str(self.parallel))
+        self.logger.log("workers = " + str(self.workers))
+        self.logger.log("threads = " + str(self.threads))
+        self.logger.log("processes = " + str(self.processes))
+        self.logger.log("timeout = " + str(self.timeout))
+        self.logger.log("cache directory = " + self.cachedir)
+        self.logger.log("cache size = " + str(self.cachesize) + " MB")
+        self.logger.log("encoding profile = " + self.profilename)
+        self.logger.log("engine = " + self.engine)
+        self.logger.log("smart = " + str(self.smart))
+        self.logger.log("progress = " + self.progress)
+        self.logger.log("trace file = " + self.tracefile)
+        if self.ranges is not None:
+            self.logger.log("ranges = " + ", ".join([ "%.3f-%.3f" % r for r in self.ranges ]))
+        self.logger.log("preview = " + str(self.preview))
+        if self.preview:
+            self.logger.log("preview start = " + str(self.preview_start))
+            self.logger.log("preview duration = " + str(self.preview_duration))
+            self.logger.log("preview scale = " + self.preview_scale)
         self.logger.log("verbosity level = " + str(self.logger.verbositylevel))
 
         return retval
 
+
+    def __get_xml_subtag_value(self, xmlnode, sublabelname, defaultvalue):
+        elements = xmlnode.getElementsByTagName(sublabelname)
+        return str(elements[0].firstChild.nodeValue) \
+                      if elements and elements[0].childNodes \
+                      else defaultvalue
+
+
+    # description: read the selected encoding profile from the configuration file
+    #              the profile is selected on the command line, or else by the default
+    #              element of the encoding section, overrides are applied afterwards
+    #              a preview uses the preview profile, or a fast builtin one
+    # returns    : True if successful and an instance of FFmpegEncodingProfile
+    def read_encoding_profile(self):
+        xmldoc = minidom.parse(self.configfile)
+        xmlgpt = xmldoc.getElementsByTagName('goprotelemetry')[0]
+        xmlencodinglist = xmlgpt.getElementsByTagName('encoding')
+
+        profilename = self.profilename
+        if not profilename and self.preview:
+            profilename = "preview"
+        elif not profilename and xmlencodinglist:
+            profilename = self.__get_xml_subtag_value(xmlencodinglist[0], 'default', '')
+
+        profile = FFmpegEncodingProfile(self.logger, profilename if profilename else "default")
+
+        if profilename:
+            xmlprofiles = [ p for p in xmlgpt.getElementsByTagName('profile') \
+                                if self.__get_xml_subtag_value(p, 'name', '') == profilename ]
+            if xmlprofiles:
+                for setting in FFmpegEncodingProfile.settings:
+                    profile.set(setting, \
+                                self.__get_xml_subtag_value(xmlprofiles[0], setting, ''))
+            elif profilename == "preview" and not self.profilename:
+                # a preview is thrown away, favour speed over quality
+                profile.set("preset", "ultrafast")
+                profile.set("crf", "30")
+            else:
+                self.logger.error("Encoding profile " + profilename + " not found")
+                return False, profile
+
+        for (setting, value) in self.profileoverrides:
+            if not profile.set(setting, value):
+                return False, profile
+
+        profile.log()
+
+        return True, profile
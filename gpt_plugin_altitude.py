@@ -16,41 +16,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os, tempfile
-
-def render(params, jsondata, ffmpeg, inputfile, outputfile, overwrite = False):
-    # write to tempfile
-    (fd, temptextfile) = tempfile.mkstemp(prefix = "gpt_plugin_altitude", suffix = ".txt")
-    f = os.fdopen(fd, 'w')
-
-    start_time = 0
-    textpos = params.get_position_ffmpeg()
-    for jd in jsondata[:-1]:  # TODO: investigate why last record crashes ffmpeg
-        text = "Altitude\\ {0:.1f}".format(jd[0])
-        f.write("{0:.3f}-{1:.3f} [enter] ".format(start_time, start_time + jd[1]))
-        f.write("drawtext reinit 'text={0}:{1}';\n".format(text, textpos))
-        start_time = start_time + jd[1]
-
-    f.close()
-
-    # render
-    retval = ffmpeg.apply_custom_filter(\
-                inputfile, \
-                ["-acodec", "copy",
-                 "-vf", "sendcmd=f=" + temptextfile + "," + \
-                        "drawtext=text='':" + \
-                                 "fontfile=/usr/share/fonts/TTF/DejaVuSans.ttf:" + \
-                                 "fontsize=72:" + \
-                                 "borderw=2:" + \
-                                 "bordercolor=0x000000:" + \
-                                 "fontcolor=0xFFFFFF",], \
-                outputfile,
-                overwrite)
-
-    # remove temp file
-    if temptextfile and os.path.isfile(temptextfile):
-        params.logger.log("Removing temp file " + temptextfile)
-        os.remove(temptextfile)
-    
-    return retval
+import sys, os
+from gpt_sendcmd import add_drawtext_filter, get_drawtext_requirements
 
+def format_value(value):
+    return "Altitude\\ {0:.1f}".format(value)
+
+
+def get_requirements(params):
+    return get_drawtext_requirements(params)
+
+
+def create_filter(params, jsondata, renderer):
+    # TODO: investigate why last record crashes ffmpeg
+    return add_drawtext_filter(params, jsondata[:-1], format_value, renderer)
@@ -16,8 +16,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os, json
+import sys, os
+from gpt_sendcmd import add_drawtext_filter, get_drawtext_requirements
 
-def render(params, jsondata, ffmpeg, inputfile, outputfile, overwrite = False):
-    pass
+# the jsontag contains two channels, each value is a list [ lat, lon ]
+def format_value(value):
+    return "{0:.5f}{1}\\ {2:.5f}{3}".format(abs(value[0]), "N" if value[0] >= 0 else "S", \
+                                           abs(value[1]), "E" if value[1] >= 0 else "W")
+
+
+def get_requirements(params):
+    return get_drawtext_requirements(params)
+
+
+def create_filter(params, jsondata, renderer):
+    return add_drawtext_filter(params, jsondata, format_value, renderer)
 
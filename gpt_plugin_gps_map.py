@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+
+# gpt_plugin_gps_map -- render a map with the GPS track on gopro movies
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, math, hashlib
+import numpy as np
+from gpt_sendcmd import get_drawtext_requirements
+from gpt_tiles import TileSource, project
+
+try:
+    from PIL import Image, ImageDraw, ImageColor
+except ImportError:
+    Image = None
+
+# The map is drawn once for each view: the tiles of a part of the world with the whole
+# track on top. The views are overlaid on the video as a sequence of still images, each
+# one until the next view starts, only the position marker moves. Every update of the
+# position sends the overlay filter of the marker an expression moving it linearly to
+# the next position, so ffmpeg animates the marker between the updates. With a fixed
+# zoom level the map follows the track, a new view starts whenever the track leaves
+# the current one.
+
+# increase when the rendered maps change, cached maps are not reused
+mapversion = 1
+# highest zoom level used when the whole track is displayed
+maxzoom = 17
+# minimum distance in pixels between the track and the edge of a view
+margin = 20
+# x coordinate of the marker when there is no position
+hidden = -10000
+
+def get_requirements(params):
+    return get_drawtext_requirements(params)
+
+
+def _get_param(params, name, default):
+    return params.pluginparams.get(name, default)
+
+
+# description: find the views needed to display the track
+# parameters : times, x, y : the time and the pixel coordinates of each position
+#              width, height : the size of the map
+# returns    : a list of (start_time, x, y) with the top left corner of each view
+def get_views(times, x, y, width, height):
+    views = []
+    start_time = 0.0
+    bounds = None
+    for (t, px, py) in zip(times.tolist(), x.tolist(), y.tolist()):
+        if bounds is None:
+            bounds = [ px, px, py, py ]
+            continue
+        extended = [ min(bounds[0], px), max(bounds[1], px), \
+                     min(bounds[2], py), max(bounds[3], py) ]
+        if extended[1] - extended[0] > width - 2 * margin or \
+           extended[3] - extended[2] > height - 2 * margin:
+            views.append((start_time, bounds))
+            start_time = t
+            extended = [ px, px, py, py ]
+        bounds = extended
+    views.append((start_time, bounds if bounds else [ 0, 0, 0, 0 ]))
+
+    return [ (start_time, int(round((b[0] + b[1] - width) / 2)), \
+                          int(round((b[2] + b[3] - height) / 2))) \
+             for (start_time, b) in views ]
+
+
+# description: get the highest zoom level at which the whole track fits in the map
+def get_zoom(lat, lon, width, height):
+    for zoom in range(maxzoom, 0, -1):
+        (x, y) = project(lat, lon, zoom)
+        if len(x) == 0 or (np.ptp(x) <= width - 2 * margin and \
+                           np.ptp(y) <= height - 2 * margin):
+            return zoom
+    return 0
+
+
+# description: get the track as lines of pixel coordinates, broken up where positions
+#              are missing, consecutive positions on the same pixel are left out
+def get_track_lines(x, y):
+    lines = []
+    valid = ~(np.isnan(x) | np.isnan(y))
+    # the start and end of each run of valid positions
+    edges = np.flatnonzero(np.diff(np.concatenate(([ 0 ], valid.astype(np.int8), [ 0 ]))))
+    for (start, end) in zip(edges[::2], edges[1::2]):
+        points = np.column_stack((np.round(x[start:end]), np.round(y[start:end])))
+        keep = np.ones(len(points), dtype = bool)
+        keep[1:] = np.any(points[1:] != points[:-1], axis = 1)
+        lines.append(points[keep].astype(np.int64))
+    return lines
+
+
+# description: get the tiles covering a view of the map
+# returns    : a list of the column and row of each tile
+def get_view_tiles(left, top, width, height, tilesize):
+    return [ (tx, ty) for ty in range(top // tilesize, (top + height - 1) // tilesize + 1) \
+                      for tx in range(left // tilesize, (left + width - 1) // tilesize + 1) ]
+
+
+# description: draw a view of the map
+# parameters : tiles : a TileSource, or None to draw the track on the background only
+#              zoom, left, top : the zoom level and the top left corner of the view
+#              width, height : the size of the view
+#              lines : the track, see get_track_lines()
+#              style : the colors and width of the track, see _get_style()
+# returns    : an RGBA image
+def draw_view(tiles, zoom, left, top, width, height, lines, style):
+    image = Image.new('RGBA', (width, height), style['background'])
+
+    if tiles is not None:
+        for (tx, ty) in get_view_tiles(left, top, width, height, tiles.tilesize):
+            tile = tiles.get_tile(zoom, tx, ty)
+            if tile is not None:
+                image.alpha_composite(tile, (tx * tiles.tilesize - left, \
+                                             ty * tiles.tilesize - top))
+
+    draw = ImageDraw.Draw(image)
+    for line in lines:
+        points = [ (px - left, py - top) for (px, py) in line.tolist() ]
+        if len(points) > 1:
+            draw.line(points, fill = style['trackcolor'], width = style['trackwidth'], \
+                      joint = 'curve')
+
+    return image
+
+
+def draw_marker(style):
+    size = style['markersize']
+    image = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((0, 0, size - 1, size - 1), fill = style['markercolor'], \
+                 outline = (255, 255, 255, 255), width = max(1, size // 8))
+    return image
+
+
+# description: store an image in the cache of the renderer, or else in a temporary
+#              file which is removed after rendering
+# parameters : renderer : the Renderer
+#              key : a hash of everything the image depends on
+#              draw_func : function returning the image, only called when the image is
+#                          not cached
+# returns    : the filename of the image
+def get_image_file(renderer, key, draw_func):
+    cache = renderer.cache
+    if not cache.is_enabled():
+        f, filename = renderer.create_tempfile("gpt_map", ".png")
+        f.close()
+        draw_func().save(filename, format = 'PNG')
+        return filename
+
+    filename = cache.lookup("map", key, ".png")
+    if filename:
+        return filename
+
+    tempfilename = cache.create_tempfile("map", ".png")
+    try:
+        draw_func().save(tempfilename, format = 'PNG')
+    except Exception:
+        cache.discard(tempfilename)
+        raise
+    return cache.commit(tempfilename, "map", key, ".png")
+
+
+def _get_style(params):
+    return { 'background': ImageColor.getcolor(_get_param(params, "background", "#e0e0e0"), \
+                                              'RGBA'), \
+             'trackcolor': ImageColor.getcolor(_get_param(params, "trackcolor", "#0050ff"), \
+                                              'RGBA'), \
+             'trackwidth': int(_get_param(params, "trackwidth", "4")), \
+             'markercolor': ImageColor.getcolor(_get_param(params, "markercolor", "#ff2000"), \
+                                               'RGBA'), \
+             'markersize': int(_get_param(params, "markersize", "16")) }
+
+
+# description: get the commands moving the marker
+# parameters : instance : the overlay filter instance of the marker
+#              times, x, y : the time and position of the marker on the video at each
+#                            update, x is NaN when there is no position
+#              views : the index of the view displayed at each update
+#              end_time : the end of the last update
+#              interpolate : move the marker to the next position, or else keep it in
+#                            place until the next update
+# returns    : a list of (start_time, end_time, command)
+def get_marker_commands(instance, times, x, y, views, end_time, interpolate):
+    commands = []
+    ends = times.tolist()[1:] + [ end_time ]
+    previous = None
+    for i, (t0, t1) in enumerate(zip(times.tolist(), ends)):
+        if math.isnan(x[i]):
+            position = ("%d" % hidden, "0")
+        elif interpolate and i + 1 < len(times) and not math.isnan(x[i + 1]) and \
+             views[i + 1] == views[i] and (x[i + 1] != x[i] or y[i + 1] != y[i]):
+            position = tuple([ "%.1f%+.4f*(t+{section_start}-%.3f)" % \
+                                    (v[i], (v[i + 1] - v[i]) / (t1 - t0), t0) \
+                               for v in (x, y) ])
+        else:
+            position = ("%.1f" % x[i], "%.1f" % y[i])
+
+        if previous == position and "t" not in position[0]:
+            # the marker doesn't move, extend the previous command
+            commands[-1] = (commands[-1][0], t1, commands[-1][2])
+        else:
+            commands.append((t0, t1, "%s x '%s', %s y '%s'" % \
+                                        (instance, position[0], instance, position[1])))
+        previous = position
+    return commands
+
+
+def _open_tiles(params):
+    tilepath = _get_param(params, "tiles", "")
+    return TileSource(params.logger, os.path.expanduser(tilepath)) if tilepath else None
+
+
+# description: get the zoom level and the views of the map
+# returns    : the zoom level, the pixel coordinates of each position, NaN when there is
+#              no position, and the views, see get_views()
+def _get_map(params, jsondata):
+    width = int(_get_param(params, "width", "320"))
+    height = int(_get_param(params, "height", "320"))
+    zoom = int(_get_param(params, "zoom", "0"))
+
+    lat = jsondata.values[:, 0]
+    lon = jsondata.values[:, 1]
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    if zoom <= 0:
+        zoom = get_zoom(lat[valid], lon[valid], width, height)
+    (x, y) = project(lat, lon, zoom)
+    views = get_views(jsondata.timestamps[valid], x[valid], y[valid], width, height)
+    return zoom, x, y, views
+
+
+# description: get the identity of the tiles of each view, see TileSource.get_identity()
+def _get_tiles_identities(params, tiles, zoom, views):
+    width = int(_get_param(params, "width", "320"))
+    height = int(_get_param(params, "height", "320"))
+    return [ tiles.get_identity(zoom, get_view_tiles(left, top, width, height, \
+                                                     tiles.tilesize)) \
+                 if tiles else "" \
+             for (start_time, left, top) in views ]
+
+
+# description: get what the layer depends on besides the configuration and the data,
+#              the tiles, so the layer is rendered again when they change
+# returns    : a string, or None if the layer can't be cached
+def get_layer_key(params, jsondata):
+    if jsondata.values.ndim != 2 or jsondata.values.shape[1] != 2:
+        return None
+
+    try:
+        tiles = _open_tiles(params)
+    except Exception:
+        return None
+    try:
+        (zoom, x, y, views) = _get_map(params, jsondata)
+        return "%d:%s" % (mapversion, ";".join(_get_tiles_identities(params, tiles, zoom, views)))
+    finally:
+        if tiles:
+            tiles.close()
+
+
+def create_filter(params, jsondata, renderer):
+    if jsondata.values.ndim != 2 or jsondata.values.shape[1] != 2:
+        params.logger.error("The GPS map requires the jsontag lat,lon")
+        return False
+    if Image is None:
+        raise Exception("The GPS map requires the Python Imaging Library (Pillow)")
+
+    width = int(_get_param(params, "width", "320"))
+    height = int(_get_param(params, "height", "320"))
+    style = _get_style(params)
+
+    try:
+        tiles = _open_tiles(params)
+    except Exception as e:
+        params.logger.error(str(e))
+        return False
+
+    try:
+        (zoom, x, y, views) = _get_map(params, jsondata)
+        params.logger.log("Drawing %d map view(s) at zoom level %d", len(views), zoom)
+
+        # the key of each view depends on the whole track, the style and its tiles
+        h = hashlib.sha1()
+        h.update(("%d:%d:%d:%d:%s" % (mapversion, zoom, width, height, \
+                                      sorted(style.items()))).encode('utf-8'))
+        lines = get_track_lines(x, y)
+        for line in lines:
+            h.update(line.tobytes())
+        trackkey = h.hexdigest()
+
+        images = []
+        identities = _get_tiles_identities(params, tiles, zoom, views)
+        for ((start_time, left, top), identity) in zip(views, identities):
+            key = hashlib.sha1(("%s:%s:%d:%d" % (trackkey, identity, left, top)) \
+                                    .encode('utf-8')).hexdigest()
+            imagefile = get_image_file(renderer, key, \
+                            lambda: draw_view(tiles, zoom, left, top, width, height, \
+                                              lines, style))
+            images.append((start_time, imagefile))
+    finally:
+        if tiles:
+            tiles.close()
+
+    # a single overlay displays each view until the next one starts
+    (mapx, mapy) = params.get_position(renderer.videoproperties.video_width, \
+                                       renderer.videoproperties.video_height, \
+                                       width, height)
+    if not renderer.add_image_sequence(renderer.get_instance_name("overlay"), images, \
+                                       str(mapx), str(mapy)):
+        return False
+
+    # the marker positions, as often as the position is updated
+    series = jsondata
+    framerate = renderer.videoproperties.framerate
+    if framerate > 0 and params.updaterate > 0:
+        series = jsondata.resample(max(1, round(framerate / params.updaterate)) / framerate, \
+                                   params.interpolate, params.maxgap if params.maxgap > 0 \
+                                                                     else None)
+    (markerx, markery) = project(series.values[:, 0], series.values[:, 1], zoom)
+    markerviews = np.maximum(np.searchsorted([ v[0] for v in views ], series.timestamps, \
+                                             side = 'right') - 1, 0)
+    half = style['markersize'] / 2
+    markerx = mapx + markerx - np.array([ views[v][1] for v in markerviews ]) - half
+    markery = mapy + markery - np.array([ views[v][2] for v in markerviews ]) - half
+
+    markerkey = hashlib.sha1(("%d:marker:%s" % (mapversion, sorted(style.items()))) \
+                                .encode('utf-8')).hexdigest()
+    markerfile = get_image_file(renderer, markerkey, lambda: draw_marker(style))
+    instance = renderer.get_instance_name("overlay")
+    if not renderer.add_image(instance, markerfile, str(hidden), "0"):
+        return False
+    renderer.add_commands(get_marker_commands(instance, series.timestamps, markerx, markery, \
+                                              markerviews, series.end_time, \
+                                              params.interpolate))
+
+    return True
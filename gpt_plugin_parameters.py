@@ -36,6 +36,9 @@ class PluginParameters:
         self.vertpos = self.POS_VERT_BOTTOM
         self.pluginlib = ""
         self.jsontag = ""
+        self.updaterate = 4.0
+        self.interpolate = True
+        self.maxgap = 2.0
         self.pluginparams = {}
 
 
@@ -67,11 +70,19 @@ class PluginParameters:
         
         self.pluginlib = self.__get_xml_subtag_value(xmlnode, 'pluginlib', '')
         self.jsontag = self.__get_xml_subtag_value(xmlnode, 'jsontag', '')
+        self.updaterate = float(self.__get_xml_subtag_value(xmlnode, 'updaterate', \
+                                                            str(self.updaterate)))
+        self.interpolate = self.__get_xml_subtag_value(xmlnode, 'interpolate', \
+                                                       str(self.interpolate)).lower() == "true"
+        self.maxgap = float(self.__get_xml_subtag_value(xmlnode, 'maxgap', str(self.maxgap)))
         
         self.logger.log("Plugin parameters:")
         self.logger.log("horizpos = " + hpos)
         self.logger.log("vertpos = " + vpos)
         self.logger.log("jsontag = " + self.jsontag)
+        self.logger.log("updaterate = " + str(self.updaterate))
+        self.logger.log("interpolate = " + str(self.interpolate))
+        self.logger.log("maxgap = " + str(self.maxgap))
         
         for param in xmlnode.getElementsByTagName('params')[0].childNodes:
             if param.nodeType == param.ELEMENT_NODE:
@@ -81,6 +92,11 @@ class PluginParameters:
             self.logger.log(param + " = " + self.pluginparams[param])
 
 
+    # description: get the channels in the jsontag, eg lat,lon contains two channels
+    def get_channels(self):
+        return [ tag.strip() for tag in self.jsontag.split(',') if tag.strip() ]
+
+
     def get_position_ffmpeg(self):
         xpos = "x="
         if self.horizpos == self.POS_HORIZ_LEFT:
@@ -99,3 +115,23 @@ class PluginParameters:
             ypos = ypos + "H-th-10"
         return xpos + ":" + ypos
 
+
+    # description: get the position of an element, as get_position_ffmpeg() does
+    # parameters : width, height : the dimensions of the video frame
+    #              elementwidth, elementheight : the dimensions of the element
+    # returns    : the x and y coordinate of the top left corner of the element
+    def get_position(self, width, height, elementwidth, elementheight):
+        if self.horizpos == self.POS_HORIZ_LEFT:
+            xpos = 10
+        elif self.horizpos == self.POS_HORIZ_CENTER:
+            xpos = (width - elementwidth) // 2
+        else:
+            xpos = width - elementwidth - 10
+
+        if self.vertpos == self.POS_VERT_TOP:
+            ypos = 10
+        elif self.vertpos == self.POS_VERT_CENTER:
+            ypos = (height - elementheight) // 2
+        else:
+            ypos = height - elementheight - 10
+        return xpos, ypos
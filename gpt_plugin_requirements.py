@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# gpt_plugin_requirements.py -- telemetry data needed by gopro-telemetry plugins
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os
+from gpt_telemetry_store import derived_channels
+
+# The telemetry data a plugin needs. A plugin module declares its requirements with a
+# function get_requirements(params), which returns an instance of this class. Only the
+# channels required by the enabled plugins are decoded and kept in memory.
+class PluginRequirements:
+    def __init__(self, channels = [], derived = [], samplerate = 0):
+        # the decoded channels, eg spd or lat and lon
+        self.channels = list(channels)
+        # the channels calculated from decoded channels, see derived_channels
+        self.derived = list(derived)
+        # maximum number of values per second the plugin uses, 0 for all values
+        self.samplerate = samplerate
+
+
+    def get_tags(self):
+        return self.channels + self.derived
+
+
+    # description: get the decoded channels needed to calculate all required channels
+    def get_source_channels(self):
+        sources = list(self.channels)
+        for tag in self.derived:
+            sources = sources + [ source for source in derived_channels[tag][0] \
+                                                    if source not in sources ]
+        return sources
+
+
+
+# description: get the requirements of a plugin which doesn't declare them, all values
+#              of the channels in its jsontag
+# parameters : params : the PluginParameters of the plugin
+#              samplerate : maximum number of values per second, 0 for all values
+# returns    : a PluginRequirements instance
+def get_default_requirements(params, samplerate = 0):
+    tags = params.get_channels()
+    return PluginRequirements([ tag for tag in tags if tag not in derived_channels ], \
+                              [ tag for tag in tags if tag in derived_channels ], \
+                              samplerate)
+
+
+# description: combine the requirements of all plugins
+# parameters : requirements : a list of PluginRequirements
+# returns    : a dictionary with the maximum number of values per second of each
+#              required channel, 0 for all values, and a set of the decoded channels
+#              needed to calculate them
+def merge_requirements(requirements):
+    samplerates = {}
+    for r in requirements:
+        for tag in r.get_tags():
+            if r.samplerate <= 0 or samplerates.get(tag, -1) == 0:
+                samplerates[tag] = 0
+            else:
+                samplerates[tag] = max(samplerates.get(tag, 0), r.samplerate)
+
+    sources = set()
+    for r in requirements:
+        sources.update(r.get_source_channels())
+
+    return samplerates, sources
@@ -0,0 +1,750 @@
+#!/usr/bin/env python
+
+# gpt_renderer -- combine the filters of all plugins in a single ffmpeg pass
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, re, copy, tempfile, shutil
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg import FFmpegLogger
+from ffmpeg import FFmpeg
+from ffmpeg import FFmpegCache
+from gpt_sendcmd import get_drawtext_commands, clip_events
+from gpt_overlay import OverlayRenderer
+
+# description: escape a filter option value, eg a filename, for use in a filter graph
+#              the value is escaped for the option parser and again for the filter
+#              graph parser, see the quoting and escaping section of ffmpeg-filters
+def escape_filter_value(value):
+    value = re.sub(r"([\\':])", r"\\\1", value)
+    return re.sub(r"([\\'\[\],;])", r"\\\1", value)
+
+
+# The filters, commands and texts added by one plugin can be recorded as a layer,
+# which can be stored and added again later without running the plugin.
+class Renderer:
+    # increase when the contents of a layer change, stored layers are not reused
+    layerversion = 4
+    # encoders producing a stream which can be joined with a stream of the given codec
+    __encoders = { 'h264': [ 'libx264', 'h264_nvenc', 'h264_qsv', 'h264_vaapi', \
+                             'h264_videotoolbox' ], \
+                   'hevc': [ 'libx265', 'hevc_nvenc', 'hevc_qsv', 'hevc_vaapi', \
+                             'hevc_videotoolbox' ] }
+
+    def __init__(self, logger, videoproperties, engine = "drawtext", cache = None, \
+                 ranges = None):
+        self.logger = logger
+        self.videoproperties = videoproperties
+        # the FFmpegCache plugins may store their files in
+        self.cache = cache if cache else FFmpegCache(logger)
+        self.cachedir = self.cache.cachedir
+        # a list of (start_time, end_time) where texts are displayed, None for always
+        self.ranges = ranges
+        # text is drawn by the drawtext filter, or rendered in python and overlaid
+        self.overlay = OverlayRenderer(logger, videoproperties, self.cachedir) \
+                                            if engine == "overlay" else None
+
+        self.__filters = []
+        # (start_time, end_time, command) to be written in a sendcmd file
+        self.__commands = []
+        self.__tempfiles = []
+        self.__tempdirs = []
+        # temporary directory holding the images read while rendering, None until used
+        self.__imagedir = None
+        self.__instance_index = 0
+        # the layer being recorded, None if not recording
+        self.__layer = None
+        # (start_time, end_time) of every text, to find out which parts of the video
+        # need to be rendered, other filters are assumed to change the whole video
+        self.__active = []
+        self.__always_active = False
+
+
+    # description: get a unique name for a filter instance
+    #              commands in a sendcmd file are sent to every filter matching the
+    #              target name, so each plugin should address its own instance
+    # parameters : filtername : the ffmpeg filter, eg drawtext
+    # returns    : the instance name, eg drawtext@gpt1
+    #              instances in a layer are named after the layer, so a stored layer
+    #              never clashes with the instances of other layers
+    def get_instance_name(self, filtername):
+        self.__instance_index = self.__instance_index + 1
+        if self.__layer is not None and self.__layer['key']:
+            return filtername + "@gpt" + self.__layer['key'][:12] + "_" + \
+                   str(self.__instance_index)
+        return filtername + "@gpt" + str(self.__instance_index)
+
+
+    # description: start recording everything which is added as a layer
+    # parameters : key : the key of the layer, None if it won't be stored
+    def begin_layer(self, key):
+        self.__layer = { 'version': self.layerversion, 'key': key, \
+                         'filters': [], 'commands': [], 'texts': [], 'images': [] }
+
+
+    # description: stop recording
+    # returns    : the recorded layer, which can be serialized as JSON
+    def end_layer(self):
+        layer = self.__layer
+        self.__layer = None
+        return layer
+
+
+    # description: add a layer recorded by end_layer()
+    # parameters : params : the plugin parameters, containing the position of the texts
+    #              layer : the recorded layer
+    # returns    : True if the layer could be added
+    def add_layer(self, params, layer):
+        if not layer or layer.get('version') != self.layerversion:
+            return False
+        # the images may be removed from the cache in the meantime
+        sequences = [ (instance, self.__pin_images([ tuple(i) for i in images ]), x, y) \
+                            for (instance, images, x, y) in layer['images'] ]
+        if not all([ images is not None for (instance, images, x, y) in sequences ]):
+            return False
+
+        for filterstring in layer['filters']:
+            self.__add_filter(filterstring)
+        self.__add_commands([ tuple(c) for c in layer['commands'] ])
+        for (instance, images, x, y) in sequences:
+            self.__add_image_sequence(instance, images, x, y)
+        if layer['filters'] or layer['commands'] or layer['images']:
+            self.__always_active = True
+        for events in layer['texts']:
+            self.__add_text(params, [ tuple(e) for e in events ])
+
+        return True
+
+
+    # description: create a temporary file which is removed after rendering
+    # parameters : prefix : prefix of the temporary filename
+    #              suffix : suffix of the temporary filename
+    # returns    : an open file object and the filename
+    def create_tempfile(self, prefix, suffix = ".txt"):
+        (fd, tempfilename) = tempfile.mkstemp(prefix = prefix, suffix = suffix)
+        self.__tempfiles.append(tempfilename)
+        return os.fdopen(fd, 'w'), tempfilename
+
+
+    # description: create a temporary directory which is removed after rendering
+    # parameters : prefix : prefix of the temporary directory name
+    # returns    : the directory name
+    def create_tempdir(self, prefix):
+        tempdirname = tempfile.mkdtemp(prefix = prefix)
+        self.__tempdirs.append(tempdirname)
+        return tempdirname
+
+
+    # description: add a filter to the combined filter chain
+    # parameters : filterstring : one or more comma separated ffmpeg filters
+    def add_filter(self, filterstring):
+        if self.__layer is not None:
+            self.__layer['filters'].append(filterstring)
+        self.__always_active = True
+        self.__add_filter(filterstring)
+
+
+    def __add_filter(self, filterstring):
+        self.logger.log("Adding filter %s", filterstring)
+        self.__filters.append(filterstring)
+
+
+    # description: overlay an image file on the video, eg a map
+    # parameters : instance : the name of the overlay filter instance, which accepts the
+    #                         commands x and y, see get_instance_name()
+    #              imagefile : the image, it should exist until the video is rendered
+    #                          unless it is stored in the cache
+    #              x, y : the position of the top left corner, ffmpeg expressions
+    # returns    : True if successful
+    def add_image(self, instance, imagefile, x, y):
+        return self.add_image_sequence(instance, [ (0, imagefile) ], x, y)
+
+
+    # description: overlay a sequence of images on the video, each one is displayed
+    #              from its start time until the next one starts
+    #              ffmpeg reads them one by one, only one image is held in memory
+    # parameters : instance : the name of the overlay filter instance, see add_image()
+    #              images : a list of (start_time, imagefile), the first one starting at
+    #                       0, all files in the same directory and named without any
+    #                       characters other than letters, digits, '_', '-' and '.'
+    #              x, y : the position of the top left corner, ffmpeg expressions
+    # returns    : True if successful
+    def add_image_sequence(self, instance, images, x, y):
+        pinned = self.__pin_images(images)
+        if pinned is None:
+            self.logger.error("Image removed from the cache before rendering")
+            return False
+
+        if self.__layer is not None:
+            self.__layer['images'].append((instance, images, x, y))
+        self.__always_active = True
+        self.__add_image_sequence(instance, pinned, x, y)
+        return True
+
+
+    # description: keep images stored in the cache until the video is rendered
+    #              ffmpeg only opens the images of a sequence when they are displayed,
+    #              so they are linked, or else copied, into a temporary directory where
+    #              another job sharing the cache can't evict them
+    # parameters : images : a list of (start_time, imagefile)
+    # returns    : a list of (start_time, imagefile) referring to the kept images, or
+    #              None if an image doesn't exist any more
+    def __pin_images(self, images):
+        if not self.cache.is_enabled():
+            return images
+
+        if self.__imagedir is None:
+            self.__imagedir = self.create_tempdir("gpt_images")
+        pinned = []
+        for (start_time, imagefile) in images:
+            pinnedfile = os.path.join(self.__imagedir, os.path.basename(imagefile))
+            if not os.path.isfile(pinnedfile):
+                try:
+                    # mark as recently used, see FFmpegCache.lookup()
+                    os.utime(imagefile)
+                    os.link(imagefile, pinnedfile)
+                except OSError:
+                    # the temporary directory may be on another file system
+                    try:
+                        shutil.copyfile(imagefile, pinnedfile)
+                    except OSError:
+                        return None
+            pinned.append((start_time, pinnedfile))
+        return pinned
+
+
+    def __add_image_sequence(self, instance, images, x, y):
+        if len(images) == 1:
+            source = "movie=filename=" + escape_filter_value(images[0][1])
+        else:
+            # the concat list refers to the images relative to its own location
+            (fd, listfile) = tempfile.mkstemp(prefix = "gpt_images", suffix = ".txt", \
+                                              dir = os.path.dirname(images[0][1]))
+            self.__tempfiles.append(listfile)
+            with os.fdopen(fd, 'w') as f:
+                f.write("ffconcat version 1.0\n")
+                for index, (start_time, imagefile) in enumerate(images):
+                    f.write("file '%s'\n" % os.path.basename(imagefile))
+                    if index + 1 < len(images):
+                        f.write("duration %.3f\n" % (images[index + 1][0] - start_time))
+            self.logger.add_file_written(listfile)
+            # the images are timed from the start of the video, the section starts at 0
+            source = "movie=filename=" + escape_filter_value(listfile) + \
+                     ":format_name=concat,setpts=PTS-{section_start}/TB"
+
+        label = "[" + instance.replace('@', '_') + "_image]"
+        self.__add_filter(source + label + ";" + \
+                          "{input}" + label + instance + "=x=" + escape_filter_value(x) + \
+                          ":y=" + escape_filter_value(y))
+
+
+    # description: add commands to be sent to the filters while rendering
+    #              all commands are combined in a single sendcmd filter
+    # parameters : commands : a list of (start_time, end_time, command), where command
+    #                         is the target instance, the command and its argument
+    #                         expressions using the time t of the rendered section should
+    #                         add {section_start} to it, eg t+{section_start}
+    def add_commands(self, commands):
+        if self.__layer is not None:
+            self.__layer['commands'].extend(commands)
+        self.__always_active = True
+        self.__add_commands(commands)
+
+
+    def __add_commands(self, commands):
+        self.__commands.extend(commands)
+
+
+    # description: add a text which changes over time
+    # parameters : params : the plugin parameters, containing the position
+    #              events : a list of (start_time, end_time, text)
+    def add_text(self, params, events):
+        if self.__layer is not None:
+            self.__layer['texts'].append(events)
+        self.__add_text(params, events)
+
+
+    def __add_text(self, params, events):
+        if self.ranges is not None:
+            events = clip_events(events, self.ranges)
+        self.__active.extend([ (start_time, end_time) for (start_time, end_time, text) in events ])
+
+        if self.overlay is not None:
+            self.overlay.add_text_layer(params, events)
+        else:
+            instance = self.get_instance_name("drawtext")
+            self.__add_commands(get_drawtext_commands(instance, events, \
+                                                      params.get_position_ffmpeg()))
+            self.__add_filter(instance + "=text='':" + \
+                                       "fontfile=/usr/share/fonts/TTF/DejaVuSans.ttf:" + \
+                                       "fontsize=72:" + \
+                                       "borderw=2:" + \
+                                       "bordercolor=0x000000:" + \
+                                       "fontcolor=0xFFFFFF")
+
+
+    def has_filters(self):
+        return len(self.__filters) > 0 or \
+               (self.overlay is not None and self.overlay.has_layers())
+
+
+    def __write_commands(self, start_time, end_time):
+        with self.logger.span("sendcmd", "render", start = start_time, end = end_time):
+            f, tempcmdfile = self.create_tempfile("gpt_renderer_sendcmd")
+            count = 0
+            for (cmd_start, cmd_end, command) in self.__commands:
+                if cmd_end > start_time and cmd_start < end_time:
+                    f.write("{0:.3f}-{1:.3f} [enter] {2};\n".format( \
+                                max(cmd_start, start_time) - start_time, \
+                                min(cmd_end, end_time) - start_time, \
+                                command.replace("{section_start}", \
+                                                "{0:.3f}".format(start_time))))
+                    count = count + 1
+            f.close()
+            self.logger.add_file_written(tempcmdfile)
+
+        return tempcmdfile, count
+
+
+    # description: get the combined filter graph for a section of the video
+    # parameters : start_time : start of the section in seconds
+    #              end_time : end of the section in seconds, None for the end of the video
+    # returns    : the filter graph, the commands are shifted so the section starts at 0
+    #              filters with an {input} placeholder, see add_image(), get the video
+    #              filtered so far as a labelled input, {section_start} is replaced by
+    #              the start of the section
+    def get_filtergraph(self, start_time = 0, end_time = None):
+        if end_time is None:
+            end_time = self.videoproperties.duration
+
+        filters = self.__filters
+        if self.__commands:
+            tempcmdfile, count = self.__write_commands(start_time, end_time)
+            if count > 0:
+                filters = [ "sendcmd=f=" + escape_filter_value(tempcmdfile) ] + filters
+
+        filtergraph = ""
+        for index, filterstring in enumerate(filters):
+            filterstring = filterstring.replace("{section_start}", "{0:.3f}".format(start_time))
+            if "{input}" in filterstring:
+                label = "[gptvideo%d]" % index
+                filtergraph = (filtergraph if filtergraph else "null") + label + ";" + \
+                              filterstring.replace("{input}", label)
+            else:
+                filtergraph = filtergraph + "," + filterstring if filtergraph \
+                                                              else filterstring
+
+        return filtergraph
+
+
+    # description: render all filters on a section of a video file
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              infilename : the video file
+    #              outfilename : the resulting video file
+    #              overwrite : if True then outfilename will always be overwritten
+    #              start_time, end_time : the section of the telemetry to render
+    #              postfilter : filters to apply after the telemetry is rendered
+    #              threads : maximum number of threads, None for the ffmpeg default
+    #              inputparams : a list of ffmpeg input options
+    #              profile : the encoding profile, None for the profile of ffmpeg
+    # returns    : True if successful
+    def __render(self, ffmpeg, infilename, outfilename, overwrite, \
+                 start_time = 0, end_time = None, postfilter = "", threads = None, \
+                 inputparams = [], profile = None):
+        if end_time is None:
+            end_time = self.videoproperties.duration
+        with self.logger.span("encode", "render", start = start_time, end = end_time):
+            filtergraph = self.get_filtergraph(start_time, end_time)
+
+            if self.overlay is not None and self.overlay.has_layers():
+                filtercomplex = ("[0:v]" + filtergraph + "[base];[base]" if filtergraph \
+                                                                        else "[0:v]") + \
+                                "[1:v]overlay=eof_action=repeat" + \
+                                ("," + postfilter if postfilter else "") + "[out]"
+
+                return ffmpeg.apply_custom_filter(\
+                            infilename, \
+                            ["-filter_complex", filtercomplex,
+                             "-map", "[out]",
+                             "-map", "0:a?",
+                             "-acodec", "copy"], \
+                            outfilename, \
+                            overwrite, \
+                            threads, \
+                            profile, \
+                            inputparams = inputparams, \
+                            pipeparams = self.overlay.get_input_params(), \
+                            pipedata = self.overlay.get_frames(start_time, end_time), \
+                            duration = end_time - start_time)
+            else:
+                filtergraph = ",".join([ f for f in [ filtergraph, postfilter ] if f ])
+
+                return ffmpeg.apply_custom_filter(\
+                            infilename, \
+                            ["-acodec", "copy",
+                             "-vf", filtergraph], \
+                            outfilename, \
+                            overwrite, \
+                            threads, \
+                            profile, \
+                            inputparams = inputparams, \
+                            duration = end_time - start_time)
+
+
+    # description: render all filters on a video file in one ffmpeg pass
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              infilename : the original video file
+    #              outfilename : the resulting video file
+    #              overwrite : if True then outfilename will always be overwritten
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    # returns    : True if successful
+    def run(self, ffmpeg, infilename, outfilename, overwrite = False, inputparams = []):
+        self.logger.log("Rendering %d filter(s) in a single pass" % len(self.__filters))
+
+        return self.__render(ffmpeg, infilename, outfilename, overwrite, \
+                             inputparams = inputparams)
+
+
+    # description: render all filters on a section of a video file and downscale it
+    #              the commands should already be relative to the start of the section
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              infilename : the original video file
+    #              outfilename : the resulting video file
+    #              start_time : start of the section in seconds
+    #              duration : duration of the section in seconds
+    #              scale : the dimensions of the result, see FFmpeg.rescale_video()
+    #              overwrite : if True then outfilename will always be overwritten
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    # returns    : True if successful
+    def run_preview(self, ffmpeg, infilename, outfilename, start_time, duration, scale, \
+                    overwrite = False, inputparams = []):
+        self.logger.log("Rendering preview of %.3f seconds starting at %.3f" % \
+                        (duration, start_time))
+
+        # scale after the filters to keep the layout of the full size render
+        return self.__render(ffmpeg, infilename, outfilename, overwrite, \
+                             0, duration, "scale=" + scale, \
+                             inputparams = inputparams + \
+                                           [ "-ss", "{0:.3f}".format(start_time), \
+                                             "-t", "{0:.3f}".format(duration) ])
+
+
+    # description: get the ffmpeg input options to read a section of the input video
+    #              the section is decoded from the preceding keyframe, the frames before
+    #              the start are dropped, so no copy of the section is needed
+    # parameters : start_time, end_time : the section in seconds, end_time is None to
+    #                                     read until the end of the video
+    # returns    : a list of ffmpeg input options
+    def __get_section_params(self, start_time, end_time):
+        # half a frame margin, the frame at start_time is included but the one at
+        # end_time is not
+        margin = 0.5 / self.videoproperties.framerate if self.videoproperties.framerate else 0
+        params = []
+        if start_time > 0:
+            params = params + [ "-ss", "{0:.6f}".format(max(0, start_time - margin)) ]
+        if end_time is not None:
+            params = params + [ "-t", "{0:.6f}".format(end_time - start_time) ]
+        return params
+
+
+    # description: render sections of a video file simultaneously, each render reads its
+    #              section straight from the input file
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              infilename : the original video file
+    #              sections : a list of (start_time, end_time, renderedfile)
+    #              executor : the ThreadPoolExecutor to run the renders in
+    #              threads : maximum number of threads of each render
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    #              profile : the encoding profile, None for the profile of ffmpeg
+    # returns    : a list of futures, the result of each one is True if successful
+    def __render_sections(self, ffmpeg, infilename, sections, executor, threads, inputparams, \
+                          profile = None):
+        duration = self.videoproperties.duration
+        return [ executor.submit(self.__render, ffmpeg, infilename, renderedfile, True, \
+                                 start_time, end_time, threads = threads, \
+                                 inputparams = inputparams + \
+                                     self.__get_section_params(start_time, \
+                                        end_time if end_time < duration else None), \
+                                 profile = profile) \
+                 for (start_time, end_time, renderedfile) in sections ]
+
+
+    # description: render all filters on sections of a video file in parallel and
+    #              concatenate the results
+    #              the sections are read from the input file, only the rendered sections
+    #              are written to temporary files
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              infilename : the original video file
+    #              outfilename : the resulting video file
+    #              segment_count : the number of segments to render simultaneously
+    #              overwrite : if True then outfilename will always be overwritten
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    # returns    : True if successful
+    def run_parallel(self, ffmpeg, infilename, outfilename, segment_count, overwrite = False, \
+                     inputparams = []):
+        if not overwrite and os.path.exists(outfilename):
+            self.logger.log("Output file already exists, skipping")
+            return True
+
+        self.logger.log("Rendering %d filter(s) in %d parallel segments" % \
+                        (len(self.__filters), segment_count))
+
+        # split on frame boundaries, every frame is rendered exactly once
+        duration = self.videoproperties.duration
+        framerate = self.videoproperties.framerate if self.videoproperties.framerate else 1
+        split_times = [ round(duration * i / segment_count * framerate) / framerate \
+                                                    for i in range(1, segment_count) ]
+        bounds = [ 0 ] + split_times + [ duration ]
+
+        tempdir = self.create_tempdir("gpt_renderer_segments")
+        sections = [ (bounds[index], bounds[index + 1], \
+                      os.path.join(tempdir, "rendered_%03d.mp4" % index)) \
+                                                    for index in range(segment_count) ]
+
+        # the segments share the thread budget of the whole render
+        threads = max(1, ffmpeg.threads // segment_count) if ffmpeg.threads > 0 else 0
+        with ThreadPoolExecutor(max_workers = segment_count) as executor:
+            futures = self.__render_sections(ffmpeg, infilename, sections, executor, \
+                                             threads, inputparams)
+            retval = all([ future.result() for future in futures ])
+
+        if retval:
+            with self.logger.span("concat", "render"):
+                retval = ffmpeg.concat_video([ section[2] for section in sections ], \
+                                             outfilename, True)
+
+        return retval
+
+
+    # description: get the time ranges in which any text is displayed
+    # returns    : a sorted list of non-overlapping (start_time, end_time)
+    def get_active_intervals(self):
+        intervals = []
+        for (start_time, end_time) in sorted(self.__active):
+            if intervals and start_time <= intervals[-1][1]:
+                intervals[-1] = (intervals[-1][0], max(intervals[-1][1], end_time))
+            else:
+                intervals.append((start_time, end_time))
+        return intervals
+
+
+    # description: check if re-encoded segments can be joined with the copied segments of
+    #              the input video, the encoding profile must produce the same codec and
+    #              the profile, level and pixel format of the input must be known, these
+    #              replace the ones of the encoding profile
+    # parameters : ffmpeg : the FFmpeg instance to use
+    # returns    : the reason why joining is not possible, empty if it is
+    def __can_join(self, ffmpeg):
+        vp = self.videoproperties
+        encoder = ffmpeg.profile.codec if ffmpeg.profile.codec else "libx264"
+        if encoder != vp.codec and encoder not in self.__encoders.get(vp.codec, []):
+            return "the encoding profile doesn't produce " + vp.codec
+        if not vp.profile or not vp.level or not vp.pixelformat:
+            return "the profile, level or pixel format of the input video is unknown"
+        timebase = vp.timebase.split('/')
+        if len(timebase) != 2 or not timebase[1].isdigit() or int(timebase[1]) > 90000:
+            return "the time base %s of the input video can't be kept" % vp.timebase
+        return ""
+
+
+    # description: get the encoding profile producing a stream with the codec profile,
+    #              level and pixel format of the input video
+    # parameters : ffmpeg : the FFmpeg instance to use
+    # returns    : an instance of FFmpegEncodingProfile
+    def __get_join_profile(self, ffmpeg):
+        vp = self.videoproperties
+        profile = copy.copy(ffmpeg.profile)
+        # ffprobe reports eg Constrained Baseline or Main 10, the encoders expect
+        # baseline or main10
+        codecprofile = vp.profile.lower().replace(" ", "")
+        profile.codecprofile = "baseline" if codecprofile == "constrainedbaseline" \
+                                          else codecprofile
+        # the h264 level is reported as 10 times the level, the level of the hevc
+        # encoders can't be set consistently and is only verified afterwards
+        if vp.codec == 'h264':
+            profile.level = "%.1f" % (vp.level / 10.0)
+        profile.pixelformat = vp.pixelformat
+        return profile
+
+
+    # description: check if a re-encoded segment has the stream properties of the input
+    #              video, an encoder may not support the requested profile or level
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              renderedfile : the re-encoded segment
+    # returns    : True if the segment can be joined with the input video
+    def __is_joinable(self, ffmpeg, renderedfile):
+        vp = self.videoproperties
+        retval, rendered = ffmpeg.probe(renderedfile, False)
+        if not retval:
+            return False
+        for (name, expected, actual) in \
+                [ ("codec", vp.codec, rendered.codec), \
+                  ("profile", vp.profile, rendered.profile), \
+                  ("level", vp.level, rendered.level), \
+                  ("pixel format", vp.pixelformat, rendered.pixelformat), \
+                  ("width", vp.video_width, rendered.video_width), \
+                  ("height", vp.video_height, rendered.video_height) ]:
+            if expected != actual:
+                self.logger.error("Re-encoded %s %s differs from %s of the input video" % \
+                                  (name, str(actual), str(expected)))
+                return False
+        return True
+
+
+    # description: find the keyframe intervals (GOPs) in which a text is displayed
+    # parameters : keyframes : the sorted keyframe times
+    #              intervals : the active intervals, see get_active_intervals()
+    # returns    : a numpy array with a boolean for each GOP
+    def __get_dirty_gops(self, keyframes, intervals):
+        gop_starts = np.asarray(keyframes, dtype = np.float64)
+        gop_ends = np.append(gop_starts[1:], max(self.videoproperties.duration, \
+                                                 gop_starts[-1]))
+        dirty = np.zeros(len(gop_starts), dtype = bool)
+        for (start_time, end_time) in intervals:
+            first = np.searchsorted(gop_ends, start_time, side = 'right')
+            last = np.searchsorted(gop_starts, end_time, side = 'left')
+            dirty[first:last] = True
+        return dirty
+
+
+    # description: render only the parts of a video file where a text is displayed
+    #              the video is split on the keyframes where the display starts or
+    #              stops, the segments without text are copied without re-encoding
+    #              the segments are joined through MPEG-TS, so every segment carries the
+    #              parameter sets of its codec in the stream
+    #              the whole video is rendered when other filters are used, or when the
+    #              re-encoded segments don't match the codec profile, level, pixel format
+    #              and resolution of the input video
+    # parameters : ffmpeg : the FFmpeg instance to use
+    #              infilename : the original video file
+    #              outfilename : the resulting video file
+    #              segment_count : the number of segments to render simultaneously
+    #              overwrite : if True then outfilename will always be overwritten
+    #              inputparams : a list of ffmpeg input options, eg for a concat list
+    # returns    : True if successful
+    def run_smart(self, ffmpeg, infilename, outfilename, segment_count = 1, \
+                  overwrite = False, inputparams = []):
+        if not overwrite and os.path.exists(outfilename):
+            self.logger.log("Output file already exists, skipping")
+            return True
+
+        fallback = "filters are applied to the whole video" if self.__always_active \
+                                                            else self.__can_join(ffmpeg)
+        if fallback:
+            self.logger.error("Smart rendering is not possible, " + fallback)
+            return self.__run_full(ffmpeg, infilename, outfilename, segment_count, inputparams)
+
+        with self.logger.span("keyframes", "render"):
+            retval, keyframes = ffmpeg.get_keyframes(infilename, inputparams)
+        if not retval or not keyframes:
+            self.logger.error("No keyframes found in " + infilename)
+            return False
+
+        intervals = self.get_active_intervals()
+        dirty = self.__get_dirty_gops(keyframes, intervals)
+        boundaries = [ i for i in range(1, len(keyframes)) if dirty[i] != dirty[i - 1] ]
+        bounds = [ 0 ] + [ keyframes[i] for i in boundaries ] + \
+                 [ self.videoproperties.duration ]
+        # split slightly before the keyframe, the segment muxer splits on the first
+        # keyframe at or after the requested time
+        split_times = [ keyframes[i] - 0.001 for i in boundaries ]
+
+        tempdir = self.create_tempdir("gpt_renderer_smart")
+        renderedfiles = {}
+        sections = []
+        for index in range(len(bounds) - 1):
+            if dirty[0] == (index % 2 == 0):
+                renderedfiles[index] = os.path.join(tempdir, "rendered_%03d.ts" % index)
+                sections.append((bounds[index], bounds[index + 1], renderedfiles[index]))
+
+        self.logger.log("Re-encoding %d of %d segments, %.1f of %.1f seconds" % \
+                        (len(sections), len(bounds) - 1, \
+                         sum([ section[1] - section[0] for section in sections ]), \
+                         self.videoproperties.duration))
+
+        # the sections to re-encode are read from the input file, so they are rendered
+        # while the sections without text are copied
+        workers = max(1, min(segment_count, len(sections)))
+        threads = max(1, ffmpeg.threads // workers) if ffmpeg.threads > 0 else 0
+        profile = self.__get_join_profile(ffmpeg)
+        with ThreadPoolExecutor(max_workers = workers + 1) as executor:
+            # nothing needs to be copied when the whole video is re-encoded
+            split = executor.submit(self.__split, ffmpeg, infilename, split_times, \
+                                    tempdir, inputparams) \
+                        if len(sections) < len(bounds) - 1 else None
+            futures = self.__render_sections(ffmpeg, infilename, sections, executor, \
+                                             threads, inputparams, profile)
+            retval, segments = split.result() if split else (True, [ (None, 0, 0) ])
+            retval = all([ future.result() for future in futures ]) and retval
+
+        if retval and len(segments) != len(bounds) - 1:
+            self.logger.error("Expected %d segments, found %d" % \
+                              (len(bounds) - 1, len(segments)))
+            retval = False
+
+        if retval and sections and not self.__is_joinable(ffmpeg, sections[0][2]):
+            self.logger.error("Smart rendering is not possible, " + \
+                              "the re-encoded segments differ from the input video")
+            return self.__run_full(ffmpeg, infilename, outfilename, segment_count, inputparams)
+
+        if retval:
+            # the copies of the re-encoded sections are not needed
+            for index in renderedfiles:
+                if segments[index][0]:
+                    os.remove(segments[index][0])
+            outputfiles = [ renderedfiles.get(index, segment[0]) \
+                                for index, segment in enumerate(segments) ]
+            # keep the duration of each segment and the time base of the input, the
+            # parameter sets stay in the stream so the sample entry is avc3 or hev1
+            durations = [ bounds[index + 1] - bounds[index] \
+                                for index in range(len(bounds) - 1) ]
+            outputparams = [ "-tag:v", "avc3" if self.videoproperties.codec == 'h264' \
+                                              else "hev1", \
+                             "-video_track_timescale", \
+                             self.videoproperties.timebase.split('/')[1] ]
+            with self.logger.span("concat", "render"):
+                retval = ffmpeg.concat_video(outputfiles, outfilename, True, durations, \
+                                             outputparams)
+
+        return retval
+
+
+    # description: render the whole video when smart rendering is not possible
+    def __run_full(self, ffmpeg, infilename, outfilename, segment_count, inputparams):
+        if segment_count > 1:
+            return self.run_parallel(ffmpeg, infilename, outfilename, segment_count, \
+                                     True, inputparams)
+        return self.run(ffmpeg, infilename, outfilename, True, inputparams)
+
+
+    def __split(self, ffmpeg, infilename, split_times, tempdir, inputparams):
+        with self.logger.span("split", "render"):
+            return ffmpeg.split_video(infilename, split_times, tempdir, inputparams, \
+                                      "mpegts")
+
+
+    def cleanup(self):
+        for tempfilename in self.__tempfiles:
+            if os.path.isfile(tempfilename):
+                self.logger.log("Removing temp file " + tempfilename)
+                os.remove(tempfilename)
+        self.__tempfiles = []
+
+        for tempdirname in self.__tempdirs:
+            if os.path.isdir(tempdirname):
+                self.logger.log("Removing temp directory " + tempdirname)
+                shutil.rmtree(tempdirname)
+        self.__tempdirs = []
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# gpt_sendcmd -- create sendcmd files for gopro-telemetry plugins
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, math
+import numpy as np
+from gpt_plugin_requirements import get_default_requirements
+
+# description: convert telemetry data to a list of text events
+#              the telemetry is resampled on the frame boundaries at most updaterate
+#              times per second, consecutive updates resulting in the same text are
+#              merged, no text is displayed in the gaps of the telemetry
+# parameters : series : a TelemetrySeries
+#              format_func : function converting a value to the text to display
+#              framerate : the framerate of the video
+#              updaterate : maximum number of updates per second, 0 for no limit
+#              interpolate : interpolate between two values, see TelemetrySeries.resample()
+#              maxgap : the maximum time in seconds between two connected values,
+#                       0 for no limit
+# returns    : a list of (start_time, end_time, text)
+def get_text_events(series, format_func, framerate, updaterate, \
+                    interpolate = False, maxgap = 0):
+    if len(series) == 0:
+        return []
+
+    step = 0
+    if framerate > 0 and updaterate > 0:
+        step = max(1, round(framerate / updaterate)) / framerate
+
+    if step > 0:
+        series = series.resample(step, interpolate, maxgap if maxgap > 0 else None)
+
+    # only format the values which differ from the preceding one
+    # values of multiple channels are passed to format_func as a list
+    values = series.values
+    times = series.timestamps
+    changed = np.ones(len(values), dtype = bool)
+    if values.ndim == 1:
+        changed[1:] = values[1:] != values[:-1]
+    else:
+        changed[1:] = np.any(values[1:] != values[:-1], axis = 1)
+
+    # without resampling the gaps are found between the samples, gaps[i] is True when
+    # the sample following sample i is more than maxgap later
+    gaps = np.zeros(len(values), dtype = bool)
+    if step == 0 and maxgap > 0:
+        gaps[:-1] = np.diff(times) > maxgap
+        changed[1:] = changed[1:] | gaps[:-1]
+
+    firsts = []
+    texts = []
+    for index, value in zip(np.flatnonzero(changed).tolist(), values[changed].tolist()):
+        missing = any([ math.isnan(v) for v in value ]) if isinstance(value, list) \
+                                                        else math.isnan(value)
+        text = None if missing else format_func(value)
+        if not texts or texts[-1] != text or gaps[index - 1]:
+            firsts.append(index)
+            texts.append(text)
+
+    events = []
+    for event, (first, text) in enumerate(zip(firsts, texts)):
+        if event + 1 < len(firsts):
+            last = firsts[event + 1] - 1
+            end_time = float(times[firsts[event + 1]])
+        else:
+            last = len(values) - 1
+            end_time = series.end_time
+        # the text is hidden maxgap after the last sample before a gap
+        if step == 0 and maxgap > 0 and (gaps[last] or event + 1 == len(firsts)):
+            end_time = min(end_time, float(times[last]) + maxgap)
+        if text is not None:
+            events.append((float(times[first]), end_time, text))
+    return events
+
+
+# description: limit text events to a number of time ranges
+# parameters : events : a list of (start_time, end_time, text)
+#              ranges : a list of (start_time, end_time)
+# returns    : a list of (start_time, end_time, text) within the ranges
+def clip_events(events, ranges):
+    clipped = []
+    for (start_time, end_time, text) in events:
+        for (range_start, range_end) in ranges:
+            if start_time < range_end and end_time > range_start:
+                clipped.append((max(start_time, range_start), min(end_time, range_end), text))
+    return sorted(clipped)
+
+
+# description: get the sendcmd commands updating the text of a drawtext filter
+# parameters : instance : the name of the drawtext filter instance
+#              events : a list of (start_time, end_time, text)
+#              textpos : the position of the text, see get_position_ffmpeg()
+# returns    : a list of (start_time, end_time, command)
+#              the text remains until it is changed, so it is cleared in the gaps
+def get_drawtext_commands(instance, events, textpos):
+    commands = []
+    for index, (start_time, end_time, text) in enumerate(events):
+        commands.append((start_time, end_time, \
+                         "{0} reinit 'text={1}:{2}'".format(instance, text, textpos)))
+        next_start = events[index + 1][0] if index + 1 < len(events) else float("inf")
+        if next_start > end_time:
+            commands.append((end_time, next_start, \
+                             "{0} reinit 'text=:{1}'".format(instance, textpos)))
+    return commands
+
+
+# description: get the telemetry data needed to display the channels in the jsontag as
+#              text, values are only kept as often as the text is updated
+#              in the gaps enough values are kept to detect gaps longer than maxgap
+# parameters : params : the plugin parameters
+# returns    : a PluginRequirements instance
+def get_drawtext_requirements(params):
+    samplerate = 0
+    if params.updaterate > 0:
+        samplerate = max(params.updaterate, 2 / params.maxgap) if params.maxgap > 0 \
+                                                               else params.updaterate
+    return get_default_requirements(params, samplerate)
+
+
+# description: add a text displaying telemetry data to the renderer
+# parameters : params : the plugin parameters
+#              jsondata : a TelemetrySeries
+#              format_func : function converting a value to the text to display
+#              renderer : the Renderer collecting all filters
+# returns    : True if successful
+def add_drawtext_filter(params, jsondata, format_func, renderer):
+    events = get_text_events(jsondata, format_func, \
+                             renderer.videoproperties.framerate, params.updaterate, \
+                             params.interpolate, params.maxgap)
+    params.logger.log("Reduced %d samples to %d text updates", len(jsondata), len(events))
+
+    renderer.add_text(params, events)
+
+    return True
@@ -16,12 +16,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, os, json, subprocess, importlib
+import sys, os, copy, json, importlib, inspect, shutil, hashlib
+import numpy as np
 from xml.dom import minidom
 from ffmpeg import FFmpegLogger
 from ffmpeg import FFmpegVideoProperties
 from ffmpeg import FFmpeg
+from gpt_gpmf import GPMFDecoder
+from gpt_json_reader import read_json_columns
+from gpt_telemetry_store import TelemetryStore, read_columns, write_columns, stitch_columns
+from gpt_telemetry_store import derive_columns, derived_channels
 from gpt_plugin_parameters import PluginParameters
+from gpt_plugin_requirements import get_default_requirements, merge_requirements
+from gpt_renderer import Renderer
 
 class Telemetry:
     def __init__(self, params, ffmpeg):
@@ -31,39 +38,146 @@ class Telemetry:
         self.__ffmpeg = ffmpeg
 
         self.__gopro2jsonexe = ""
-        self.__telemetryfile = params.filename + ".telemetry.bin"
-        self.__telemetryjsonfile = params.filename + ".telemetry.json"
-        self.__outputfile = params.filename + ".rendered.mp4"
+        # a recording split in chapters is processed as a single video
+        self.__chapters = params.chapterfiles if params.chapterfiles else [ params.filename ]
+        self.__durations = []
+        self.__outputfile = params.filename + \
+                            (".preview.mp4" if params.preview else ".rendered.mp4")
         
         self.__vp = None
-        self.__jsondata = []
+        self.__store = None
+        # hash of the source each plugin depends on, by plugin module
+        self.__sourcehashes = {}
 
+        # the telemetry is only extracted when the decoded data is not cached
         self.initialized = \
-            self.__find_gopro2json_executable() and \
-            self.__ffmpeg.fetch_telemetry_stream(params.filename, \
-                                                 self.__telemetryfile, \
-                                                 params.overwrite) and \
-            self.__convert_telemetry_to_json(params.overwrite) and \
             self.__fetch_videoproperties() and \
-            self.__parse_json()
+            (self.__find_gopro2json_executable() if params.gopro2json else True) and \
+            self.__decode_chapters()
 
 
-    def __run_command(self, args):
-        retval = True
-        output = ""
+    # description: extract the telemetry stream for gopro2json, in the artifact cache if
+    #              it is enabled or else next to the input file
+    # returns    : True if successful and the filename of the telemetry stream
+    def __fetch_telemetry_stream(self, filename):
+        with self.logger.span("extract telemetry", "telemetry", file = filename):
+            if self.__ffmpeg.cache.is_enabled():
+                return self.__ffmpeg.fetch_cached_telemetry_stream(filename)
+            
+            telemetryfile = filename + ".telemetry.bin"
+            retval = self.__ffmpeg.fetch_telemetry_stream(filename, telemetryfile, \
+                                                          self.__params.overwrite)
+        
+        return retval, telemetryfile
+
+
+    def __read_cached_columns(self, key):
+        filename = self.__ffmpeg.cache.lookup("telemetry", key, ".npz")
+        if not filename:
+            return None, None
+        
         try:
-            self.logger.log("Running command: " + subprocess.list2cmdline(args))
-            process = subprocess.run(args, \
-                                     stdout = subprocess.PIPE, \
-                                     check = True, \
-                                     universal_newlines = True)
-            process.check_returncode()
-            output = process.stdout
-        except subprocess.CalledProcessError as e:
-            self.logger.error("Command failed, return code = " + str(e.returncode))
-            retval = False
+            return read_columns(filename)
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.log("Could not read cached telemetry, error = " + str(e))
+            return None, None
+
+
+    def __write_cached_columns(self, key, columns, timestamps):
+        try:
+            tempfilename = self.__ffmpeg.cache.create_tempfile("telemetry", ".npz")
+            write_columns(tempfilename, columns, timestamps)
+            self.logger.add_file_written(tempfilename)
+            self.__ffmpeg.cache.commit(tempfilename, "telemetry", key, ".npz")
+        except OSError as e:
+            self.logger.log("Could not write telemetry to cache, error = " + str(e))
+
+
+    # parameters : filename : the video file
+    #              channels : the channels to decode
+    # returns    : True if successful, the decoded columns and their timestamps
+    def __decode_telemetry(self, filename, channels):
+        decoder = GPMFDecoder(self.logger, channels)
+        key = self.__ffmpeg.get_telemetry_key(filename, "gpmf", GPMFDecoder.version, \
+                                              ",".join(decoder.get_sensors())) \
+                  if self.__ffmpeg.cache.is_enabled() else None
+        (columns, timestamps) = self.__read_cached_columns(key) if key else (None, None)
+        
+        retval = True
+        if columns is None:
+            # the telemetry is decoded while ffmpeg extracts it, without a temporary file
+            with self.logger.span("decode gpmf", "telemetry", file = filename):
+                retval = self.__ffmpeg.read_telemetry_stream(filename, decoder.feed)
+                retval = decoder.finish() and retval
+            columns = decoder.columns
+            timestamps = decoder.timestamps
+            if retval and key:
+                self.__write_cached_columns(key, columns, timestamps)
+        
+        return retval, columns, timestamps
+
+
+    # parameters : filename : the video file
+    #              channels : the channels to keep
+    # returns    : True if successful, the decoded columns and their timestamps
+    def __decode_with_gopro2json(self, filename, channels):
+        if self.__ffmpeg.cache.is_enabled():
+            retval, jsonfile = self.__convert_cached_telemetry_to_json(filename)
+        else:
+            jsonfile = filename + ".telemetry.json"
+            retval, telemetryfile = self.__fetch_telemetry_stream(filename)
+            retval = retval and \
+                     self.__convert_telemetry_to_json(telemetryfile, jsonfile, \
+                                                      self.__params.overwrite)
+        
+        if not retval:
+            return False, None, None
+        
+        with self.logger.span("parse json", "telemetry", file = filename):
+            return self.__parse_json(jsonfile, channels)
+
+
+    # description: decode the telemetry of all chapters and add it to a TelemetryStore
+    #              the timestamps of each chapter continue from the end of the
+    #              previous one
+    #              only the channels required by the enabled plugins are kept
+    def __decode_chapters(self):
+        (samplerates, channels) = self.__get_requirements()
         
-        return retval, output
+        chapters = []
+        for (filename, duration) in zip(self.__chapters, self.__durations):
+            retval, columns, timestamps = \
+                self.__decode_with_gopro2json(filename, channels) \
+                    if self.__params.gopro2json \
+                    else self.__decode_telemetry(filename, channels)
+            if not retval:
+                return False
+            chapters.append((columns, timestamps, duration))
+        
+        if len(chapters) > 1:
+            self.logger.log("Stitching telemetry of %d chapters", len(chapters))
+            with self.logger.span("stitch chapters", "telemetry"):
+                (columns, timestamps) = stitch_columns(chapters)
+        else:
+            (columns, timestamps, duration) = chapters[0]
+        
+        columns = dict(columns)
+        timestamps = dict(timestamps)
+        # missing channels which aren't derived are reported when a plugin needs them
+        derive_columns(columns, timestamps, \
+                       [ tag for tag in samplerates \
+                                if tag in derived_channels and tag not in columns ])
+        
+        self.__store = TelemetryStore(self.logger, self.__vp.duration)
+        for tag, samplerate in samplerates.items():
+            if tag in columns:
+                self.__store.add_column(tag, columns[tag], timestamps.get(tag), samplerate)
+        
+        return True
+
+
+    def __run_command(self, args):
+        return self.__ffmpeg.runner.run_command(args)
 
 
     def __set_gopro2json_executable(self, gopro2jsonexe):
@@ -74,14 +188,14 @@ class Telemetry:
     def __find_gopro2json_executable(self):
         self.logger.log("Checking installation of gopro2json")
         
-        retval, output = self.__run_command(["which", "gopro2json"])
+        output = shutil.which("gopro2json")
 
-        if retval:
+        if output:
             self.__set_gopro2json_executable(output)
         else:
             self.logger.error("gopro2json not found")
         
-        return retval
+        return output is not None
 
 
     def get_gopro2json_executable(self):
@@ -90,42 +204,130 @@ class Telemetry:
         return self.__gopro2jsonexe
 
 
-    def __convert_telemetry_to_json(self, overwrite = False):
+    def __convert_telemetry_to_json(self, telemetryfile, jsonfile, overwrite = False):
         self.logger.log("Converting telemetry to json format")
 
         retval = True
-        if not overwrite and os.path.exists(self.__telemetryjsonfile):
+        if not overwrite and os.path.exists(jsonfile):
             self.logger.log("Telemetry json file already exists, skipping")
         else:
-            retval, output = self.__run_command([
-                self.get_gopro2json_executable(),
-                "-i", self.__telemetryfile,
-                "-o", self.__telemetryjsonfile])
+            with self.logger.span("gopro2json", "telemetry", file = telemetryfile):
+                retval, output = self.__run_command([
+                    self.get_gopro2json_executable(),
+                    "-i", telemetryfile,
+                    "-o", jsonfile])
+                self.logger.add_file_written(jsonfile)
         
         return retval
 
 
+    # description: convert the telemetry to json in the artifact cache, the json file
+    #              depends on the version of gopro2json, represented by its timestamp
+    # returns    : True if successful and the filename of the json file
+    def __convert_cached_telemetry_to_json(self, filename):
+        gopro2jsonexe = self.get_gopro2json_executable()
+        key = self.__ffmpeg.get_telemetry_key(filename, "gopro2json", \
+                                              os.path.realpath(gopro2jsonexe), \
+                                              os.stat(gopro2jsonexe).st_mtime_ns)
+        jsonfile = self.__ffmpeg.cache.lookup("json", key, ".json")
+        if jsonfile:
+            return True, jsonfile
+        
+        retval, telemetryfile = self.__fetch_telemetry_stream(filename)
+        if retval:
+            tempfilename = self.__ffmpeg.cache.create_tempfile("json", ".json")
+            retval = self.__convert_telemetry_to_json(telemetryfile, tempfilename, True)
+            if retval:
+                jsonfile = self.__ffmpeg.cache.commit(tempfilename, "json", key, ".json")
+            else:
+                self.__ffmpeg.cache.discard(tempfilename)
+        
+        return retval, jsonfile
+
+
+    # description: get the properties of the video, for chapters the duration is the
+    #              total of all chapters
     def __fetch_videoproperties(self):
-        retval, self.__vp = self.__ffmpeg.get_video_properties(self.__params.filename)
+        for filename in self.__chapters:
+            with self.logger.span("probe", "telemetry", file = filename):
+                retval, vp = self.__ffmpeg.get_video_properties(filename)
+            if not retval:
+                return False
+            if self.__vp is None:
+                self.__vp = copy.copy(vp)
+            self.__durations.append(vp.duration)
         
-        return retval
+        self.__vp.duration = sum(self.__durations)
+        
+        return True
+
 
+    # description: get the requirements of a plugin, declared by its get_requirements()
+    #              function or else all values of the channels in its jsontag
+    def __get_plugin_requirements(self, pluginparams):
+        try:
+            mod = importlib.import_module(pluginparams.pluginlib)
+        except ImportError:
+            # reported when the plugin is run
+            return get_default_requirements(pluginparams)
+        
+        if callable(getattr(mod, "get_requirements", None)):
+            return mod.get_requirements(pluginparams)
+        return get_default_requirements(pluginparams)
 
-    def __parse_json(self):
+
+    # description: get the telemetry needed by all enabled plugins in the configuration
+    # returns    : a dictionary with the maximum number of values per second of each
+    #              required channel, 0 for all values, and a set of the channels to decode
+    def __get_requirements(self):
+        xmldoc = minidom.parse(self.__params.configfile)
+        xmlgpt = xmldoc.getElementsByTagName('goprotelemetry')[0]
+        
+        requirements = []
+        for xmlplugin in xmlgpt.getElementsByTagName('plugin'):
+            pluginenabled = self.__get_xml_subtag_value(xmlplugin, 'enabled', 'false')
+            if pluginenabled.lower() == "true":
+                pluginparams = PluginParameters(self.logger)
+                pluginparams.parse_plugin_parameters(xmlplugin)
+                requirements.append(self.__get_plugin_requirements(pluginparams))
+        
+        (samplerates, channels) = merge_requirements(requirements)
+        self.logger.log("Required channels = %s", \
+                        ", ".join([ "%s (%s)" % (tag, "%g/s" % rate if rate > 0 else "all") \
+                                        for (tag, rate) in sorted(samplerates.items()) ]))
+        self.logger.log("Decoded channels = %s", ", ".join(sorted(channels)))
+        
+        return samplerates, channels
+
+
+    # parameters : jsonfile : the json file written by gopro2json
+    #              channels : the channels to keep
+    # returns    : True if successful, the columns and their timestamps
+    def __parse_json(self, jsonfile, channels):
         self.logger.log("Parsing telemetry json")
 
         retval = True
+        columns = None
+        timestamps = {}
         try:
-            with open(self.__telemetryjsonfile) as f:
-                self.__jsondata = json.load(f)
-                self.logger.log("Parsing succeeded")
+            columns = read_json_columns(jsonfile, set(channels) | { 'utc' })
+            # every record has a utc timestamp in microseconds, which is relative to
+            # the first record, gopro2json doesn't provide the time since the start
+            if 'utc' in columns and len(columns['utc']) > 0:
+                utc = np.frombuffer(columns['utc'], dtype = np.float64)
+                utc_timestamps = (utc - utc[0]) / 1000000
+                for tag, values in columns.items():
+                    if len(values) == len(utc_timestamps):
+                        timestamps[tag] = utc_timestamps
+            self.logger.log("Parsing succeeded")
         except json.decoder.JSONDecodeError as e:
             self.logger.error("Parsing failed, error = " + e.msg)
             retval = False
         
-        return retval
+        return retval, columns, timestamps
 
 
+    # description: returns a function converting a numpy array to the configured unit
     def __get_unit_conversion(self, pluginparams):
         conv_func = lambda x: x
         
@@ -141,18 +343,45 @@ class Telemetry:
         return conv_func
 
 
-    # description: returns a list of (value, duration) for a given tagname
+    # description: returns the start and end time of the preview in seconds
+    def __get_preview_window(self):
+        start_time = min(self.__params.preview_start, self.__vp.duration)
+        end_time = min(start_time + self.__params.preview_duration, self.__vp.duration)
+        return start_time, end_time
+
+
+    # description: returns the time ranges in which telemetry is displayed, in preview
+    #              mode relative to the start of the preview, None for always
+    def __get_ranges(self):
+        if self.__params.ranges is None or not self.__params.preview:
+            return self.__params.ranges
+        
+        start_time, end_time = self.__get_preview_window()
+        return [ (r[0] - start_time, r[1] - start_time) for r in self.__params.ranges ]
+
+
+    # description: returns a TelemetrySeries for a given tagname, converted to the
+    #              configured unit, in preview mode clipped to the preview window and
+    #              relative to its start
+    #              a tagname with multiple channels, eg lat,lon, returns a column for
+    #              each channel
     def get_jsondata(self, pluginparams):
-        tagvalues = [ data[pluginparams.jsontag] for data in self.__jsondata['data'] \
-                                                          if pluginparams.jsontag in data ]
-        interval = self.__vp.duration / len(tagvalues)
-        conv_func = self.__get_unit_conversion(pluginparams)
-        retlist = [ (conv_func(value), interval) for value in tagvalues ]
+        channels = pluginparams.get_channels()
+        if len(channels) == 1:
+            series = self.__store.get_series(channels[0])
+        else:
+            series = self.__store.get_multi_series(channels) if channels else None
+        if series is None:
+            self.logger.error("No telemetry data found for tag " + pluginparams.jsontag)
+            return None
         
-        # TODO: optimize: if value doesn't change
-        #       remove the element and modify duration of preceding element
+        if self.__params.preview:
+            start_time, end_time = self.__get_preview_window()
+            series = series.select(start_time, end_time).rebase(start_time)
         
-        return retlist
+        conv_func = self.__get_unit_conversion(pluginparams)
+        
+        return series.convert(conv_func)
 
 
     # description: call function in a given module with given arguments
@@ -180,8 +409,100 @@ class Telemetry:
                       else defaultvalue
 
 
-    def __get_next_chain_filename(self, index):
-        return self.__params.filename + ".filter_" + str(index) + ".mp4"
+    # description: get the source files of modules and of all modules of this program
+    #              they use, directly or through other modules
+    # parameters : modules : a list of modules
+    # returns    : a sorted list of filenames
+    def __get_source_files(self, modules):
+        sourcedir = os.path.dirname(os.path.abspath(__file__))
+        sourcefiles = set()
+        pending = list(modules)
+        while pending:
+            module = pending.pop()
+            filename = os.path.abspath(module.__file__) \
+                            if getattr(module, '__file__', None) else None
+            if not filename or os.path.dirname(filename) != sourcedir or \
+               filename in sourcefiles:
+                continue
+            sourcefiles.add(filename)
+            for value in vars(module).values():
+                name = value.__name__ if inspect.ismodule(value) \
+                                      else getattr(value, '__module__', None)
+                if isinstance(name, str) and name in sys.modules:
+                    pending.append(sys.modules[name])
+        return sorted(sourcefiles)
+
+
+    # description: get a hash of the source of a plugin and of all modules the layer it
+    #              renders depends on, eg the renderer emitting the filters
+    # returns    : the hash, computed once for each plugin
+    def __get_source_hash(self, pluginlib, plugindata):
+        if pluginlib not in self.__sourcehashes:
+            h = hashlib.sha1()
+            for filename in self.__get_source_files([ importlib.import_module(pluginlib), \
+                                                      inspect.getmodule(Renderer), \
+                                                      inspect.getmodule(type(plugindata)) ]):
+                with open(filename, 'rb') as f:
+                    h.update(f.read())
+            self.__sourcehashes[pluginlib] = h.hexdigest()
+        return self.__sourcehashes[pluginlib]
+
+
+    # description: get the key of the layer rendered by a plugin, a hash of the plugin
+    #              configuration, the source of the plugin module and of the modules it
+    #              uses, the telemetry data passed to it and the properties of the video
+    #              a plugin module depending on anything else, eg files, returns a
+    #              description of it with a function get_layer_key(params, jsondata),
+    #              None if its layer can't be cached
+    # returns    : the key, or None if the layer can't be cached
+    def __get_layer_key(self, xmlplugin, pluginparams, plugindata):
+        if not self.__ffmpeg.cache.is_enabled():
+            return None
+        
+        h = hashlib.sha1()
+        h.update(xmlplugin.toxml().encode('utf-8'))
+        try:
+            h.update(self.__get_source_hash(pluginparams.pluginlib, plugindata).encode('utf-8'))
+        except (ImportError, OSError, TypeError):
+            # without the source any change of the plugin would go unnoticed
+            return None
+        h.update(plugindata.timestamps.tobytes())
+        h.update(plugindata.values.tobytes())
+        h.update(("%s:%s:%s:%d:%d:%s" % \
+                    (plugindata.end_time, self.__vp.framerate, self.__vp.duration, \
+                     self.__vp.video_width, self.__vp.video_height, \
+                     self.__params.engine)).encode('utf-8'))
+        
+        mod = importlib.import_module(pluginparams.pluginlib)
+        if callable(getattr(mod, "get_layer_key", None)):
+            pluginkey = mod.get_layer_key(pluginparams, plugindata)
+            if pluginkey is None:
+                return None
+            h.update(pluginkey.encode('utf-8'))
+        
+        return h.hexdigest()
+
+
+    # description: add the layer of a plugin to the renderer, from the cache if the
+    #              plugin, its configuration and its data are unchanged
+    # returns    : True if successful
+    def __add_plugin_layer(self, xmlplugin, pluginparams, plugindata, renderer):
+        key = self.__get_layer_key(xmlplugin, pluginparams, plugindata)
+        if key and renderer.add_layer(pluginparams, \
+                                      self.__ffmpeg.cache.read_json("layer", key)):
+            return True
+        
+        renderer.begin_layer(key)
+        try:
+            retval = self.__call_plugin(pluginparams.pluginlib, "create_filter", \
+                                        pluginparams, plugindata, renderer)
+        finally:
+            layer = renderer.end_layer()
+        
+        if retval and key:
+            self.__ffmpeg.cache.write_json("layer", key, layer)
+        
+        return retval
 
 
     def run_plugins(self):
@@ -191,9 +512,8 @@ class Telemetry:
         xmlpluginlist = xmlgpt.getElementsByTagName('plugin')
         
         retval = True
-        chain_index = 1
-        chain_infilename = self.__params.filename
-        chain_outfilename = self.__get_next_chain_filename(chain_index)
+        renderer = Renderer(self.logger, self.__vp, self.__params.engine, \
+                            self.__ffmpeg.cache, self.__get_ranges())
         for xmlplugin in xmlpluginlist:
             pluginlabel = self.__get_xml_subtag_value(xmlplugin, 'label', '[unnamed]')
             pluginenabled = self.__get_xml_subtag_value(xmlplugin, 'enabled', 'false')
@@ -201,24 +521,53 @@ class Telemetry:
             if pluginenabled.lower() == "true":
                 self.logger.log("Found enabled plugin rendering " + pluginlabel)
                 
-                pluginparams = PluginParameters(self.logger)
-                pluginparams.parse_plugin_parameters(xmlplugin)
-                
-                plugindata = self.get_jsondata(pluginparams)
+                with self.logger.span(pluginlabel, "plugin"):
+                    pluginparams = PluginParameters(self.logger)
+                    pluginparams.parse_plugin_parameters(xmlplugin)
                 
-                retval = self.__call_plugin(pluginparams.pluginlib, "render", \
-                                            pluginparams, plugindata, self.__ffmpeg, \
-                                            chain_infilename, chain_outfilename)
+                    plugindata = self.get_jsondata(pluginparams)
+                    if plugindata is None:
+                        self.logger.error("Skipping plugin rendering " + pluginlabel)
+                        continue
                 
-                if not retval:
-                    break
+                    retval = self.__add_plugin_layer(xmlplugin, pluginparams, plugindata, \
+                                                     renderer)
                 
-                chain_index = chain_index + 1
-                chain_infilename = chain_outfilename
-                chain_outfilename = self.__get_next_chain_filename(chain_index)
+                    if not retval:
+                        break
             else:
                 self.logger.log("Skipping disabled plugin rendering " + pluginlabel)
         
-        if retval and chain_index > 1:
-            os.rename(chain_infilename, self.__outputfile)
-
+        if retval and renderer.has_filters():
+            # chapters are read as one video by the concat demuxer, without re-encoding
+            infilename = self.__params.filename
+            inputparams = []
+            if len(self.__chapters) > 1:
+                f, infilename = renderer.create_tempfile("gpt_renderer_concat", ".list")
+                self.__ffmpeg.write_concat_list(f, self.__chapters)
+                inputparams = self.__ffmpeg.get_concat_input_params()
+            
+            with self.logger.span("render", "render", file = self.__outputfile):
+                if self.__params.preview:
+                    start_time, end_time = self.__get_preview_window()
+                    retval = renderer.run_preview(self.__ffmpeg, infilename, \
+                                                  self.__outputfile, start_time, \
+                                                  end_time - start_time, \
+                                                  self.__params.preview_scale, \
+                                                  self.__params.overwrite, inputparams)
+                elif self.__params.smart:
+                    retval = renderer.run_smart(self.__ffmpeg, infilename, \
+                                                self.__outputfile, self.__params.parallel, \
+                                                self.__params.overwrite, inputparams)
+                elif self.__params.parallel > 1:
+                    retval = renderer.run_parallel(self.__ffmpeg, infilename, \
+                                                   self.__outputfile, self.__params.parallel, \
+                                                   self.__params.overwrite, inputparams)
+                else:
+                    retval = renderer.run(self.__ffmpeg, infilename, \
+                                          self.__outputfile, self.__params.overwrite, \
+                                          inputparams)
+        
+        renderer.cleanup()
+        
+        return retval
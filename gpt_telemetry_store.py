@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+
+# gpt_telemetry_store -- columnar storage of decoded telemetry data
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, array, math
+import numpy as np
+from ffmpeg import FFmpegLogger
+
+# the values of one tag and the time in seconds on which each value starts
+# a value is valid until the timestamp of the next value, the last one until end_time
+# the values of multiple tags sharing their timestamps are a two dimensional array with
+# a column for each tag
+# slicing returns views on the same arrays, no data is copied
+class TelemetrySeries:
+    def __init__(self, timestamps, values, end_time):
+        self.timestamps = timestamps
+        self.values = values
+        self.end_time = end_time
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("TelemetrySeries only supports contiguous slices")
+
+        start, stop, step = key.indices(len(self.values))
+        stop = max(start, stop)
+        end_time = float(self.timestamps[stop]) if stop < len(self.timestamps) \
+                                                else self.end_time
+        return TelemetrySeries(self.timestamps[start:stop], self.values[start:stop], end_time)
+
+
+    # description: get the duration of each value
+    def get_durations(self):
+        return np.diff(self.timestamps, append = self.end_time)
+
+
+    # description: apply a vectorized conversion to all values
+    # parameters : conv_func : function accepting and returning a numpy array
+    # returns    : a new TelemetrySeries sharing the timestamps
+    def convert(self, conv_func):
+        return TelemetrySeries(self.timestamps, conv_func(self.values), self.end_time)
+
+
+    # description: shift the timestamps
+    # parameters : offset : the time in seconds which becomes the new start
+    # returns    : a new TelemetrySeries sharing the values
+    def rebase(self, offset):
+        return TelemetrySeries(self.timestamps - offset, self.values, self.end_time - offset)
+
+
+    # description: get the values between two timestamps
+    # parameters : start_time, end_time : the time window in seconds
+    # returns    : a TelemetrySeries containing the value valid at start_time and all
+    #              values starting before end_time
+    def select(self, start_time, end_time):
+        start = max(0, np.searchsorted(self.timestamps, start_time, side = 'right') - 1)
+        stop = np.searchsorted(self.timestamps, end_time, side = 'left')
+        return TelemetrySeries(self.timestamps[start:stop], self.values[start:stop], \
+                               min(end_time, self.end_time))
+
+
+    # description: get the values at a constant interval, starting at 0
+    # parameters : interval : the time between two values in seconds
+    #              interpolate : interpolate linearly between two values, or else keep
+    #                            each value until the next one
+    #              maxgap : values further apart than this number of seconds are not
+    #                       interpolated, a value is kept at most this long and the rest
+    #                       of the time until the next value becomes a gap, None to keep
+    #                       every value until the next one regardless of the distance
+    # returns    : a new TelemetrySeries, gaps and the time before the first value
+    #              contain NaN
+    def resample(self, interval, interpolate = True, maxgap = None):
+        times = np.arange(math.ceil(self.end_time / interval - 1e-6)) * interval
+        if len(self.values) == 0:
+            return TelemetrySeries(times, np.full(len(times), np.nan), self.end_time)
+
+        indexes = np.searchsorted(self.timestamps, times, side = 'right') - 1
+        previous = np.maximum(indexes, 0)
+        values = self.values[previous]
+        missing = indexes < 0
+
+        connected = np.ones(len(times), dtype = bool)
+        if maxgap is not None:
+            connected = self.get_durations()[previous] <= maxgap
+            missing = missing | (times - self.timestamps[previous] > maxgap)
+        if interpolate:
+            if self.values.ndim == 1:
+                interpolated = np.interp(times, self.timestamps, self.values)
+            else:
+                interpolated = np.column_stack([ np.interp(times, self.timestamps, column) \
+                                                    for column in self.values.T ])
+                connected = connected[:, np.newaxis]
+            values = np.where(connected, interpolated, values)
+
+        values[missing] = np.nan
+
+        return TelemetrySeries(times, values, self.end_time)
+
+
+class TelemetryStore:
+    def __init__(self, logger, duration):
+        self.logger = logger
+        self.duration = duration
+
+        # the values of each tag, in a contiguous float64 array
+        self.__columns = {}
+        # the timestamps of each tag, tags sampled by the same sensor share one array
+        self.__timestamps = {}
+        # evenly spaced timestamps by number of samples
+        self.__even_timestamps = {}
+        # decimated timestamps by the id of the original array and the step, so tags
+        # sharing their timestamps still do after decimation
+        self.__decimated_timestamps = {}
+
+
+    def __get_even_timestamps(self, count):
+        if count not in self.__even_timestamps:
+            self.__even_timestamps[count] = np.arange(count) * (self.duration / count)
+        return self.__even_timestamps[count]
+
+
+    def __decimate_timestamps(self, timestamps, step):
+        key = (id(timestamps), step)
+        if key not in self.__decimated_timestamps:
+            self.__decimated_timestamps[key] = (timestamps, \
+                                                np.ascontiguousarray(timestamps[::step]))
+        return self.__decimated_timestamps[key][1]
+
+
+    # description: add the values of a tag
+    # parameters : tag : the name of the tag
+    #              values : a sequence of numbers, an array.array is used without copying
+    #              timestamps : the start time of each value in seconds, if omitted the
+    #                           values are spread evenly over the video duration
+    #              samplerate : the maximum number of values per second to keep, the
+    #                           others are dropped, 0 to keep all values
+    def add_column(self, tag, values, timestamps = None, samplerate = 0):
+        if isinstance(values, array.array) and values.typecode == 'd':
+            column = np.frombuffer(values, dtype = np.float64)
+        else:
+            column = np.ascontiguousarray(values, dtype = np.float64)
+
+        if len(column) == 0:
+            return
+
+        if timestamps is None:
+            timestamps = self.__get_even_timestamps(len(column))
+
+        if samplerate > 0 and self.duration > 0:
+            step = int(len(column) / self.duration / samplerate)
+            if step > 1:
+                self.logger.log("Keeping 1 of %d values of %s", step, tag)
+                column = np.ascontiguousarray(column[::step])
+                timestamps = self.__decimate_timestamps(timestamps, step)
+
+        self.__columns[tag] = column
+        self.__timestamps[tag] = timestamps
+
+
+    def has_tag(self, tag):
+        return tag in self.__columns
+
+
+    def get_tags(self):
+        return list(self.__columns.keys())
+
+
+    # description: get all values of a tag
+    # returns    : a TelemetrySeries, or None if the tag is not available
+    def get_series(self, tag):
+        if tag not in self.__columns:
+            return None
+        return TelemetrySeries(self.__timestamps[tag], self.__columns[tag], self.duration)
+
+
+    # description: get all values of multiple tags, eg lat and lon
+    #              tags with other timestamps than the first tag are interpolated on the
+    #              timestamps of the first tag
+    # returns    : a TelemetrySeries with a column for each tag, or None if any tag is
+    #              not available
+    def get_multi_series(self, tags):
+        if not all([ tag in self.__columns for tag in tags ]):
+            return None
+
+        timestamps = self.__timestamps[tags[0]]
+        columns = [ self.__columns[tag] if self.__timestamps[tag] is timestamps \
+                        else np.interp(timestamps, self.__timestamps[tag], self.__columns[tag]) \
+                    for tag in tags ]
+        return TelemetrySeries(timestamps, np.column_stack(columns), self.duration)
+
+
+
+# description: distance travelled in meters since the first position
+def calculate_distance(timestamps, lat, lon):
+    lat = np.radians(np.asarray(lat, dtype = np.float64))
+    lon = np.radians(np.asarray(lon, dtype = np.float64))
+    # haversine formula on a sphere with the mean radius of the earth
+    a = np.sin(np.diff(lat) / 2) ** 2 + \
+        np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    steps = 2 * 6371008.8 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return np.concatenate(([ 0.0 ], np.cumsum(steps)))
+
+
+# description: length of a vector given by its components
+def calculate_magnitude(timestamps, *axes):
+    return np.sqrt(sum([ np.asarray(axis, dtype = np.float64) ** 2 for axis in axes ]))
+
+
+# description: vertical speed in meters per second
+def calculate_vertical_speed(timestamps, alt):
+    alt = np.asarray(alt, dtype = np.float64)
+    durations = np.diff(timestamps)
+    speed = np.divide(np.diff(alt), durations, out = np.zeros(len(durations)), \
+                      where = durations > 0)
+    return np.concatenate(([ 0.0 ], speed))
+
+
+# channels calculated from decoded channels, the name of each derived channel with the
+# channels it is calculated from and the function calculating it, which is called with
+# the timestamps of the first channel followed by the values of each channel
+derived_channels = { 'distance': ([ 'lat', 'lon' ], calculate_distance), \
+                     'vspd': ([ 'alt' ], calculate_vertical_speed), \
+                     'accl': ([ 'accl_x', 'accl_y', 'accl_z' ], calculate_magnitude), \
+                     'gyro': ([ 'gyro_x', 'gyro_y', 'gyro_z' ], calculate_magnitude) }
+
+
+# description: add derived channels to decoded columns
+# parameters : columns : a dictionary of column names and their values
+#              timestamps : a dictionary of column names and their timestamps
+#              tags : the derived channels to add, see derived_channels, channels of
+#                     which the source channels are missing are not added
+def derive_columns(columns, timestamps, tags):
+    for tag in tags:
+        (sources, derive_func) = derived_channels[tag]
+        if all([ source in columns and len(columns[source]) > 0 for source in sources ]) and \
+           len(set([ len(columns[source]) for source in sources ])) == 1:
+            times = timestamps.get(sources[0])
+            if times is None:
+                times = np.arange(len(columns[sources[0]]), dtype = np.float64)
+            columns[tag] = derive_func(times, *[ columns[source] for source in sources ])
+            if sources[0] in timestamps:
+                timestamps[tag] = timestamps[sources[0]]
+
+
+
+# description: join the columns of consecutive chapters of a video
+# parameters : chapters : a list of (columns, timestamps, duration) for each chapter
+#                         columns without timestamps are spread evenly over the chapter
+# returns    : the joined columns and their timestamps, which continue from the end
+#              of the previous chapter, columns sharing their timestamps in every
+#              chapter also share the joined timestamps
+def stitch_columns(chapters):
+    tags = []
+    for (columns, timestamps, duration) in chapters:
+        tags = tags + [ tag for tag in columns if tag not in tags ]
+
+    stitched_columns = {}
+    stitched_timestamps = {}
+    shared = {}
+    for tag in tags:
+        values = [ np.asarray(columns.get(tag, []), dtype = np.float64) \
+                        for (columns, timestamps, duration) in chapters ]
+        stitched_columns[tag] = np.concatenate(values)
+
+        key = tuple([ id(timestamps[tag]) if tag in timestamps else len(v) \
+                        for ((columns, timestamps, duration), v) in zip(chapters, values) ])
+        if key not in shared:
+            offset = 0.0
+            times = []
+            for ((columns, timestamps, duration), v) in zip(chapters, values):
+                if tag in timestamps:
+                    times.append(np.asarray(timestamps[tag], dtype = np.float64) + offset)
+                else:
+                    times.append(offset + np.arange(len(v)) * (duration / max(1, len(v))))
+                offset = offset + duration
+            shared[key] = np.concatenate(times)
+        stitched_timestamps[tag] = shared[key]
+
+    return stitched_columns, stitched_timestamps
+
+
+# description: write decoded columns to a file
+# parameters : filename : the file to write, in numpy .npz format
+#              columns : a dictionary of column names and their values
+#              timestamps : a dictionary of column names and their timestamps, columns
+#                           sharing the same array of timestamps only store it once
+def write_columns(filename, columns, timestamps = {}):
+    arrays = {}
+    shared = []
+    stored = {}
+    for tag, values in columns.items():
+        arrays['values/' + tag] = np.asarray(values, dtype = np.float64)
+        if tag in timestamps:
+            if id(timestamps[tag]) in stored:
+                shared.append(tag + '=' + stored[id(timestamps[tag])])
+            else:
+                arrays['timestamps/' + tag] = np.asarray(timestamps[tag], dtype = np.float64)
+                stored[id(timestamps[tag])] = tag
+    arrays['shared'] = np.array(shared, dtype = str)
+
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+# description: read columns written by write_columns()
+# returns    : a dictionary of column names and numpy arrays and a dictionary of
+#              column names and their timestamps
+def read_columns(filename):
+    columns = {}
+    timestamps = {}
+    with np.load(filename) as data:
+        for name in data.files:
+            if name.startswith('values/'):
+                columns[name[len('values/'):]] = data[name]
+            elif name.startswith('timestamps/'):
+                timestamps[name[len('timestamps/'):]] = data[name]
+        for reference in data['shared'].tolist():
+            (tag, sharedtag) = reference.split('=', 1)
+            timestamps[tag] = timestamps[sharedtag]
+    return columns, timestamps
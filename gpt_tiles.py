@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# gpt_tiles -- read map tiles from a local tile directory or MBTiles file
+# Copyright (C) 2018  Roel Derickx <roel.derickx AT gmail>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, io, math, sqlite3, hashlib, collections
+import numpy as np
+from ffmpeg import FFmpegLogger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# description: convert a GPS position to pixel coordinates in the web mercator
+#              projection used by map tiles
+# parameters : lat, lon : the position in degrees, numbers or numpy arrays
+#              zoom : the zoom level of the tiles
+#              tilesize : the size of a tile in pixels
+# returns    : the x and y coordinate in pixels from the top left corner of the world
+def project(lat, lon, zoom, tilesize = 256):
+    scale = tilesize * 2 ** zoom
+    x = (lon + 180.0) / 360.0 * scale
+    lat = np.radians(lat)
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * scale
+    return x, y
+
+
+
+# Reads map tiles without network access, either from a directory containing the tiles
+# as zoom/x/y.png (the layout of most tile servers and tile downloaders) or from an
+# MBTiles file. Decoded tiles are kept in a least recently used cache of a fixed number
+# of tiles, so the memory use doesn't depend on the size of the map.
+class TileSource:
+    tilesize = 256
+    # maximum number of decoded tiles in memory
+    cachesize = 64
+    # image formats of the tiles in a directory
+    extensions = [ "png", "jpg", "jpeg", "webp" ]
+
+    def __init__(self, logger, path):
+        if Image is None:
+            raise Exception("Map tiles require the Python Imaging Library (Pillow)")
+
+        self.logger = logger
+        self.path = path
+
+        self.__tiles = collections.OrderedDict()
+        self.__connection = None
+        if os.path.isfile(path):
+            # read only, an MBTiles file may be shared with other applications
+            self.__connection = sqlite3.connect("file:" + os.path.abspath(path) + "?mode=ro", \
+                                                uri = True)
+            row = self.__connection.execute( \
+                        "SELECT value FROM metadata WHERE name = 'format'").fetchone()
+            if row and row[0] == "pbf":
+                self.close()
+                raise Exception("Vector tiles are not supported: " + path)
+        elif not os.path.isdir(path):
+            raise Exception("Tile directory or MBTiles file not found: " + path)
+
+        self.logger.log("Reading map tiles from %s", path)
+
+
+    # description: get a description of a number of tiles which changes when any of them
+    #              changes, to be used in cache keys
+    # parameters : zoom : the zoom level
+    #              tiles : a list of the column and row of each tile
+    # returns    : a string, for a directory derived from the path, size and
+    #              modification time of each tile file, since adding or replacing a
+    #              tile doesn't change the directory itself
+    def get_identity(self, zoom, tiles):
+        if self.__connection:
+            stat = os.stat(self.path)
+            return "%s:%d:%d" % (os.path.abspath(self.path), stat.st_size, stat.st_mtime_ns)
+
+        h = hashlib.sha1()
+        for (x, y) in tiles:
+            filename = self.__find_file(zoom, x % 2 ** zoom, y)
+            stat = os.stat(filename) if filename else None
+            h.update(("%d/%d/%d:%s:%d:%d;" % \
+                        (zoom, x, y, filename, stat.st_size if stat else 0, \
+                         stat.st_mtime_ns if stat else 0)).encode('utf-8'))
+        return "%s:%s" % (os.path.abspath(self.path), h.hexdigest())
+
+
+    def __find_file(self, zoom, x, y):
+        for extension in self.extensions:
+            filename = os.path.join(self.path, str(zoom), str(x), "%d.%s" % (y, extension))
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+
+    def __read_file(self, zoom, x, y):
+        filename = self.__find_file(zoom, x, y)
+        if filename:
+            with open(filename, 'rb') as f:
+                return f.read()
+        return None
+
+
+    def __read_mbtiles(self, zoom, x, y):
+        # MBTiles numbers the rows from the bottom (TMS)
+        row = self.__connection.execute( \
+                    "SELECT tile_data FROM tiles " \
+                    "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", \
+                    (zoom, x, 2 ** zoom - 1 - y)).fetchone()
+        return row[0] if row else None
+
+
+    # description: get a tile
+    # parameters : zoom : the zoom level
+    #              x, y : the column and row of the tile, x wraps around the world
+    # returns    : an RGBA image, or None if the tile is not available
+    def get_tile(self, zoom, x, y):
+        x = x % 2 ** zoom
+        if y < 0 or y >= 2 ** zoom:
+            return None
+
+        key = (zoom, x, y)
+        if key in self.__tiles:
+            self.__tiles.move_to_end(key)
+            return self.__tiles[key]
+
+        data = self.__read_mbtiles(zoom, x, y) if self.__connection \
+                                               else self.__read_file(zoom, x, y)
+        tile = None
+        if data:
+            try:
+                tile = Image.open(io.BytesIO(data)).convert('RGBA')
+                if tile.size != (self.tilesize, self.tilesize):
+                    tile = tile.resize((self.tilesize, self.tilesize))
+            except OSError as e:
+                self.logger.log("Could not decode tile %d/%d/%d, error = %s", \
+                                zoom, x, y, str(e))
+
+        self.__tiles[key] = tile
+        if len(self.__tiles) > self.cachesize:
+            self.__tiles.popitem(last = False)
+        return tile
+
+
+    def close(self):
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+        self.__tiles.clear()